@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from sqlalchemy import engine_from_config, pool
 
 from backend.db.base import Base
+from backend.db.models import outbox, users  # noqa: F401 (register the tables)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -0,0 +1,68 @@
+"""baseline: users and email outbox tables
+
+Revision ID: 4f1c2a9d7e10
+Revises:
+Create Date: 2022-04-12 10:00:00.000000
+
+Databases created before migrations were used (tables created by the application
+at startup) are already at this revision:
+
+    alembic -c backend/alembic.ini stamp 4f1c2a9d7e10
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4f1c2a9d7e10"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("is_verified", sa.Boolean(), nullable=True),
+        sa.Column("is_validation_mail_send", sa.Boolean(), nullable=True),
+        sa.Column("validation_date", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_id", "users", ["id"], unique=False)
+
+    op.create_table(
+        "emailoutbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("email_to", sa.String(), nullable=False),
+        sa.Column("subject", sa.String(), nullable=False),
+        sa.Column("template", sa.String(), nullable=False),
+        sa.Column("environment", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_emailoutbox_id", "emailoutbox", ["id"], unique=False)
+    op.create_index(
+        "ix_emailoutbox_status_next_attempt",
+        "emailoutbox",
+        ["status", "next_attempt_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_emailoutbox_status_next_attempt", table_name="emailoutbox")
+    op.drop_index("ix_emailoutbox_id", table_name="emailoutbox")
+    op.drop_table("emailoutbox")
+    op.drop_index("ix_users_id", table_name="users")
+    op.drop_index("ix_users_email", table_name="users")
+    op.drop_table("users")
@@ -0,0 +1,32 @@
+"""users: case-insensitive unique email
+
+Revision ID: 9b2e6d4c1a35
+Revises: 4f1c2a9d7e10
+Create Date: 2022-04-12 11:00:00.000000
+
+Existing emails are lowercased first. The upgrade fails if two accounts only
+differ by the case of their email: they have to be merged by hand beforehand.
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9b2e6d4c1a35"
+down_revision = "4f1c2a9d7e10"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE users SET email = lower(email) WHERE email <> lower(email)")
+    op.create_index(
+        "ix_users_email_lower", "users", [sa.text("lower(email)")], unique=True
+    )
+    # Lookups and conflicts go through lower(email), the plain index is redundant
+    op.drop_index("ix_users_email", table_name="users")
+
+
+def downgrade():
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.drop_index("ix_users_email_lower", table_name="users")
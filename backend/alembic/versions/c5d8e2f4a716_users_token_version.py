@@ -0,0 +1,26 @@
+"""users: token version
+
+Revision ID: c5d8e2f4a716
+Revises: 9b2e6d4c1a35
+Create Date: 2022-04-20 10:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c5d8e2f4a716"
+down_revision = "9b2e6d4c1a35"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column("token_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_column("users", "token_version")
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from backend.api.v1 import route_auth, route_users
+from backend.api.v1 import route_auth, route_internal, route_users
 from backend.core.configs import settings
 
 api_router = APIRouter()
@@ -11,3 +11,6 @@ api_router.include_router(
 api_router.include_router(
     route_auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Login"]
 )
+api_router.include_router(
+    route_internal.router, prefix=f"{settings.API_V1_STR}/internal", tags=["Internal"]
+)
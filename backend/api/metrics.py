@@ -0,0 +1,77 @@
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import APIRouter, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from backend.core.metrics import (
+    CONTENT_TYPE,
+    RequestDatabaseStats,
+    db_request_duration_seconds,
+    db_request_queries,
+    http_request_duration_seconds,
+    http_requests_total,
+    registry,
+    request_database_stats,
+)
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def retrieve_metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    Time the HTTP requests and count their database queries, by route.
+
+    Requests are labelled by route template (/users/get/{id}), not by path, so
+    the number of series stays bounded. Pure ASGI: responses aren't buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.route_templates: Optional[Dict[Callable, str]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestDatabaseStats()
+        token = request_database_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_database_stats.reset(token)
+            route = self.route_template(scope)
+            method = scope["method"]
+            http_requests_total.inc(method=method, route=route, status=str(status_code))
+            http_request_duration_seconds.observe(elapsed, method=method, route=route)
+            db_request_queries.observe(stats.queries, route=route)
+            db_request_duration_seconds.observe(stats.seconds, route=route)
+
+    def route_template(self, scope: Scope) -> str:
+        # The router adds the matched endpoint to the (shared) scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self.route_templates is None:
+            self.route_templates = {
+                route.endpoint: route.path
+                for route in scope["router"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self.route_templates.get(endpoint, "unmatched")
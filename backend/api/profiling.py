@@ -0,0 +1,58 @@
+import cProfile
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from backend.core.profiling import RequestProfiler, request_profiler
+
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+
+class ProfilingMiddleware:
+    """
+    Profile the selected requests with cProfile, see RequestProfiler. The
+    profile id is returned in the X-Profile-Id header, the profile itself is
+    served by /internal/profiles/{profile_id}.
+
+    Only installed when PROFILING_ENABLED, it costs nothing otherwise.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: RequestProfiler = request_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_TOKEN_HEADER:
+                token = value.decode("latin-1")
+                break
+        if not self.profiler.should_profile(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER, profile_id.encode())
+                ]
+            await send(message)
+
+        self.profiler.running = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.disable()
+            self.profiler.running = False
+            self.profiler.profiled += 1
+            await run_in_threadpool(self.profiler.store.save, profile, profile_id)
@@ -1,32 +1,46 @@
 import logging
-import os
-import random
+import secrets
 import string
-from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Any, Dict, Optional
+import uuid
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
 
-import emails
-from emails.template import JinjaTemplate
-from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi import Depends, Header, HTTPException, Request, Response, status
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
-from fastapi.security.oauth2 import OAuth2
+from fastapi.security.oauth2 import OAuth2, OAuth2PasswordRequestForm
 from fastapi.security.utils import get_authorization_scheme_param
-from jose import jwt
 from jose.exceptions import JWTError
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
 
 from backend.core.configs import settings
+from backend.core.email_templates import email_templates
+from backend.core.metrics import email_send_duration_seconds
+from backend.core.principal_cache import principal_cache
+from backend.core.profiling import is_valid_profiling_token
+from backend.core.rate_limit import (
+    login_email_limiter,
+    login_ip_limiter,
+    register_email_limiter,
+    register_ip_limiter,
+)
+from backend.core.revocation import token_denylist
 from backend.core.security import decode_jwt, generate_jwt
+from backend.core.verification import new_verification_id
+from backend.db.models.outbox import EmailOutbox
 from backend.db.models.users import Users
-from backend.db.repository.users import get_user_by_email
-from backend.db.session import get_db
-from backend.schemas.token import Token
+from backend.db.repository.users import update_password_hash
+from backend.db.session import AsyncSessionLocal
+from backend.schemas.token import CurrentPrincipal, Token
+from backend.schemas.users import UserCreate
+
+# 'type' claim of the tokens
+ACCESS_TOKEN_TYPE = "login"
+REFRESH_TOKEN_TYPE = "refresh"
+REFRESH_COOKIE_PATH = f"{settings.API_V1_STR}/auth"
 
 
 def generate_random_code(size: int = 4) -> str:
-    return "".join(random.choices(string.ascii_uppercase, k=size))
+    return "".join(secrets.choice(string.ascii_uppercase) for _ in range(size))
 
 
 def create_token(data: Dict, response: Response, expire_minute: int):
@@ -41,6 +55,8 @@ def create_token(data: Dict, response: Response, expire_minute: int):
         Token: JW Token
     """
     access_token_expire = timedelta(minutes=expire_minute)
+    # Unique token id, to revoke the token (logout)
+    data = {"jti": uuid.uuid4().hex, **data}
     access_token = generate_jwt(data=data, expires_delta=access_token_expire)
 
     # Store access token as cookies, activate httponly for more safety
@@ -51,29 +67,54 @@ def create_token(data: Dict, response: Response, expire_minute: int):
     return Token(access_token=access_token, token_type="bearer")
 
 
-def generate_code_verification_token(code: str, email: str) -> str:
-    """
-    Generate a JWT containing the code, mail and expire time, for email verification
+def access_token_claims(user: Users) -> Dict[str, Any]:
+    """Authorizations of the user, trusted until the access token expires"""
+    return {
+        "sub": user.email,
+        "type": ACCESS_TOKEN_TYPE,
+        "uid": user.id,
+        "is_active": user.is_active,
+        "is_verified": user.is_verified,
+        "ver": user.token_version,
+    }
+
+
+def create_session_tokens(user: Users, response: Response) -> Token:
+    """Short-lived access token and refresh token of a user, also set as cookies
+
+    Args:
+        user (Users): authenticated user
+        response (Response): FastAPI Response
+
+    Returns:
+        Token: access and refresh tokens
     """
-    delta = timedelta(hours=settings.JWT_EMAIL_TOKEN_EXPIRE_MINUTES)
-    now = datetime.utcnow()
-    expires = now + delta
-    exp = expires.timestamp()
-
-    encoded_jwt = jwt.encode(
-        {"exp": exp, "nbf": now, "sub": code, "email": email},
-        key=settings.JWT_SECRET_KEY,
-        algorithm=settings.JWT_ALGORITHM,
+    token = create_token(
+        data=access_token_claims(user),
+        response=response,
+        expire_minute=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES,
+    )
+    token.refresh_token = generate_jwt(
+        data={
+            "jti": uuid.uuid4().hex,
+            "sub": user.email,
+            "type": REFRESH_TOKEN_TYPE,
+            "uid": user.id,
+            "ver": user.token_version,
+        },
+        expires_delta=timedelta(minutes=settings.JWT_REFRESH_TOKEN_EXPIRE_MINUTES),
     )
-    return encoded_jwt
+    # Only sent to the authentication endpoints
+    response.set_cookie(
+        key="refresh_token",
+        value=token.refresh_token,
+        httponly=True,
+        path=REFRESH_COOKIE_PATH,
+    )
+    return token
 
 
-def send_email(
-    email_to: str,
-    subject_template: str = "",
-    html_template: str = "",
-    environment: Dict[str, Any] = {},
-) -> None:
+def get_smtp_options() -> Dict[str, Any]:
 
     smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
     if not settings.EMAILS_ENABLED:
@@ -81,54 +122,119 @@ def send_email(
     if not smtp_options.get("host"):
         raise ValueError("Invalid SMTP hostname")
 
-    message = emails.Message(
-        subject=JinjaTemplate(subject_template),
-        html=JinjaTemplate(html_template),
-        mail_from=(settings.MAIL_FROM_NAME, settings.MAIL_FROM),
-    )
     if settings.SMTP_TLS:
         smtp_options["tls"] = True
     if settings.SMTP_USERNAME:
         smtp_options["user"] = settings.SMTP_USERNAME
     if settings.SMTP_PASSWORD:
         smtp_options["password"] = settings.SMTP_PASSWORD
+    return smtp_options
+
 
-    response = message.send(to=email_to, render=environment, smtp=smtp_options)
+def send_email(
+    email_to: str,
+    subject_template: str = "",
+    html_template: str = "",
+    environment: Dict[str, Any] = {},
+) -> None:
+
+    # Imported on first use: workers which never send emails don't load it
+    import emails
+    from emails.template import JinjaTemplate
+
+    smtp_options = get_smtp_options()
+
+    message = emails.Message(
+        subject=JinjaTemplate(subject_template),
+        html=JinjaTemplate(html_template),
+        mail_from=(settings.MAIL_FROM_NAME, settings.MAIL_FROM),
+    )
+
+    with email_send_duration_seconds.time():
+        response = message.send(to=email_to, render=environment, smtp=smtp_options)
     logging.info(f"send email result: {response}")
     return response
 
 
-def send_verification_email(email_to: str, verification_code: str) -> None:
+def send_rendered_email(email_to: str, subject: str, html: str):
+    """
+    Send an email which is already rendered, see backend.core.email_templates
+    """
+    import emails
 
-    project_name = settings.PROJECT_TITLE
-    subject = f"{project_name} - Activate your account"
+    smtp_options = get_smtp_options()
 
-    BASE_DIR = os.path.dirname(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    message = emails.Message(
+        subject=subject,
+        html=html,
+        mail_from=(settings.MAIL_FROM_NAME, settings.MAIL_FROM),
     )
-    template_filepath = os.path.join(BASE_DIR, settings.EMAIL_TEMPLATES_DIR)
 
-    with open(Path(template_filepath) / "new_account.html") as f:
-        template_str = f.read()
+    with email_send_duration_seconds.time():
+        response = message.send(to=email_to, smtp=smtp_options)
+    logging.info(f"send email result: {response}")
+    return response
+
 
-    # Generate token
-    verify_token = generate_code_verification_token(
-        code=verification_code, email=email_to
-    )
-    link = f"{settings.APPS_HOST}{settings.API_V1_STR}/verify/{verify_token}"
+def build_verification_email(email_to: str, verification_code: str) -> EmailOutbox:
+    """Build the account activation email, to be queued in the emails outbox
+
+    The verification itself has to be saved in the verification store, see
+    verification_of, once the user is created.
+
+    Args:
+        email_to (str): new user email address
+        verification_code (str): code the user has to enter
+
+    Returns:
+        EmailOutbox: email to send, its activation link is in environment["link"]
+            and the verification id in environment["verification_id"]
+    """
+    project_name = settings.PROJECT_TITLE
+    subject = f"{project_name} - Activate your account"
+
+    # An opaque id: the code is only known by the store and the email
+    verification_id = new_verification_id()
+    link = f"{settings.APPS_HOST}{settings.API_V1_STR}/users/verify/{verification_id}"
 
-    send_email(
+    return EmailOutbox(
         email_to=email_to,
-        subject_template=subject,
-        html_template=template_str,
+        subject=subject,
+        template="new_account.html",
         environment={
             "project_name": settings.PROJECT_TITLE,
             "verification_code": verification_code,
+            "verification_id": verification_id,
             "email": email_to,
             "link": link,
         },
     )
-    return link
+
+
+def verification_of(email: EmailOutbox, user_id: int) -> Tuple[str, int, str]:
+    """Verification to save for a user, from its activation email"""
+    return (
+        email.environment["verification_id"],
+        user_id,
+        email.environment["verification_code"],
+    )
+
+
+def send_outbox_email(email: EmailOutbox):
+    return send_rendered_email(
+        email_to=email.email_to,
+        subject=email_templates.render_string(email.subject, email.environment),
+        html=email_templates.render(email.template, email.environment),
+    )
+
+
+def send_verification_email(email_to: str, verification_code: str) -> None:
+
+    email = build_verification_email(
+        email_to=email_to, verification_code=verification_code
+    )
+    send_outbox_email(email)
+    return email.environment["link"]
 
 
 class OAuth2PasswordBearerWithCookie(OAuth2):
@@ -184,20 +290,135 @@ oauth2_scheme = OAuth2PasswordBearerWithCookie(
 )
 
 
-def get_current_user_from_token(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-) -> Users:
+async def get_token_claims(
+    token: str, token_type: str = ACCESS_TOKEN_TYPE
+) -> Dict[str, Any]:
+    """Claims of a valid access (or refresh) token, which wasn't revoked"""
+    # Decoded claims are cached, so most requests don't check the JWT signature
+    payload = principal_cache.get_claims(token)
+    if payload is None:
+        try:
+            payload = decode_jwt(token_string=token)
+
+        except (JWTError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credential",
+            )
+        principal_cache.set_claims(token, payload)
+
+    if payload.get("type") != token_type:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credential",
+        )
 
-    try:
-        payload = decode_jwt(token_string=token)
+    # Checked in memory, see TokenDenylist. Tokens issued without a 'jti' can't
+    # be revoked, they just expire. Refresh tokens are single use instead, see
+    # refresh_token_store
+    jti = payload.get("jti")
+    if (
+        jti
+        and token_type == ACCESS_TOKEN_TYPE
+        and await token_denylist.is_revoked(jti, payload["exp"])
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Token has been revoked",
+        )
+    return payload
 
-    except (JWTError, ValidationError):
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+) -> CurrentPrincipal:
+    """
+    Authenticated user from its access token claims alone, without a database
+    round trip. Authorizations changes are seen once the token is refreshed.
+    """
+    payload = await get_token_claims(token)
+    try:
+        return CurrentPrincipal(
+            id=payload["uid"],
+            email=payload["sub"],
+            is_active=payload["is_active"],
+            is_verified=payload["is_verified"],
+        )
+    except (KeyError, ValidationError):
+        # Issued before the authorization claims: the user has to log in again
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credential",
         )
-    user = get_user_by_email(email=payload.get("sub"), db=db)
 
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+
+async def get_current_verified_principal(
+    principal: CurrentPrincipal = Depends(get_current_principal),
+) -> CurrentPrincipal:
+    # If the user access rules were implemented, here we should have to check the
+    # current user access right. For now, only verified users have these rights.
+    if not principal.is_verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only verified user can perform this action",
+        )
+    return principal
+
+
+async def get_bulk_register_principal(
+    principal: CurrentPrincipal = Depends(get_current_verified_principal),
+) -> CurrentPrincipal:
+    """Verified user listed in BULK_REGISTER_ALLOWED_EMAILS"""
+    if principal.email.lower() not in settings.BULK_REGISTER_ALLOWED_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed to register users in bulk",
+        )
+    return principal
+
+
+async def require_internal_token(
+    x_profile_token: Optional[str] = Header(None),
+) -> None:
+    """
+    Internal endpoints (statistics, profiling) are for the operators, who sign
+    an X-Profile-Token with the JWT keys, see generate_profiling_token
+    """
+    if not x_profile_token or not is_valid_profiling_token(x_profile_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Missing or invalid X-Profile-Token header",
+        )
+
+
+async def rehash_password(user_id: int, hashed_password: str) -> None:
+    """Save a password hash updated at login, once the response is sent"""
+    async with AsyncSessionLocal() as db:
+        await update_password_hash(
+            user_id=user_id, hashed_password=hashed_password, db=db
+        )
+
+
+def get_client_ip(request: Request) -> Optional[str]:
+    # Behind a proxy, run uvicorn with --proxy-headers to get the real client
+    return request.client.host if request.client else None
+
+
+async def rate_limit_login(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+) -> None:
+    """Reject abusive clients before any password verification"""
+    await login_ip_limiter.check(get_client_ip(request))
+    await login_email_limiter.check(form_data.username.lower())
+
+
+async def rate_limit_register(request: Request, user_in: UserCreate) -> None:
+    """Reject abusive clients before any password hashing or database access"""
+    # 'user_in' is the body of the registration endpoint, parsed once for both
+    await register_ip_limiter.check(get_client_ip(request))
+    await register_email_limiter.check(user_in.email)
+
+
+async def rate_limit_bulk_register(request: Request) -> None:
+    """A bulk registration counts as a registration from its client"""
+    await register_ip_limiter.check(get_client_ip(request))
@@ -1,26 +1,57 @@
-from typing import Any
+from functools import partial
+from typing import Any, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Cookie,
+    Depends,
+    Form,
+    HTTPException,
+    Response,
+    status,
+)
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.api.utils import create_token
-from backend.core.configs import settings
-from backend.db.repository.users import authenticate
-from backend.db.session import get_db
+from backend.api.utils import (
+    REFRESH_COOKIE_PATH,
+    REFRESH_TOKEN_TYPE,
+    create_session_tokens,
+    get_token_claims,
+    oauth2_scheme,
+    rate_limit_login,
+    rehash_password,
+)
+from backend.core.keyring import jwt_keyring
+from backend.core.revocation import refresh_token_store, token_denylist
+from backend.db.repository.users import authenticate, get_user_by_id
+from backend.db.session import get_async_db
 from backend.schemas.token import Token
 
 router = APIRouter()
 
 
-@router.post("/access-token", response_model=Token, description="Authentification")
+@router.post(
+    "/access-token",
+    response_model=Token,
+    description="Authentification",
+    dependencies=[Depends(rate_limit_login)],
+)
 async def login_for_access_token(
     response: Response,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     # 'OAuth2PasswordRequestForm' object has no attribute 'email', so we used username file as email field
-    user = authenticate(email=form_data.username, password=form_data.password, db=db)
+    # An outdated password hash is updated after the response
+    user = await authenticate(
+        email=form_data.username,
+        password=form_data.password,
+        db=db,
+        rehash=partial(background_tasks.add_task, rehash_password),
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -31,11 +62,77 @@ async def login_for_access_token(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This email address isn't active, please contact your admin",
         )
-    token_data = {"sub": user.email, "type": "login"}
 
-    access_token = create_token(
-        data=token_data,
-        response=response,
-        expire_minute=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES,
-    )
-    return access_token
+    return create_session_tokens(user, response)
+
+
+@router.post(
+    "/refresh",
+    response_model=Token,
+    description="New access and refresh tokens, from the refresh token (cookie or "
+    "form field). A refresh token is used once.",
+)
+async def refresh_access_token(
+    response: Response,
+    refresh_token: Optional[str] = Form(None),
+    refresh_token_cookie: Optional[str] = Cookie(None, alias="refresh_token"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    token = refresh_token or refresh_token_cookie
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
+        )
+    payload = await get_token_claims(token, token_type=REFRESH_TOKEN_TYPE)
+    # Marked as used at once: of concurrent refreshes, a single one gets tokens
+    if not await refresh_token_store.use(payload["jti"], payload["exp"]):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Refresh token already used",
+        )
+
+    # The only lookup of the session: authorizations are read again, and a
+    # password change or a deactivation ends the session
+    user = await get_user_by_id(user_id=payload["uid"], db=db)
+    if not user or not user.is_active or user.token_version != payload["ver"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expired, please log in again",
+        )
+    return create_session_tokens(user, response)
+
+
+@router.post("/logout", description="Revoke the access token, and clear its cookie")
+async def logout(
+    response: Response,
+    token: str = Depends(oauth2_scheme),
+    refresh_token: Optional[str] = Cookie(None),
+):
+    payload = await get_token_claims(token)
+    if payload.get("jti"):
+        await token_denylist.revoke(payload["jti"], payload["exp"])
+
+    # The refresh token of the session, if still valid
+    if refresh_token:
+        try:
+            refresh_payload = await get_token_claims(
+                refresh_token, token_type=REFRESH_TOKEN_TYPE
+            )
+        except HTTPException:
+            pass
+        else:
+            await refresh_token_store.use(
+                refresh_payload["jti"], refresh_payload["exp"]
+            )
+
+    response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token", path=REFRESH_COOKIE_PATH)
+    return {"detail": "Successfully logged out"}
+
+
+@router.get(
+    "/jwks.json",
+    description="Public keys verifying the tokens (JWK Set), without the secrets",
+)
+async def jwks():
+    return jwt_keyring.jwks()
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+
+from backend.api.utils import require_internal_token
+from backend.core.configs import settings
+from backend.core.hashing import hashing_service
+from backend.core.principal_cache import principal_cache
+from backend.core.profiling import request_profiler
+from backend.core.revocation import token_denylist
+from backend.db.pool import get_pool_stats
+from backend.schemas.profiling import ProfilingUpdate
+
+router = APIRouter(dependencies=[Depends(require_internal_token)])
+
+
+@router.get("/pool", description="Connection pools statistics of this worker")
+async def retrieve_pool_stats():
+    return get_pool_stats()
+
+
+@router.get("/hashing", description="Password hashing statistics of this worker")
+async def retrieve_hashing_stats():
+    return hashing_service.snapshot()
+
+
+@router.get("/auth-cache", description="Decoded token claims cache statistics")
+async def retrieve_auth_cache_stats():
+    return principal_cache.snapshot()
+
+
+@router.get("/token-denylist", description="Revoked tokens denylist statistics")
+async def retrieve_token_denylist_stats():
+    return token_denylist.snapshot()
+
+
+@router.get("/profiling", description="Requests profiling settings of this worker")
+async def retrieve_profiling():
+    return request_profiler.snapshot()
+
+
+@router.put(
+    "/profiling",
+    description="Profile all the requests, or a sample of them, in this worker",
+)
+async def update_profiling(profiling_in: ProfilingUpdate):
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiling is disabled, see PROFILING_ENABLED",
+        )
+    if profiling_in.profile_all is not None:
+        request_profiler.profile_all = profiling_in.profile_all
+    if profiling_in.sample_rate is not None:
+        request_profiler.sample_rate = profiling_in.sample_rate
+    return request_profiler.snapshot()
+
+
+@router.get("/profiles/{profile_id}", description="Download a pstats profile")
+async def retrieve_profile(profile_id: str):
+    path = request_profiler.store.path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profile '{profile_id}' not found",
+        )
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.pstats",
+    )
@@ -1,28 +1,61 @@
+import logging
+import time
 from datetime import datetime
-from typing import Any, List
-
-from fastapi import APIRouter, Depends, Form, HTTPException, status
-from jose import JWTError
-from sqlalchemy.orm import Session
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Form,
+    HTTPException,
+    Query,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.utils import (
+    build_verification_email,
     generate_random_code,
-    get_current_user_from_token,
-    send_verification_email,
+    get_bulk_register_principal,
+    get_current_principal,
+    get_current_verified_principal,
+    rate_limit_bulk_register,
+    rate_limit_register,
+    verification_of,
 )
 from backend.core.configs import settings
-from backend.core.security import decode_jwt
-from backend.db.models.users import Users
+from backend.core.exports import EXPORT_FORMATS, ExportEncoder
+from backend.core.verification import (
+    InvalidVerificationCode,
+    VerificationNotFound,
+    verification_store,
+)
 from backend.db.repository.users import (
+    EXPORT_COLUMNS,
+    bulk_create_users,
     create_new_user,
     delete_user_by_id,
-    get_user_by_email,
     get_user_by_id,
     retrieve_all_users,
+    stream_all_users,
+    stream_users_export,
     update_user_by_id,
 )
-from backend.db.session import get_db
-from backend.schemas.users import UserCreate, UserShow, UserUpdate
+from backend.db.session import AsyncSessionLocal, get_async_db
+from backend.schemas.token import CurrentPrincipal
+from backend.schemas.users import (
+    BulkRegisterResult,
+    UserCreate,
+    UserExportFilters,
+    UserShow,
+    UserUpdate,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -31,85 +64,168 @@ def get_verification_msg(verification_code):
     return f"""<p>Your verification code is {verification_code}</p>"""
 
 
-@router.post("/register", response_model=UserShow, description="Create a new user")
+@router.post(
+    "/register",
+    response_model=UserShow,
+    description="Create a new user",
+    dependencies=[Depends(rate_limit_register)],
+)
 async def create_user(
     user_in: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> Any:
 
-    user = get_user_by_email(email=user_in.email, db=db)
-    if user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Email '{user.email}' already exist",
-        )
-
-    created_user = create_new_user(user_in, db)
-    if not created_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Can't create user {user_in.email}, please contact your admin",
-        )
-
     # For a production env, I advice to use a service provider like twilio API for account validation by sms or email
+    # The email is queued with the user and sent by the outbox worker, so the
+    # registration doesn't wait for the SMTP server
+    emails = []
     if settings.EMAILS_ENABLED and user_in.email:
         verification_code = generate_random_code(size=4)
 
-        verify_link = send_verification_email(
+        verification_email = build_verification_email(
             email_to=user_in.email,
             verification_code=verification_code,
         )
+        emails.append(verification_email)
         print(
             f"\n *********** Verification CODE (): '{verification_code}' ******************* \n "
         )
         print(
-            f"\n *********** Activation LINK (send by mail): '{verify_link}' ******************* \n \n "
+            f"\n *********** Activation LINK (send by mail): '{verification_email.environment['link']}' ******************* \n \n "
         )
 
+    # The unique index on the email rejects duplicates, even concurrent ones
+    created_user = await create_new_user(user_in, db, emails=emails)
+    if not created_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Email '{user_in.email}' already exist",
+        )
+
+    if emails:
+        await verification_store.save(*verification_of(emails[0], created_user.id))
     return created_user
 
 
-@router.post("/verify/{token}", status_code=status.HTTP_200_OK)
-async def verify_email_token_code(
-    token: str, code: str = Form(...), db: Session = Depends(get_db)
-) -> Any:
+def build_bulk_verification_email(email: str):
+    return build_verification_email(
+        email_to=email, verification_code=generate_random_code(size=4)
+    )
 
-    try:
-        token_data = decode_jwt(token_string=token)
-        # {'exp': 1648409190.684334, 'nbf': 1648344390, 'sub': 'TLFN', 'email': 'user3@example.com'}
-    except JWTError:
+
+@router.post(
+    "/bulk-register",
+    response_model=List[BulkRegisterResult],
+    description="Create many users at once. Each user is reported as 'created', "
+    "'duplicate' (email already used) or 'invalid', in the order of the request. "
+    "Restricted to the users of BULK_REGISTER_ALLOWED_EMAILS.",
+    dependencies=[Depends(rate_limit_bulk_register)],
+)
+async def bulk_create_user(
+    users_in: List[Dict[str, Any]] = Body(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentPrincipal = Depends(get_bulk_register_principal),
+) -> Any:
+    if len(users_in) > settings.BULK_REGISTER_MAX_USERS:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Can't decode the given JWT token.",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BULK_REGISTER_MAX_USERS} users can be "
+            "registered at once",
         )
 
-    if token_data.get("sub") != code:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid verification code"
+    # Items are validated one by one, so an invalid user doesn't reject the batch
+    results: List[BulkRegisterResult] = []
+    valid_users: List[UserCreate] = []
+    seen_emails = set()
+    for index, item in enumerate(users_in):
+        try:
+            user_in = UserCreate.parse_obj(item)
+        except ValidationError as exc:
+            email = item.get("email") if isinstance(item, dict) else None
+            results.append(
+                BulkRegisterResult(
+                    index=index,
+                    email=email if isinstance(email, str) else None,
+                    status="invalid",
+                    errors=exc.errors(),
+                )
+            )
+            continue
+
+        results.append(
+            BulkRegisterResult(index=index, email=user_in.email, status="duplicate")
+        )
+        if user_in.email not in seen_emails:
+            seen_emails.add(user_in.email)
+            valid_users.append(user_in)
+
+    verification_emails = {}
+
+    def build_email(email: str):
+        verification_emails[email] = build_bulk_verification_email(email)
+        return verification_emails[email]
+
+    created_users = {}
+    if valid_users:
+        created_users = await bulk_create_users(
+            valid_users,
+            db,
+            chunk_size=settings.BULK_INSERT_CHUNK_SIZE,
+            build_email=build_email if settings.EMAILS_ENABLED else None,
+        )
+    if verification_emails:
+        await verification_store.save_many(
+            verification_of(verification_emails[email], user_id)
+            for email, user_id in created_users.items()
         )
 
-    user = get_user_by_email(email=token_data.get("email"), db=db)
+    for result in results:
+        # Only the first occurrence of an email in the batch is created
+        if result.status == "duplicate" and result.email in created_users:
+            result.status = "created"
+            result.id = created_users.pop(result.email)
 
-    if not user:
+    return results
+
+
+@router.post("/verify/{verification_id}", status_code=status.HTTP_200_OK)
+async def verify_email_token_code(
+    verification_id: str,
+    code: str = Form(...),
+    db: AsyncSession = Depends(get_async_db),
+) -> Any:
+    # A verification is consumed once, and locked after too many wrong codes
+    try:
+        user_id = await verification_store.consume(verification_id, code)
+    except VerificationNotFound:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Invalid token"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown or expired verification link",
+        )
+    except InvalidVerificationCode as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid verification code, {exc.attempts_left} attempts left",
         )
 
-    # Update user informations
     user_in = UserUpdate(
         is_active=True,
         is_validation_mail_send=True,
         is_verified=True,
         validation_date=datetime.now(),
     )
-    update_user_by_id(user_id=user.id, user=user_in, db=db)
+    if not await update_user_by_id(user_id=user_id, user=user_in, db=db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown or expired verification link",
+        )
 
     return {"message": "Code successfully verified"}
 
 
 @router.get("/get/{user_id}", response_model=UserShow)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = get_user_by_id(user_id=user_id, db=db)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_by_id(user_id=user_id, db=db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -118,22 +234,106 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
     return user
 
 
-@router.get("/all", response_model=List[UserShow])
-def retrieve_available_users(db: Session = Depends(get_db)):
-    users = retrieve_all_users(db=db)
-    if not users:
+async def stream_users_ndjson(after_id: Optional[int]) -> AsyncIterator[str]:
+    # The streaming response outlives the request handler, so it holds its own
+    # session for as long as rows are sent
+    async with AsyncSessionLocal() as db:
+        async for user in stream_all_users(
+            db=db, after_id=after_id, batch_size=settings.USERS_STREAM_BATCH_SIZE
+        ):
+            yield UserShow.from_orm(user).json() + "\n"
+
+
+@router.get(
+    "/all",
+    response_model=List[UserShow],
+    description="List active users by pages of 'limit' users, after the user "
+    "'after_id'. The next page starts after the id given in the X-Next-After-Id "
+    "header. With 'stream', all users are sent as NDJSON.",
+)
+async def retrieve_available_users(
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(settings.USERS_PAGE_SIZE, ge=1, le=settings.USERS_PAGE_MAX_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    if stream:
+        return StreamingResponse(
+            stream_users_ndjson(after_id=after_id), media_type="application/x-ndjson"
+        )
+
+    users = await retrieve_all_users(db=db, after_id=after_id, limit=limit)
+    if not users and after_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No users found in the database",
         )
+
+    if len(users) == limit:
+        response.headers["X-Next-After-Id"] = str(users[-1].id)
     return users
 
 
+async def stream_users_export_file(
+    encoder: ExportEncoder, filters: UserExportFilters
+) -> AsyncIterator[bytes]:
+    start = time.perf_counter()
+    yield encoder.header()
+    async with AsyncSessionLocal() as db:
+        async for rows in stream_users_export(
+            db=db,
+            columns=encoder.columns,
+            filters=filters,
+            batch_size=settings.USERS_EXPORT_BATCH_SIZE,
+        ):
+            yield encoder.encode(rows)
+    yield encoder.finish()
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"{encoder.rows} users exported in {elapsed:.1f}s "
+        f"({encoder.rows / elapsed:.0f} rows/s)"
+    )
+
+
+@router.get(
+    "/export",
+    description="Export users as a CSV or NDJSON file, optionally gzipped. "
+    f"Exportable columns: {', '.join(EXPORT_COLUMNS)} (all by default).",
+)
+async def export_users(
+    file_format: str = Query("csv", alias="format"),
+    columns: Optional[List[str]] = Query(None),
+    gzip: bool = False,
+    filters: UserExportFilters = Depends(),
+    current_user: CurrentPrincipal = Depends(get_current_verified_principal),
+):
+    columns = columns or list(EXPORT_COLUMNS)
+    unknown_columns = set(columns) - set(EXPORT_COLUMNS)
+    if unknown_columns or file_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown columns {sorted(unknown_columns)}"
+            if unknown_columns
+            else f"Unknown format '{file_format}'",
+        )
+
+    encoder = ExportEncoder(columns, file_format=file_format, compress=gzip)
+    return StreamingResponse(
+        stream_users_export_file(encoder=encoder, filters=filters),
+        media_type=encoder.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="users.{encoder.extension}"'
+        },
+    )
+
+
 @router.delete("/delete/{user_id}", status_code=status.HTTP_200_OK)
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: Users = Depends(get_current_user_from_token),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentPrincipal = Depends(get_current_principal),
 ):
     if not current_user:
         raise HTTPException(
@@ -150,14 +350,11 @@ async def delete_user(
             detail=f"Only verified user can delete data",
         )
 
-    user = get_user_by_id(user_id=user_id, db=db)
-    if not user:
+    if not await delete_user_by_id(user_id=user_id, db=db):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No user with id {user_id} found",
         )
-
-    assert delete_user_by_id(user_id=user_id, db=db)
     return {"detail": "Successfully deleted"}
 
 
@@ -165,15 +362,13 @@ async def delete_user(
 async def update_user(
     user_id: int,
     user: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
 
     # Only user owner or super admin user can delete a user
-    user_search = get_user_by_id(user_id=user_id, db=db)
-    if not user_search:
+    if not await update_user_by_id(user_id=user_id, user=user, db=db):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User '{user_id}' not found",
         )
-    update_user_by_id(user_id=user_id, user=user, db=db)
     return {"detail": "Successfully updated"}
@@ -1,10 +1,46 @@
 import os
 import secrets
+from typing import List
+
 from dotenv import find_dotenv, load_dotenv
 from pydantic import EmailStr
 
 load_dotenv(find_dotenv())
 
+# Async drivers used in place of the default (sync) DBAPI of each backend
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """Build the async SQLAlchemy URL matching a sync database URL
+
+    Args:
+        database_url (str): sync URL, like postgresql://user:pw@host/db
+
+    Returns:
+        str: async URL, like postgresql+asyncpg://user:pw@host/db
+    """
+    if not database_url:
+        return database_url
+
+    scheme, _, rest = database_url.partition("://")
+    backend = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(backend, scheme)}://{rest}"
+
+
+def getenv_bool(key: str, default: bool = False) -> bool:
+    value = os.getenv(key)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def getenv_list(key: str) -> List[str]:
+    """Comma separated values, lowercased"""
+    return [
+        item.strip().lower() for item in os.getenv(key, "").split(",") if item.strip()
+    ]
+
 
 class Settings:
 
@@ -21,29 +57,162 @@ class Settings:
     DATABASE_USER: str = os.getenv("POSTGRES_USER")
     DATABASE_PASSWORD: str = os.getenv("POSTGRES_PASSWORD")
     DATABASE_URL = str = os.getenv("DATABASE_URL")
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(
+        DATABASE_URL
+    )
+
+    # Create the missing tables on startup, unless Alembic manages the schema
+    DATABASE_CREATE_TABLES: bool = getenv_bool("DATABASE_CREATE_TABLES", True)
+
+    # Connection pool (per engine and per worker process).
+    # 'pgbouncer' profile: PgBouncer in transaction mode does the pooling, so the
+    # application doesn't keep connections and doesn't use prepared statements
+    DATABASE_POOL_MODE: str = os.getenv("DATABASE_POOL_MODE", "default")
+    DATABASE_POOL_SIZE: int = int(os.getenv("DATABASE_POOL_SIZE", 5))
+    DATABASE_MAX_OVERFLOW: int = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+    DATABASE_POOL_TIMEOUT: float = float(os.getenv("DATABASE_POOL_TIMEOUT", 30))
+    DATABASE_POOL_RECYCLE: int = int(os.getenv("DATABASE_POOL_RECYCLE", 1800))
+    DATABASE_POOL_PRE_PING: bool = getenv_bool("DATABASE_POOL_PRE_PING", True)
+
+    # Users listing: page size and rows fetched per round trip when streaming
+    USERS_PAGE_SIZE: int = 100
+    USERS_PAGE_MAX_SIZE: int = 1000
+    USERS_STREAM_BATCH_SIZE: int = 500
+    USERS_EXPORT_BATCH_SIZE: int = int(os.getenv("USERS_EXPORT_BATCH_SIZE", 5000))
+
+    # Bulk registration: users per request and per INSERT statement
+    BULK_REGISTER_MAX_USERS: int = int(os.getenv("BULK_REGISTER_MAX_USERS", 10000))
+    BULK_INSERT_CHUNK_SIZE: int = 1000
+    # Without an admin role, the (verified) users allowed to bulk register, e.g.
+    # "admin@example.com,partner@example.com". Nobody by default
+    BULK_REGISTER_ALLOWED_EMAILS: list = getenv_list("BULK_REGISTER_ALLOWED_EMAILS")
+
+    # Users import (backend.tools.import_users): rows loaded and merged per chunk
+    IMPORT_CHUNK_SIZE: int = int(os.getenv("IMPORT_CHUNK_SIZE", 10000))
 
     # Getting JWT params
-    JWT_SECRET_KEY: str = secrets.token_hex()
+    # Keyring shared by the workers and nodes: a JSON file of keys ({"keys": [{
+    # "kid", "alg", "key" or "key_file", "not_before", "expires"}]}), reloaded when
+    # it changes, or the same JSON in JWT_KEYS. See backend.tools.jwt_keys
+    JWT_KEYS_FILE: str = os.getenv("JWT_KEYS_FILE")
+    JWT_KEYS: str = os.getenv("JWT_KEYS")
+    JWT_KEYS_RELOAD_SECONDS: float = float(os.getenv("JWT_KEYS_RELOAD_SECONDS", 60))
+    # Without a keyring, a single HS256 secret. Random by default: tokens are only
+    # valid for this process
+    JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY") or secrets.token_hex()
     JWT_ALGORITHM = "HS256"
-    JWT_ACCESS_TOKEN_EXPIRE_MINUTES = 30
+    # Access tokens carry the user authorizations, which are refreshed with the
+    # access token: keep them short-lived
+    JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = int(
+        os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 15)
+    )
+    JWT_REFRESH_TOKEN_EXPIRE_MINUTES: int = int(
+        os.getenv("JWT_REFRESH_TOKEN_EXPIRE_MINUTES", 7 * 24 * 60)
+    )
+
+    # Email verifications (activation link id, code, failed attempts), in Redis
+    # when REDIS_URL is set, otherwise in the worker process
+    VERIFICATION_EXPIRE_MINUTES: int = int(os.getenv("VERIFICATION_EXPIRE_MINUTES", 60))
+    VERIFICATION_MAX_ATTEMPTS: int = int(os.getenv("VERIFICATION_MAX_ATTEMPTS", 5))
+
+    # Revoked tokens (logout), shared through Redis when REDIS_URL is set. Each
+    # worker checks them in a Bloom filter, synced every TOKEN_DENYLIST_SYNC_SECONDS
+    TOKEN_DENYLIST_SYNC_SECONDS: float = float(
+        os.getenv("TOKEN_DENYLIST_SYNC_SECONDS", 1)
+    )
+    # Expected revocations per access token lifetime, and Bloom false positive
+    # rate: a false positive costs a round trip to the shared store
+    TOKEN_DENYLIST_CAPACITY: int = int(os.getenv("TOKEN_DENYLIST_CAPACITY", 100000))
+    TOKEN_DENYLIST_ERROR_RATE: float = float(
+        os.getenv("TOKEN_DENYLIST_ERROR_RATE", 0.001)
+    )
+
+    # Decoded token claims cache (per worker process)
+    AUTH_CACHE_MAXSIZE: int = int(os.getenv("AUTH_CACHE_MAXSIZE", 10000))
+    AUTH_CLAIMS_CACHE_TTL_SECONDS: int = int(
+        os.getenv("AUTH_CLAIMS_CACHE_TTL_SECONDS", 300)
+    )
 
-    JWT_EMAIL_TOKEN_EXPIRE_MINUTES = 1
-    EMAILS_ENABLED: bool = os.getenv("EMAILS_ENABLED")
+    # Password hashing process pool, 0 to hash in the calling process
+    HASHING_POOL_SIZE: int = int(os.getenv("HASHING_POOL_SIZE", os.cpu_count() or 1))
+    HASHING_MAX_PENDING: int = int(os.getenv("HASHING_MAX_PENDING", 256))
+    # bcrypt cost of new hashes, calibrated at startup to take about
+    # HASHING_TARGET_MS when not set. Lower cost hashes are updated on login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 0))
+    HASHING_TARGET_MS: float = float(os.getenv("HASHING_TARGET_MS", 250))
+
+    # Rate limiting of the login and registration endpoints, over a sliding window.
+    # Counters are shared by all the workers through Redis when REDIS_URL is set,
+    # otherwise each worker counts on its own
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    RATE_LIMIT_ENABLED: bool = getenv_bool("RATE_LIMIT_ENABLED", True)
+    RATE_LIMIT_WINDOW_SECONDS: int = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", 60))
+    LOGIN_RATE_LIMIT_PER_IP: int = int(os.getenv("LOGIN_RATE_LIMIT_PER_IP", 30))
+    LOGIN_RATE_LIMIT_PER_EMAIL: int = int(os.getenv("LOGIN_RATE_LIMIT_PER_EMAIL", 5))
+    REGISTER_RATE_LIMIT_PER_IP: int = int(os.getenv("REGISTER_RATE_LIMIT_PER_IP", 10))
+    REGISTER_RATE_LIMIT_PER_EMAIL: int = int(
+        os.getenv("REGISTER_RATE_LIMIT_PER_EMAIL", 3)
+    )
+
+    # Prometheus metrics, served on /metrics. Each worker has its own metrics
+    METRICS_ENABLED: bool = getenv_bool("METRICS_ENABLED", True)
+
+    # Requests profiling (cProfile). Off by default: the middleware isn't even
+    # installed. When enabled, a request is profiled when it has a valid
+    # X-Profile-Token header, when profiling is switched on for all requests
+    # (/internal/profiling), or at random for PROFILING_SAMPLE_RATE of them.
+    # Profiles are kept in PROFILING_DIR, the oldest removed past PROFILING_MAX_FILES
+    PROFILING_ENABLED: bool = getenv_bool("PROFILING_ENABLED")
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+    PROFILING_DIR: str = os.getenv("PROFILING_DIR", "/tmp/profiles")
+    PROFILING_MAX_FILES: int = int(os.getenv("PROFILING_MAX_FILES", 100))
+    PROFILING_TOKEN_EXPIRE_MINUTES: int = int(
+        os.getenv("PROFILING_TOKEN_EXPIRE_MINUTES", 60)
+    )
+
+    # Production server (python -m backend.serve): WEB_CONCURRENCY workers, the
+    # available CPUs by default. A worker is replaced after SERVER_MAX_REQUESTS
+    # requests, plus up to SERVER_MAX_REQUESTS_JITTER so they don't all restart
+    # together (0: never). On SIGTERM, workers get SERVER_GRACEFUL_TIMEOUT seconds
+    # to finish their requests
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT: int = int(os.getenv("APPS_PORT") or 8000)
+    SERVER_WORKERS: int = int(os.getenv("WEB_CONCURRENCY", 0))
+    SERVER_MAX_REQUESTS: int = int(os.getenv("SERVER_MAX_REQUESTS", 10000))
+    SERVER_MAX_REQUESTS_JITTER: int = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 1000))
+    SERVER_GRACEFUL_TIMEOUT: float = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+    # Open the pooled database connections and start the hashing workers on
+    # startup, before serving (on with backend.serve)
+    WARMUP_ENABLED: bool = getenv_bool("WARMUP_ENABLED")
+
+    EMAILS_ENABLED: bool = getenv_bool("EMAILS_ENABLED")
 
     # Mails & SMTP
     MAIL_FROM: str = os.getenv("MAIL_FROM")
     MAIL_FROM_NAME: str = os.getenv("MAIL_FROM_NAME")
     EMAIL_TEMPLATES_DIR: str = "backend/email-templates/build"
+    # Recompile email templates when their file changes (development)
+    EMAIL_TEMPLATES_AUTO_RELOAD: bool = getenv_bool("EMAIL_TEMPLATES_AUTO_RELOAD")
 
     SMTP_USERNAME: str = os.getenv("SMTP_USERNAME")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD")
     SMTP_PORT: int = os.getenv("SMTP_PORT")
     SMTP_HOST: str = os.getenv("SMTP_HOST")
-    SMTP_TLS: bool = os.getenv("SMTP_TLS")
-    SMTP_SSL: bool = os.getenv("SMTP_SSL")
+    SMTP_TLS: bool = getenv_bool("SMTP_TLS")
+    SMTP_SSL: bool = getenv_bool("SMTP_SSL")
     SMTP_USE_CREDENTIALS: bool = os.getenv("SMTP_USE_CREDENTIALS")
     SMTP_VALIDATE_CERTS: bool = os.getenv("SMTP_VALIDATE_CERTS")
 
+    # Emails outbox, delivered by the backend.workers.outbox process.
+    # A failed email is retried after OUTBOX_RETRY_DELAY_SECONDS, doubled after
+    # each attempt
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+    OUTBOX_POLL_INTERVAL_SECONDS: float = float(
+        os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", 2)
+    )
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+    OUTBOX_RETRY_DELAY_SECONDS: int = int(os.getenv("OUTBOX_RETRY_DELAY_SECONDS", 30))
+
     # Test
     EMAIL_TEST_USER: EmailStr = "test@dailymotion.local"
 
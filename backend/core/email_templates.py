@@ -0,0 +1,79 @@
+import os
+from typing import Any, Dict, Iterable, Iterator
+
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+
+from backend.core.configs import settings
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class EmailTemplates:
+    """
+    Email templates compiled once and kept in memory, so rendering an email doesn't
+    read nor parse any file.
+
+    With auto_reload, a template is recompiled when its file changes (development).
+    """
+
+    def __init__(self, directory: str, auto_reload: bool = False):
+        self.directory = directory
+        self.auto_reload = auto_reload
+        self.environment = Environment(
+            loader=FileSystemLoader(directory),
+            autoescape=select_autoescape(["html"]),
+            auto_reload=auto_reload,
+            # Keep every compiled template, there are only a few of them
+            cache_size=-1,
+        )
+        self.templates: Dict[str, Template] = {}
+        self._string_templates: Dict[str, Template] = {}
+
+    def load(self) -> None:
+        """Compile all the templates of the directory"""
+        for name in self.environment.list_templates(extensions=["html"]):
+            self.templates[name] = self.environment.get_template(name)
+
+    def get(self, name: str) -> Template:
+        if self.auto_reload or name not in self.templates:
+            # The environment checks the file modification time when reloading
+            self.templates[name] = self.environment.get_template(name)
+        return self.templates[name]
+
+    def get_from_string(self, source: str) -> Template:
+        """Compile a template from a string (like an email subject), once"""
+        if source not in self._string_templates:
+            self._string_templates[source] = self.environment.from_string(source)
+        return self._string_templates[source]
+
+    def render(self, name: str, environment: Dict[str, Any]) -> str:
+        return self.get(name).render(environment)
+
+    def render_string(self, source: str, environment: Dict[str, Any]) -> str:
+        return self.get_from_string(source).render(environment)
+
+    def render_many(
+        self,
+        name: str,
+        environments: Iterable[Dict[str, Any]],
+        common: Dict[str, Any] = None,
+    ) -> Iterator[str]:
+        """Render one template for many recipients (bulk campaigns)
+
+        Args:
+            name (str): template file name, like 'new_account.html'
+            environments (Iterable[Dict[str, Any]]): variables of each recipient
+            common (Dict[str, Any], optional): variables shared by all recipients
+
+        Yields:
+            str: rendered template, in the order of the environments
+        """
+        template = self.get(name)
+        for environment in environments:
+            yield template.render({**(common or {}), **environment})
+
+
+email_templates = EmailTemplates(
+    directory=os.path.join(BASE_DIR, settings.EMAIL_TEMPLATES_DIR),
+    auto_reload=settings.EMAIL_TEMPLATES_AUTO_RELOAD,
+)
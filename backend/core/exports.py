@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Iterable, List, Sequence
+
+EXPORT_FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class ExportEncoder:
+    """
+    Encode exported rows as CSV or NDJSON, by batches of rows, optionally gzipped.
+
+    The output is produced chunk by chunk (header, one chunk per batch, end of the
+    gzip stream), so an export never holds more than one batch in memory.
+    """
+
+    def __init__(
+        self, columns: Sequence[str], file_format: str = "csv", compress: bool = False
+    ):
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{file_format}'")
+        self.columns = list(columns)
+        self.file_format = file_format
+        self.rows = 0
+        # wbits=31: gzip container instead of a raw zlib stream
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+
+    @property
+    def media_type(self) -> str:
+        return "application/gzip" if self._compressor else MEDIA_TYPES[self.file_format]
+
+    @property
+    def extension(self) -> str:
+        return f"{self.file_format}.gz" if self._compressor else self.file_format
+
+    def header(self) -> bytes:
+        if self.file_format != "csv":
+            return self._output("")
+        return self._output(self._csv_lines([self.columns]))
+
+    def encode(self, rows: Iterable[Sequence[Any]]) -> bytes:
+        rows = [[export_value(value) for value in row] for row in rows]
+        self.rows += len(rows)
+        if self.file_format == "csv":
+            return self._output(self._csv_lines(rows))
+        return self._output(
+            "".join(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows)
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor else b""
+
+    def _csv_lines(self, rows: List[Sequence[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def _output(self, text: str) -> bytes:
+        data = text.encode()
+        return self._compressor.compress(data) if self._compressor else data
@@ -1,10 +1,24 @@
-from typing import Tuple
+import asyncio
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 from passlib import pwd
 from passlib.context import CryptContext
 
+from backend.core.configs import settings
+from backend.core.metrics import password_hashing_duration_seconds
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Bounds of the calibrated bcrypt cost, each round doubles the hashing time
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+# Calibration hashes at a low cost, then extrapolates
+BCRYPT_CALIBRATION_ROUNDS = 8
+
 
 class Hasher:
     @staticmethod
@@ -18,3 +32,211 @@ class Hasher:
     @staticmethod
     def verify_password(plain_password: str, hash_password: str) -> Tuple[bool, str]:
         return pwd_context.verify(plain_password, hash_password)
+
+
+def hash_passwords(plain_passwords: List[str]) -> List[str]:
+    return [Hasher.get_password_hash(password) for password in plain_passwords]
+
+
+def verify_and_update_password(
+    plain_password: str, hash_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify a password, and hash it again if its hash is below the policy"""
+    return pwd_context.verify_and_update(plain_password, hash_password)
+
+
+def calibrate_bcrypt_rounds(
+    target_ms: float,
+    min_rounds: int = BCRYPT_MIN_ROUNDS,
+    max_rounds: int = BCRYPT_MAX_ROUNDS,
+) -> int:
+    """Find the highest bcrypt cost whose hashing time fits the target
+
+    Args:
+        target_ms (float): hashing time budget, in milliseconds
+        min_rounds (int): lowest accepted cost, whatever the hardware
+        max_rounds (int): highest accepted cost
+
+    Returns:
+        int: bcrypt rounds (log2 of the iterations)
+    """
+    handler = pwd_context.handler("bcrypt").using(rounds=BCRYPT_CALIBRATION_ROUNDS)
+    elapsed_ms = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        handler.hash("calibration")
+        elapsed_ms = min(elapsed_ms, (time.perf_counter() - start) * 1000)
+
+    rounds = BCRYPT_CALIBRATION_ROUNDS + math.floor(math.log2(target_ms / elapsed_ms))
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+def configure_hashing_policy(rounds: int) -> None:
+    """
+    New hashes use the given bcrypt cost, and hashes with a lower cost are
+    updated on the next login (a higher cost is kept, so workers calibrated
+    slightly differently don't rehash each other's hashes)
+    """
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+class HashingQueueFull(Exception):
+    """Raised when too many hashing jobs are already waiting for a worker"""
+
+
+class HashingService:
+    """
+    Run bcrypt hashing and verification in a dedicated process pool, so a
+    ~250 ms hash never blocks the event loop.
+
+    When the pool isn't started (scripts, tests, HASHING_POOL_SIZE=0) every call
+    falls back to running synchronously in the current process.
+    """
+
+    def __init__(self, pool_size: int, max_pending: int):
+        self.pool_size = pool_size
+        self.max_pending = max_pending
+        self.rounds: Optional[int] = None
+        self.pending = 0
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        if self._executor:
+            return
+        # BCRYPT_ROUNDS from the settings, or the cost fitting HASHING_TARGET_MS
+        # on this hardware
+        self.rounds = settings.BCRYPT_ROUNDS or calibrate_bcrypt_rounds(
+            settings.HASHING_TARGET_MS
+        )
+        configure_hashing_policy(self.rounds)
+        if self.pool_size <= 0:
+            return
+        # 'spawn' avoids forking a process which already runs threads (event loop,
+        # threadpool of the sync routes). Spawned workers get the policy on start.
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_hashing_policy,
+            initargs=(self.rounds,),
+        )
+
+    async def warm_up(self) -> None:
+        """Spawn the pool workers (interpreter, bcrypt import) before serving"""
+        if not self._executor:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self._executor, Hasher.get_password_hash, "warm-up"
+                )
+                for _ in range(self.pool_size)
+            )
+        )
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def hash(self, plain_password: str) -> str:
+        return await self._run("hash", Hasher.get_password_hash, plain_password)
+
+    async def verify(self, plain_password: str, hash_password: str) -> bool:
+        return await self._run(
+            "verify", Hasher.verify_password, plain_password, hash_password
+        )
+
+    async def verify_and_update(
+        self, plain_password: str, hash_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """Verify a password, return a new hash when the current one is outdated"""
+        return await self._run(
+            "verify", verify_and_update_password, plain_password, hash_password
+        )
+
+    async def hash_many(self, plain_passwords: Sequence[str]) -> List[str]:
+        """
+        Hash many passwords (bulk registration) in parallel, as one job per worker,
+        so a big batch takes a few places of the queue only
+        """
+        plain_passwords = list(plain_passwords)
+        if not plain_passwords:
+            return []
+        if not self._executor:
+            return self._timed("hash_many", hash_passwords, plain_passwords)
+
+        size = math.ceil(len(plain_passwords) / self.pool_size)
+        chunks = [
+            plain_passwords[start : start + size]
+            for start in range(0, len(plain_passwords), size)
+        ]
+        results = await asyncio.gather(
+            *(self._run("hash_many", hash_passwords, chunk) for chunk in chunks)
+        )
+        return [hashed for chunk in results for hashed in chunk]
+
+    def hash_sync(self, plain_password: str) -> str:
+        return self._timed("hash", Hasher.get_password_hash, plain_password)
+
+    def verify_sync(self, plain_password: str, hash_password: str) -> bool:
+        return self._timed(
+            "verify", Hasher.verify_password, plain_password, hash_password
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size if self.started else 0,
+            "bcrypt_rounds": self.rounds,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "operations": {name: dict(values) for name, values in self.stats.items()},
+        }
+
+    async def _run(self, operation: str, func: Callable, *args) -> Any:
+        if not self._executor:
+            return self._timed(operation, func, *args)
+
+        if self.pending >= self.max_pending:
+            raise HashingQueueFull(
+                f"{self.pending} hashing jobs are already waiting for a worker"
+            )
+
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            self._record(operation, time.perf_counter() - start)
+
+    def _timed(self, operation: str, func: Callable, *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._record(operation, time.perf_counter() - start)
+
+    def _record(self, operation: str, elapsed: float) -> None:
+        stats = self.stats.setdefault(
+            operation, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        stats["calls"] += 1
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        password_hashing_duration_seconds.observe(elapsed, operation=operation)
+
+
+hashing_service = HashingService(
+    pool_size=settings.HASHING_POOL_SIZE, max_pending=settings.HASHING_MAX_PENDING
+)
+
+# Without a started service (scripts, workers), hashes use the configured cost
+if settings.BCRYPT_ROUNDS:
+    configure_hashing_policy(settings.BCRYPT_ROUNDS)
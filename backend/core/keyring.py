@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from jose import jwk, jwt
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWTError
+
+from backend.core.configs import settings
+
+logger = logging.getLogger(__name__)
+
+SIGNING_ALGORITHMS = ALGORITHMS.HMAC | ALGORITHMS.RSA_DS | ALGORITHMS.EC_DS
+
+
+class KeyringError(Exception):
+    """Raised when the keyring configuration is invalid or has no signing key"""
+
+
+def parse_time(value: Union[None, int, float, str]) -> Optional[float]:
+    """Timestamp of an epoch number or an ISO datetime (UTC when naive)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class JWTKey:
+    """
+    A key of the keyring, parsed once: HMAC secrets sign and verify, asymmetric
+    (ES256, RS256...) private keys sign, and their public key verifies.
+
+    A key signs from 'not_before', and tokens signed by it are accepted until
+    'expires'.
+    """
+
+    __slots__ = ("kid", "algorithm", "key", "verify_key", "not_before", "expires")
+
+    def __init__(
+        self,
+        kid: str,
+        algorithm: str,
+        key_data: Any,
+        not_before: float = 0.0,
+        expires: Optional[float] = None,
+    ):
+        if algorithm not in SIGNING_ALGORITHMS:
+            raise KeyringError(f"Unsupported algorithm '{algorithm}' for key '{kid}'")
+        self.kid = kid
+        self.algorithm = algorithm
+        try:
+            self.key = jwk.construct(key_data, algorithm)
+        except Exception as exc:
+            raise KeyringError(f"Invalid key '{kid}': {exc}")
+        self.verify_key = self.key if self.is_symmetric else self.key.public_key()
+        self.not_before = not_before
+        self.expires = expires
+
+    @property
+    def is_symmetric(self) -> bool:
+        return self.algorithm in ALGORITHMS.HMAC
+
+    @property
+    def can_sign(self) -> bool:
+        return self.is_symmetric or not self.key.is_public()
+
+    def is_expired(self, now: float) -> bool:
+        return self.expires is not None and self.expires <= now
+
+    def public_jwk(self) -> Optional[Dict[str, Any]]:
+        """JWK of the public key, None for secrets"""
+        if self.is_symmetric:
+            return None
+        return {**self.verify_key.to_dict(), "kid": self.kid, "use": "sig"}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], directory: str = ".") -> "JWTKey":
+        """Key of a keyring file entry: kid, alg, key (or key_file), not_before..."""
+        try:
+            kid, algorithm = config["kid"], config["alg"]
+        except KeyError as exc:
+            raise KeyringError(f"Missing {exc} in keyring entry")
+        key_data = config.get("key")
+        if "key_file" in config:
+            with open(os.path.join(directory, config["key_file"])) as file:
+                key_data = file.read()
+        if not key_data:
+            raise KeyringError(f"Missing key or key_file for key '{kid}'")
+        return cls(
+            kid,
+            algorithm,
+            key_data,
+            not_before=parse_time(config.get("not_before")) or 0.0,
+            expires=parse_time(config.get("expires")),
+        )
+
+
+class Keyring:
+    """
+    Keys signing and verifying the JWT, picked by the 'kid' header of a token.
+
+    The signing key is the latest one whose 'not_before' is past: a rotation
+    publishes the next key ahead of time, so that all the workers accept its
+    tokens before any of them signs with it. Keys loaded from a file are
+    reloaded when the file changes, checked every 'reload_seconds'.
+    """
+
+    def __init__(
+        self,
+        keys: List[JWTKey],
+        path: Optional[str] = None,
+        reload_seconds: float = 60,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.timer = timer
+        self._mtime = os.stat(path).st_mtime if path else None
+        self._next_check = timer() + reload_seconds
+        self._set_keys(keys)
+
+    def _set_keys(self, keys: List[JWTKey]) -> None:
+        kids = [key.kid for key in keys]
+        if len(set(kids)) != len(kids):
+            raise KeyringError("Duplicated key ids in the keyring")
+        self.keys = {key.kid: key for key in keys}
+        # Latest first
+        self._signing_keys = sorted(
+            (key for key in keys if key.can_sign),
+            key=lambda key: key.not_before,
+            reverse=True,
+        )
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "Keyring":
+        return cls(read_keyring_file(path), path=path, **kwargs)
+
+    def reload(self) -> None:
+        """Reload the keys file if it changed, keep the current keys on errors"""
+        now = self.timer()
+        if self.path is None or now < self._next_check:
+            return
+        self._next_check = now + self.reload_seconds
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime != self._mtime:
+                self._set_keys(read_keyring_file(self.path))
+                self._mtime = mtime
+                logger.info(f"JWT keyring reloaded, keys {sorted(self.keys)}")
+        except (OSError, ValueError, KeyringError) as exc:
+            logger.error(f"JWT keyring {self.path} not reloaded: {exc}")
+
+    def signing_key(self) -> JWTKey:
+        self.reload()
+        now = self.timer()
+        for key in self._signing_keys:
+            if key.not_before <= now and not key.is_expired(now):
+                return key
+        raise KeyringError("No active signing key in the keyring")
+
+    def verification_key(self, kid: Optional[str]) -> JWTKey:
+        self.reload()
+        if kid is None:
+            # Tokens signed before the keyring have no kid: the signing key checks them
+            try:
+                return self.signing_key()
+            except KeyringError as exc:
+                raise JWTError(str(exc))
+        key = self.keys.get(kid)
+        if key is None or key.is_expired(self.timer()):
+            raise JWTError(f"Unknown or expired signing key '{kid}'")
+        return key
+
+    def encode(self, payload: Dict[str, Any]) -> str:
+        key = self.signing_key()
+        return jwt.encode(
+            payload, key.key, algorithm=key.algorithm, headers={"kid": key.kid}
+        )
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.verification_key(kid)
+        return jwt.decode(token, key.verify_key, algorithms=[key.algorithm])
+
+    def jwks(self) -> Dict[str, List[Dict[str, Any]]]:
+        """JWK Set of the public keys, for services verifying tokens on their own"""
+        now = self.timer()
+        return {
+            "keys": [
+                key.public_jwk()
+                for key in self.keys.values()
+                if not key.is_symmetric and not key.is_expired(now)
+            ]
+        }
+
+
+def read_keyring_file(path: str) -> List[JWTKey]:
+    with open(path) as file:
+        config = json.load(file)
+    return parse_keyring(config, directory=os.path.dirname(os.path.abspath(path)))
+
+
+def parse_keyring(config: Dict[str, Any], directory: str = ".") -> List[JWTKey]:
+    return [JWTKey.from_config(entry, directory) for entry in config.get("keys", [])]
+
+
+def secret_kid(secret: str) -> str:
+    """Stable key id of a secret, which doesn't disclose it"""
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def get_keyring() -> Keyring:
+    if settings.JWT_KEYS_FILE:
+        return Keyring.from_file(
+            settings.JWT_KEYS_FILE, reload_seconds=settings.JWT_KEYS_RELOAD_SECONDS
+        )
+    if settings.JWT_KEYS:
+        return Keyring(parse_keyring(json.loads(settings.JWT_KEYS)))
+    if not os.getenv("JWT_SECRET_KEY"):
+        logger.warning(
+            "No JWT_KEYS_FILE, JWT_KEYS or JWT_SECRET_KEY: tokens are only valid "
+            "in this process"
+        )
+    return Keyring(
+        [
+            JWTKey(
+                secret_kid(settings.JWT_SECRET_KEY),
+                settings.JWT_ALGORITHM,
+                settings.JWT_SECRET_KEY,
+            )
+        ]
+    )
+
+
+jwt_keyring = get_keyring()
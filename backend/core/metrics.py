@@ -0,0 +1,206 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Upper bounds (in seconds) of the latency histograms buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the queries per request histogram buckets
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labelnames: Sequence[str], values: Sequence[str]) -> str:
+    if not labelnames:
+        return ""
+    labels = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)
+    )
+    return f"{{{labels}}}"
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, by label values"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.values.items():
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Histogram:
+    """Distribution of observed values (durations...), by label values"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # Per label values: count of each bucket (not cumulative), sum, count
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        labelnames = self.labelnames + ("le",)
+        for key, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = format_labels(labelnames, key + (format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """Metrics of this worker process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class RequestDatabaseStats:
+    """Queries run by the current request"""
+
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Set by the metrics middleware, for the SQLAlchemy hooks to update
+request_database_stats: ContextVar[Optional[RequestDatabaseStats]] = ContextVar(
+    "request_database_stats", default=None
+)
+
+registry = Registry()
+
+http_requests_total = registry.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests, by route and status code",
+        ["method", "route", "status"],
+    )
+)
+http_request_duration_seconds = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency, by route",
+        ["method", "route"],
+    )
+)
+db_queries_total = registry.register(
+    Counter("db_queries_total", "Database queries, by engine", ["engine"])
+)
+db_query_duration_seconds = registry.register(
+    Histogram(
+        "db_query_duration_seconds", "Database query duration, by engine", ["engine"]
+    )
+)
+db_request_queries = registry.register(
+    Histogram(
+        "db_request_queries",
+        "Database queries per HTTP request, by route",
+        ["route"],
+        buckets=QUERIES_BUCKETS,
+    )
+)
+db_request_duration_seconds = registry.register(
+    Histogram(
+        "db_request_duration_seconds",
+        "Time spent in database queries per HTTP request, by route",
+        ["route"],
+    )
+)
+password_hashing_duration_seconds = registry.register(
+    Histogram(
+        "password_hashing_duration_seconds",
+        "Password hashing and verification duration, queue included",
+        ["operation"],
+    )
+)
+email_send_duration_seconds = registry.register(
+    Histogram("email_send_duration_seconds", "SMTP email sending duration")
+)
+
+
+def track_query_metrics(engine, name: str) -> None:
+    """Time the queries of a (sync) engine, globally and for the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries_total.inc(engine=name)
+        db_query_duration_seconds.observe(elapsed, engine=name)
+        stats = request_database_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
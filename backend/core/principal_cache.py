@@ -0,0 +1,51 @@
+import time
+from typing import Any, Callable, Dict, Optional
+
+from cachetools import TLRUCache
+
+from backend.core.configs import settings
+
+
+class PrincipalCache:
+    """
+    In-process cache of the decoded token claims, keyed by token, never kept after
+    the token 'exp'. The principal is described by its access token claims.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        claims_ttl: float,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.claims_ttl = claims_ttl
+
+        # 'exp' is a timestamp, so the cache timer is the wall clock
+        self.claims = TLRUCache(maxsize=maxsize, ttu=self._claims_expire, timer=timer)
+        self.counters = {"claims_hits": 0, "claims_misses": 0}
+
+    def _claims_expire(self, token: str, claims: Dict[str, Any], now: float) -> float:
+        expire = now + self.claims_ttl
+        if claims.get("exp") is not None:
+            expire = min(expire, float(claims["exp"]))
+        return expire
+
+    def get_claims(self, token: str) -> Optional[Dict[str, Any]]:
+        claims = self.claims.get(token)
+        self.counters["claims_hits" if claims else "claims_misses"] += 1
+        return claims
+
+    def set_claims(self, token: str, claims: Dict[str, Any]) -> None:
+        self.claims[token] = claims
+
+    def clear(self) -> None:
+        self.claims.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"claims_size": self.claims.currsize, **self.counters}
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.AUTH_CACHE_MAXSIZE,
+    claims_ttl=settings.AUTH_CLAIMS_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,125 @@
+import cProfile
+import os
+import random
+import re
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from jose.exceptions import JWTError
+
+from backend.core.configs import settings
+from backend.core.security import decode_jwt, generate_jwt
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+PROFILE_EXTENSION = ".pstats"
+PROFILING_TOKEN_SUBJECT = "profiling"
+
+
+def generate_profiling_token(expires_delta: Optional[timedelta] = None) -> str:
+    """Token of the X-Profile-Token header, signed with the JWT secret key"""
+    return generate_jwt(
+        {"sub": PROFILING_TOKEN_SUBJECT},
+        expires_delta=expires_delta
+        or timedelta(minutes=settings.PROFILING_TOKEN_EXPIRE_MINUTES),
+    )
+
+
+def is_valid_profiling_token(token: str) -> bool:
+    try:
+        claims = decode_jwt(token)
+    except JWTError:
+        return False
+    return claims.get("sub") == PROFILING_TOKEN_SUBJECT
+
+
+class ProfileStore:
+    """
+    Ring directory of profiles: once 'max_files' profiles are stored, each new
+    one removes the oldest.
+
+    Profiles are pstats files, for pstats, snakeviz or speedscope.
+    """
+
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max_files
+
+    def path(self, profile_id: str) -> Optional[str]:
+        """Path of a stored profile, None when the id is invalid or unknown"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}{PROFILE_EXTENSION}")
+        return path if os.path.exists(path) else None
+
+    def save(self, profile: cProfile.Profile, profile_id: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile_id}{PROFILE_EXTENSION}")
+        # Written aside then renamed, a profile is never read half written
+        profile.dump_stats(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        self.prune()
+
+    def profile_ids(self) -> List[str]:
+        """Stored profiles, the most recent first"""
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(PROFILE_EXTENSION)
+            ]
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [entry.name[: -len(PROFILE_EXTENSION)] for entry in entries]
+
+    def prune(self) -> None:
+        for profile_id in self.profile_ids()[self.max_files :]:
+            try:
+                os.remove(os.path.join(self.directory, profile_id + PROFILE_EXTENSION))
+            except FileNotFoundError:
+                pass
+
+
+class RequestProfiler:
+    """
+    Decide which requests are profiled, one at a time: cProfile records
+    everything running in the thread, a concurrent profile would be meaningless.
+    """
+
+    def __init__(
+        self,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        random: Callable[[], float] = random.random,
+    ):
+        self.store = store
+        self.sample_rate = sample_rate
+        # Switched on through /internal/profiling, to profile every request
+        self.profile_all = False
+        self.running = False
+        self.random = random
+        self.profiled = 0
+
+    def should_profile(self, token: Optional[str]) -> bool:
+        if self.running:
+            return False
+        if token and is_valid_profiling_token(token):
+            return True
+        return self.profile_all or (
+            self.sample_rate > 0 and self.random() < self.sample_rate
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.PROFILING_ENABLED,
+            "profile_all": self.profile_all,
+            "sample_rate": self.sample_rate,
+            "profiled": self.profiled,
+            "profiles": self.store.profile_ids(),
+        }
+
+
+request_profiler = RequestProfiler(
+    ProfileStore(settings.PROFILING_DIR, max_files=settings.PROFILING_MAX_FILES),
+    sample_rate=settings.PROFILING_SAMPLE_RATE,
+)
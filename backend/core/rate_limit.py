@@ -0,0 +1,134 @@
+import math
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Optional
+
+import aioredis
+from cachetools import TTLCache
+
+from backend.core.configs import settings
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a client made too many requests, retry after some seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class MemoryRateLimitBackend:
+    """
+    Sliding window log kept in the worker process: the timestamps of the accepted
+    hits of each key, during the last window.
+
+    A key is forgotten one window after its last hit.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        maxsize: int = 100000,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.timer = timer
+        self.hits = TTLCache(maxsize=maxsize, ttl=window, timer=timer)
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = self.timer()
+        hits: Deque[float] = self.hits.get(key) or deque()
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+
+        if len(hits) >= limit:
+            return hits[0] + window - now
+        hits.append(now)
+        self.hits[key] = hits
+        return 0.0
+
+    async def close(self) -> None:
+        self.hits.clear()
+
+
+class RedisRateLimitBackend:
+    """
+    Sliding window log shared by all the workers: a sorted set of hit timestamps
+    per key, updated in a single MULTI/EXEC round trip.
+
+    A hit is recorded before being counted, so concurrent hits never exceed the
+    limit. Rejected hits are removed, they don't extend the ban.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str = "rate-limit:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        key = f"{self.prefix}{key}"
+        now = time.time()
+        member = f"{now}:{uuid.uuid4().hex}"
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, 0, now - window)
+            pipe.zadd(key, {member: now})
+            pipe.zcard(key)
+            pipe.zrange(key, 0, 0, withscores=True)
+            pipe.expire(key, math.ceil(window))
+            _, _, count, oldest, _ = await pipe.execute()
+
+        if count <= limit:
+            return 0.0
+        await self.redis.zrem(key, member)
+        return oldest[0][1] + window - now
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class RateLimiter:
+    """Allow at most 'limit' hits per key during any 'window' seconds"""
+
+    def __init__(self, name: str, limit: int, window: float, backend=None):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.backend = backend
+
+    async def check(self, key: Optional[str]) -> None:
+        """Record a hit for the key, raise RateLimitExceeded over the limit"""
+        if not key or not settings.RATE_LIMIT_ENABLED:
+            return
+        retry_after = await (self.backend or rate_limit_backend).hit(
+            f"{self.name}:{key}", limit=self.limit, window=self.window
+        )
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+
+def get_rate_limit_backend():
+    if settings.REDIS_URL:
+        return RedisRateLimitBackend(aioredis.from_url(settings.REDIS_URL))
+    return MemoryRateLimitBackend(window=settings.RATE_LIMIT_WINDOW_SECONDS)
+
+
+rate_limit_backend = get_rate_limit_backend()
+
+login_ip_limiter = RateLimiter(
+    "login-ip", settings.LOGIN_RATE_LIMIT_PER_IP, settings.RATE_LIMIT_WINDOW_SECONDS
+)
+login_email_limiter = RateLimiter(
+    "login-email",
+    settings.LOGIN_RATE_LIMIT_PER_EMAIL,
+    settings.RATE_LIMIT_WINDOW_SECONDS,
+)
+register_ip_limiter = RateLimiter(
+    "register-ip",
+    settings.REGISTER_RATE_LIMIT_PER_IP,
+    settings.RATE_LIMIT_WINDOW_SECONDS,
+)
+register_email_limiter = RateLimiter(
+    "register-email",
+    settings.REGISTER_RATE_LIMIT_PER_EMAIL,
+    settings.RATE_LIMIT_WINDOW_SECONDS,
+)
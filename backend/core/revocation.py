@@ -0,0 +1,280 @@
+import hashlib
+import heapq
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import aioredis
+
+from backend.core.configs import settings
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed size bit array: no false negatives, false
+    positives at 'error_rate' once 'capacity' items are added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64 bits hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class MemoryRevocationStore:
+    """Revoked tokens of this worker process only"""
+
+    def __init__(self, timer: Callable[[], float] = time.time):
+        self.timer = timer
+        # jti -> (exp, revocation time)
+        self.revoked: Dict[str, Tuple[float, float]] = {}
+        # (exp, jti), the next to expire first
+        self.expiries: List[Tuple[float, str]] = []
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        now = self.timer()
+        drop_expired(self.revoked, self.expiries, now)
+        self.revoked[jti] = (exp, now)
+        heapq.heappush(self.expiries, (exp, jti))
+
+    async def revoked_since(self, since: float) -> List[Tuple[str, float]]:
+        return [
+            (jti, exp)
+            for jti, (exp, revoked_at) in self.revoked.items()
+            if revoked_at >= since
+        ]
+
+    async def is_revoked(self, jti: str, exp: float) -> bool:
+        return jti in self.revoked
+
+    async def close(self) -> None:
+        self.revoked.clear()
+        self.expiries.clear()
+
+
+def drop_expired(
+    entries: Dict[str, Any], expiries: List[Tuple[float, str]], now: float
+):
+    """Remove the entries of the expired tokens, 'expiries' being their heap"""
+    while expiries and expiries[0][0] <= now:
+        _, jti = heapq.heappop(expiries)
+        entries.pop(jti, None)
+
+
+class RedisRevocationStore:
+    """
+    Revoked tokens shared by all the workers: a sorted set of 'jti:exp' members,
+    scored by revocation time, so workers fetch the revocations since their
+    last sync. Members are removed once their token can't be valid anymore.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        max_token_seconds: float,
+        key: str = "revoked-tokens",
+    ):
+        self.redis = redis
+        self.max_token_seconds = max_token_seconds
+        self.key = key
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.key, {f"{jti}:{exp:.0f}": now})
+            pipe.zremrangebyscore(self.key, 0, now - self.max_token_seconds)
+            await pipe.execute()
+
+    async def revoked_since(self, since: float) -> List[Tuple[str, float]]:
+        members = await self.redis.zrangebyscore(self.key, since, "+inf")
+        revoked = []
+        for member in members:
+            jti, _, exp = member.decode().rpartition(":")
+            revoked.append((jti, float(exp)))
+        return revoked
+
+    async def is_revoked(self, jti: str, exp: float) -> bool:
+        return await self.redis.zscore(self.key, f"{jti}:{exp:.0f}") is not None
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class MemoryUsedTokenStore:
+    """Single use tokens of this worker process only"""
+
+    def __init__(self, timer: Callable[[], float] = time.time):
+        self.timer = timer
+        # jti -> exp
+        self.used: Dict[str, float] = {}
+        self.expiries: List[Tuple[float, str]] = []
+
+    async def use(self, jti: str, exp: float) -> bool:
+        """Mark a token as used, False if it already was"""
+        drop_expired(self.used, self.expiries, self.timer())
+        if jti in self.used:
+            return False
+        self.used[jti] = exp
+        heapq.heappush(self.expiries, (exp, jti))
+        return True
+
+    async def close(self) -> None:
+        self.used.clear()
+        self.expiries.clear()
+
+
+class RedisUsedTokenStore:
+    """
+    Single use tokens shared by all the workers: a key per used token, set only
+    if missing, so concurrent uses of a token have a single winner. Keys expire
+    with their token.
+    """
+
+    def __init__(self, redis: aioredis.Redis, prefix: str = "used-token:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def use(self, jti: str, exp: float) -> bool:
+        """Mark a token as used, False if it already was"""
+        ttl = max(1, math.ceil(exp - time.time()))
+        return bool(await self.redis.set(f"{self.prefix}{jti}", 1, ex=ttl, nx=True))
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+class TokenDenylist:
+    """
+    Revoked tokens (by 'jti') until they expire, checked without a round trip.
+
+    Revocations are added to in-process Bloom filters, one per 'bucket_seconds'
+    of token expiry, dropped once all their tokens expired. Only a Bloom filter
+    hit, rare for a valid token, is confirmed by the shared store. Revocations
+    of the other workers are fetched at most every 'sync_seconds'.
+    """
+
+    def __init__(
+        self,
+        store,
+        bucket_seconds: float,
+        capacity: int,
+        error_rate: float,
+        sync_seconds: float,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.timer = timer
+        self.filters: Dict[int, BloomFilter] = {}
+        self.synced_at = 0.0
+        self.counters = {"checks": 0, "bloom_hits": 0, "revoked": 0, "syncs": 0}
+
+    def _bucket(self, exp: float) -> int:
+        return math.ceil(exp / self.bucket_seconds)
+
+    def _add(self, jti: str, exp: float) -> None:
+        bucket = self._bucket(exp)
+        if bucket not in self.filters:
+            self.filters[bucket] = BloomFilter(self.capacity, self.error_rate)
+        self.filters[bucket].add(jti)
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        await self.store.revoke(jti, exp)
+        self._add(jti, exp)
+
+    async def sync(self) -> None:
+        now = self.timer()
+        # Revocations are fetched since a little before the last sync: a
+        # revocation recorded while syncing isn't missed
+        for jti, exp in await self.store.revoked_since(
+            self.synced_at - self.sync_seconds
+        ):
+            if exp > now:
+                self._add(jti, exp)
+        self.synced_at = now
+        self.counters["syncs"] += 1
+
+        # All the tokens of a bucket expired
+        for bucket in [
+            bucket for bucket in self.filters if bucket * self.bucket_seconds <= now
+        ]:
+            del self.filters[bucket]
+
+    async def is_revoked(self, jti: str, exp: float) -> bool:
+        if self.timer() - self.synced_at >= self.sync_seconds:
+            await self.sync()
+
+        self.counters["checks"] += 1
+        bloom_filter = self.filters.get(self._bucket(exp))
+        if bloom_filter is None or jti not in bloom_filter:
+            return False
+        self.counters["bloom_hits"] += 1
+        revoked = await self.store.is_revoked(jti, exp)
+        self.counters["revoked"] += revoked
+        return revoked
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            "filters": len(self.filters),
+            "entries": sum(
+                bloom_filter.count for bloom_filter in self.filters.values()
+            ),
+        }
+
+    async def close(self) -> None:
+        self.filters.clear()
+        self.synced_at = 0.0
+        await self.store.close()
+
+
+def get_revocation_store():
+    if settings.REDIS_URL:
+        return RedisRevocationStore(
+            aioredis.from_url(settings.REDIS_URL),
+            max_token_seconds=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        )
+    return MemoryRevocationStore()
+
+
+def get_used_token_store():
+    if settings.REDIS_URL:
+        return RedisUsedTokenStore(aioredis.from_url(settings.REDIS_URL))
+    return MemoryUsedTokenStore()
+
+
+token_denylist = TokenDenylist(
+    get_revocation_store(),
+    bucket_seconds=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    capacity=settings.TOKEN_DENYLIST_CAPACITY,
+    error_rate=settings.TOKEN_DENYLIST_ERROR_RATE,
+    sync_seconds=settings.TOKEN_DENYLIST_SYNC_SECONDS,
+)
+
+# Refresh tokens are used once. Kept out of the denylist, whose Bloom filters
+# are sized for the revocations of access tokens
+refresh_token_store = get_used_token_store()
@@ -1,17 +1,16 @@
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional
 
-from jose import jwt
 from jose.exceptions import JWTError
 
 from backend.core.configs import settings
+from backend.core.keyring import Keyring, jwt_keyring
 
 
 def generate_jwt(
     data: dict,
-    secret_key: str = settings.JWT_SECRET_KEY,
-    algorithm: str = settings.JWT_ALGORITHM,
     expires_delta: Optional[timedelta] = None,
+    keyring: Optional[Keyring] = None,
 ) -> str:
 
     payload = data.copy()
@@ -22,19 +21,18 @@ def generate_jwt(
             minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
         )
     payload["exp"] = expire
-    encoded_jwt = jwt.encode(payload, secret_key, algorithm=algorithm)
+    encoded_jwt = (keyring or jwt_keyring).encode(payload)
 
     return encoded_jwt
 
 
 def decode_jwt(
     token_string: str,
-    key: str = settings.JWT_SECRET_KEY,
-    algorithms: List[str] = settings.JWT_ALGORITHM,
+    keyring: Optional[Keyring] = None,
 ) -> Dict[str, Any]:
 
     try:
-        token_data = jwt.decode(token=token_string, key=key, algorithms=algorithms)
+        token_data = (keyring or jwt_keyring).decode(token_string)
     except JWTError as exep:
         raise JWTError(exep)
 
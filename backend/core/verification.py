@@ -0,0 +1,165 @@
+import hmac
+import secrets
+import time
+from typing import Callable, Iterable, Tuple
+
+import aioredis
+from aioredis.exceptions import WatchError
+from cachetools import TTLCache
+
+from backend.core.configs import settings
+
+
+class VerificationNotFound(Exception):
+    """Unknown verification: never created, expired, already used or locked"""
+
+
+class InvalidVerificationCode(Exception):
+    """Raised when the code doesn't match, the verification is locked at 0 left"""
+
+    def __init__(self, attempts_left: int):
+        super().__init__(f"Invalid verification code, {attempts_left} attempts left")
+        self.attempts_left = attempts_left
+
+
+def new_verification_id() -> str:
+    """Short opaque id of a verification, for the activation link"""
+    return secrets.token_urlsafe(16)
+
+
+def codes_match(expected: str, code: str) -> bool:
+    return hmac.compare_digest(expected.upper(), code.strip().upper())
+
+
+class Verification:
+    """Pending email verification of a user"""
+
+    __slots__ = ("user_id", "code", "attempts")
+
+    def __init__(self, user_id: int, code: str, attempts: int = 0):
+        self.user_id = user_id
+        self.code = code
+        self.attempts = attempts
+
+
+class MemoryVerificationStore:
+    """
+    Verifications kept in the worker process, forgotten after 'ttl' seconds.
+
+    Only for a single worker: a link must be opened on the worker which sent it.
+    Consuming doesn't await, so it is atomic in the event loop.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_attempts: int,
+        maxsize: int = 100000,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.max_attempts = max_attempts
+        self.verifications = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+
+    async def save(self, verification_id: str, user_id: int, code: str) -> None:
+        self.verifications[verification_id] = Verification(user_id, code)
+
+    async def save_many(self, verifications: Iterable[Tuple[str, int, str]]) -> None:
+        for verification_id, user_id, code in verifications:
+            await self.save(verification_id, user_id, code)
+
+    async def consume(self, verification_id: str, code: str) -> int:
+        verification = self.verifications.get(verification_id)
+        if verification is None:
+            raise VerificationNotFound()
+
+        if codes_match(verification.code, code):
+            self.verifications.pop(verification_id, None)
+            return verification.user_id
+
+        verification.attempts += 1
+        attempts_left = self.max_attempts - verification.attempts
+        if attempts_left <= 0:
+            self.verifications.pop(verification_id, None)
+        raise InvalidVerificationCode(attempts_left)
+
+    async def close(self) -> None:
+        self.verifications.clear()
+
+
+class RedisVerificationStore:
+    """
+    Verifications shared by all the workers: a hash per verification (user id,
+    code and failed attempts), expiring after 'ttl' seconds.
+
+    A verification is consumed in a WATCH/MULTI/EXEC transaction, retried when
+    another request changed it meanwhile: a code is accepted once at most, and
+    concurrent wrong codes are all counted.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: float,
+        max_attempts: int,
+        prefix: str = "verification:",
+    ):
+        self.redis = redis
+        self.ttl = int(ttl)
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+
+    async def save(self, verification_id: str, user_id: int, code: str) -> None:
+        await self.save_many([(verification_id, user_id, code)])
+
+    async def save_many(self, verifications: Iterable[Tuple[str, int, str]]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for verification_id, user_id, code in verifications:
+                key = f"{self.prefix}{verification_id}"
+                pipe.hset(key, mapping={"user_id": user_id, "code": code})
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def consume(self, verification_id: str, code: str) -> int:
+        key = f"{self.prefix}{verification_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    data = await pipe.hgetall(key)
+                    if not data:
+                        raise VerificationNotFound()
+
+                    pipe.multi()
+                    if codes_match(data[b"code"].decode(), code):
+                        pipe.delete(key)
+                        await pipe.execute()
+                        return int(data[b"user_id"])
+
+                    attempts = int(data.get(b"attempts", 0)) + 1
+                    if attempts >= self.max_attempts:
+                        pipe.delete(key)
+                    else:
+                        pipe.hset(key, "attempts", attempts)
+                    await pipe.execute()
+                    raise InvalidVerificationCode(self.max_attempts - attempts)
+                except WatchError:
+                    continue
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+def get_verification_store():
+    ttl = settings.VERIFICATION_EXPIRE_MINUTES * 60
+    if settings.REDIS_URL:
+        return RedisVerificationStore(
+            aioredis.from_url(settings.REDIS_URL),
+            ttl=ttl,
+            max_attempts=settings.VERIFICATION_MAX_ATTEMPTS,
+        )
+    return MemoryVerificationStore(
+        ttl=ttl, max_attempts=settings.VERIFICATION_MAX_ATTEMPTS
+    )
+
+
+verification_store = get_verification_store()
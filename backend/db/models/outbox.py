@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, String, Text
+
+from backend.db.base import Base
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+
+class EmailOutbox(Base):
+    """
+    Model represent an email waiting to be delivered by the outbox worker
+    """
+
+    id = Column(Integer, primary_key=True, index=True)
+    email_to = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    template = Column(String, nullable=False)
+    environment = Column(JSON, nullable=False, default=dict)
+    status = Column(String, nullable=False, default=OUTBOX_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    # Workers claim the pending emails which are due, oldest first
+    __table_args__ = (
+        Index("ix_emailoutbox_status_next_attempt", status, next_attempt_at),
+    )
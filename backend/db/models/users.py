@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, func
 
 from backend.db.base import Base
 
@@ -9,9 +9,15 @@ class Users(Base):
     """
 
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, nullable=False, unique=True, index=True)
+    email = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_verified = Column(Boolean, default=False)
     is_validation_mail_send = Column(Boolean, default=False)
     validation_date = Column(DateTime)
+    # In the tokens claims: bumped when the password or the activation change, so
+    # the refresh tokens issued before are rejected
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Emails are unique regardless of their case, lookups use lower(email) too
+    __table_args__ = (Index("ix_users_email_lower", func.lower(email), unique=True),)
@@ -0,0 +1,131 @@
+import time
+from typing import Any, Dict, List, Optional, Type
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# Upper bounds (in seconds) of the checkout wait time histogram buckets
+WAIT_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class PoolStats:
+    """
+    Counters of a connection pool: checkouts, wait time to get a connection and
+    connection churn (opened, closed and invalidated DBAPI connections)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine: Optional[Engine] = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_buckets: List[int] = [0] * len(WAIT_TIME_BUCKETS)
+
+    def observe_wait(self, seconds: float) -> None:
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        for index, bound in enumerate(WAIT_TIME_BUCKETS):
+            if seconds <= bound:
+                self.wait_buckets[index] += 1
+                break
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.engine.pool if self.engine else None
+        return {
+            "pool": type(pool).__name__ if pool else None,
+            # NullPool (PgBouncer profile, SQLite) doesn't keep connections
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "closes": self.closes,
+            "invalidations": self.invalidations,
+            "wait_seconds": {
+                "total": self.wait_seconds_total,
+                "max": self.wait_seconds_max,
+                "buckets": {
+                    str(bound): count
+                    for bound, count in zip(WAIT_TIME_BUCKETS, self.wait_buckets)
+                },
+            },
+        }
+
+
+def instrumented_pool_class(pool_class: Type[Pool], stats: PoolStats) -> Type[Pool]:
+    """Subclass a pool class to measure the time spent waiting for a connection
+
+    SQLAlchemy has no event fired before a checkout, so the wait time is measured
+    around Pool._do_get. The subclass survives engine.dispose(), which rebuilds the
+    pool from its class.
+
+    Args:
+        pool_class (Type[Pool]): pool class to instrument, e.g. QueuePool
+        stats (PoolStats): counters to update
+
+    Returns:
+        Type[Pool]: instrumented pool class
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = pool_class._do_get(self)
+        except exc.TimeoutError:
+            stats.timeouts += 1
+            raise
+        stats.observe_wait(time.perf_counter() - start)
+        return connection
+
+    return type(
+        f"Instrumented{pool_class.__name__}", (pool_class,), {"_do_get": _do_get}
+    )
+
+
+def track_pool_stats(engine: Engine, stats: PoolStats) -> None:
+    """Update the given counters from the pool events of a (sync) engine"""
+
+    stats.engine = engine
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        stats.closes += 1
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidations += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        stats.checkins += 1
+
+
+sync_pool_stats = PoolStats("sync")
+async_pool_stats = PoolStats("async")
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        stats.name: stats.snapshot() for stats in (sync_pool_stats, async_pool_stats)
+    }
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """SQL statements executed on some engines"""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __str__(self) -> str:
+        return "\n".join(
+            f"{index}. {statement}"
+            for index, statement in enumerate(self.statements, start=1)
+        )
+
+
+@contextmanager
+def count_queries(*engines: Engine) -> Iterator[QueryCounter]:
+    """Record the statements executed on the (sync) engines inside the block
+
+    The listeners are engine-wide: statements of concurrent sessions are
+    recorded as well.
+
+    Args:
+        engines (Engine): engines to watch, 'async_engine.sync_engine' for an
+            async engine
+    """
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        counter.statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
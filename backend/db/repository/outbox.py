@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.db.models.outbox import (
+    OUTBOX_FAILED,
+    OUTBOX_PENDING,
+    OUTBOX_SENT,
+    EmailOutbox,
+)
+
+
+def claim_pending_emails(db: Session, batch_size: int) -> List[EmailOutbox]:
+    """
+    Lock a batch of due emails until the end of the transaction. Rows locked by
+    another worker are skipped instead of waited for.
+    """
+    query = (
+        select(EmailOutbox)
+        .where(
+            EmailOutbox.status == OUTBOX_PENDING,
+            EmailOutbox.next_attempt_at <= datetime.utcnow(),
+        )
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    return db.execute(query).scalars().all()
+
+
+def mark_email_sent(email: EmailOutbox) -> None:
+    email.attempts += 1
+    email.status = OUTBOX_SENT
+    email.sent_at = datetime.utcnow()
+    email.last_error = None
+
+
+def mark_email_failed(
+    email: EmailOutbox, error: str, max_attempts: int, retry_delay: int
+) -> None:
+    """Schedule a new attempt with an exponential backoff, or give up"""
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= max_attempts:
+        email.status = OUTBOX_FAILED
+    else:
+        delay = retry_delay * 2 ** (email.attempts - 1)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def get_email_by_id(email_id: int, db: Session) -> EmailOutbox:
+    return db.get(EmailOutbox, email_id)
@@ -1,64 +1,240 @@
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
 
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Insert, Select
 
-from backend.core.hashing import Hasher
+from backend.core.hashing import hashing_service
+from backend.db.models.outbox import EmailOutbox
 from backend.db.models.users import Users
-from backend.schemas.users import UserCreate, UserUpdate
+from backend.schemas.users import UserCreate, UserExportFilters, UserUpdate
 
 
-def create_new_user(user: UserCreate, db: Session) -> Users:
-    created_user = Users(
-        email=user.email,
-        hashed_password=Hasher.get_password_hash(user.password),
+async def create_new_user(
+    user: UserCreate, db: AsyncSession, emails: Sequence[EmailOutbox] = ()
+) -> Optional[Users]:
+    """
+    Insert a user, relying on the unique index of the email instead of a prior
+    lookup, and return None when the email is already used (even by a concurrent
+    registration).
+
+    The given emails are queued in the transaction which inserts the user, so they
+    are sent if and only if the user is created
+    """
+    hashed_password = await hashing_service.hash(user.password)
+    query = (
+        dialect_insert(db)(Users)
+        .values(email=user.email, hashed_password=hashed_password)
+        .on_conflict_do_nothing(index_elements=[func.lower(Users.email)])
     )
-    db.add(created_user)
-    db.commit()
-    db.refresh(created_user)
 
+    if supports_returning(db):
+        # The created row, or nothing on a duplicate, in a single round trip
+        result = await db.execute(
+            select(Users).from_statement(query.returning(*Users.__table__.c))
+        )
+        created_user = result.scalars().first()
+    else:
+        result = await db.execute(query)
+        created_user = (
+            await get_user_by_id(user_id=result.inserted_primary_key[0], db=db)
+            if result.rowcount
+            else None
+        )
+
+    # On a conflict nothing was written, the emails are dropped
+    if created_user is not None:
+        db.add_all(emails)
+    await db.commit()
     return created_user
 
 
-def get_user_by_email(email: str, db: Session) -> Users:
-    return db.query(Users).filter(Users.email == email).first()
+def supports_returning(db: AsyncSession) -> bool:
+    # SQLite (test stand-in) has no RETURNING support in SQLAlchemy 1.4
+    return db.bind.dialect.full_returning
 
 
-def get_user_by_id(user_id: int, db: Session) -> Users:
-    return db.query(Users).filter(Users.id == user_id).first()
+def dialect_insert(db: AsyncSession) -> Callable[..., Insert]:
+    """Dialect specific insert(), which supports ON CONFLICT"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
 
 
-def update_user_by_id(user_id: int, user: UserUpdate, db: Session):
-    existing_user = db.query(Users).filter(Users.id == user_id)
+async def insert_users_chunk(
+    rows: List[Dict[str, Any]], db: AsyncSession
+) -> Dict[str, int]:
+    """
+    Insert users in one multi-row INSERT ... ON CONFLICT DO NOTHING and
+    return the id of the inserted ones, by email
+    """
+    query = (
+        dialect_insert(db)(Users)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=[func.lower(Users.email)])
+    )
+    if supports_returning(db):
+        result = await db.execute(query.returning(Users.email, Users.id))
+        return dict(result.all())
 
-    if not existing_user.first():
-        return None
+    # Without RETURNING, the users which already exist are looked up beforehand
+    emails = [row["email"] for row in rows]
+    result = await db.execute(
+        select(func.lower(Users.email)).where(func.lower(Users.email).in_(emails))
+    )
+    existing_emails = set(result.scalars().all())
+    await db.execute(query)
+    result = await db.execute(
+        select(Users.email, Users.id).where(
+            Users.email.in_(set(emails) - existing_emails)
+        )
+    )
+    return dict(result.all())
+
+
+async def bulk_create_users(
+    users: Sequence[UserCreate],
+    db: AsyncSession,
+    chunk_size: int = 1000,
+    build_email: Optional[Callable[[str], EmailOutbox]] = None,
+) -> Dict[str, int]:
+    """Create many users at once, in a single transaction
+
+    Args:
+        users (Sequence[UserCreate]): users to create, with distinct emails
+        db (AsyncSession): database session
+        chunk_size (int): number of users inserted per statement
+        build_email (Callable[[str], EmailOutbox], optional): build the email to
+            queue for each created user, from its email address
+
+    Returns:
+        Dict[str, int]: id of the created users by email, users whose email
+        already exists are skipped
+    """
+    hashed_passwords = await hashing_service.hash_many(
+        [user.password for user in users]
+    )
+    rows = [
+        {"email": user.email, "hashed_password": hashed_password}
+        for user, hashed_password in zip(users, hashed_passwords)
+    ]
 
-    update_data = jsonable_encoder(user.dict(exclude_unset=True))
+    created_users = {}
+    for start in range(0, len(rows), chunk_size):
+        created_users.update(
+            await insert_users_chunk(rows=rows[start : start + chunk_size], db=db)
+        )
+
+    if build_email:
+        db.add_all(build_email(email) for email in created_users)
+    await db.commit()
+    return created_users
+
+
+def select_user_by_email(email: str) -> Select:
+    """User by email, whatever its case, through the lower(email) unique index"""
+    return select(Users).where(func.lower(Users.email) == email.lower())
+
+
+async def get_user_by_email(email: str, db: AsyncSession) -> Users:
+    result = await db.execute(select_user_by_email(email))
+    return result.scalars().first()
+
+
+async def get_user_by_id(user_id: int, db: AsyncSession) -> Users:
+    result = await db.execute(select(Users).where(Users.id == user_id))
+    return result.scalars().first()
+
+
+async def update_user_by_id(
+    user_id: int, user: UserUpdate, db: AsyncSession
+) -> Optional[Users]:
+    """
+    Update a user in a single UPDATE ... RETURNING round trip, and return the
+    updated user, or None when no user has this id
+    """
+    update_data = user.dict(exclude_unset=True)
 
     # Encrypt password if updated
-    if update_data.get("password"):
-        hash_password = Hasher.get_password_hash(update_data.get("password"))
-        update_data["hashed_password"] = hash_password
-        update_data.pop("password")
+    password = update_data.pop("password", None)
+    if password:
+        update_data["hashed_password"] = await hashing_service.hash(password)
+
+    # Sessions opened before a password change or a deactivation can't be
+    # refreshed anymore
+    if password or update_data.get("is_active") is False:
+        update_data["token_version"] = Users.token_version + 1
 
-    existing_user.update(update_data)
-    db.commit()
+    if not update_data:
+        return await get_user_by_id(user_id=user_id, db=db)
 
-    return existing_user.first()
+    query = update(Users).where(Users.id == user_id).values(update_data)
+    if supports_returning(db):
+        result = await db.execute(
+            select(Users)
+            .from_statement(query.returning(*Users.__table__.c))
+            .execution_options(populate_existing=True)
+        )
+        updated_user = result.scalars().first()
+    else:
+        result = await db.execute(query)
+        updated_user = (
+            await get_user_by_id(user_id=user_id, db=db) if result.rowcount else None
+        )
+    await db.commit()
+    return updated_user
 
 
-def authenticate(email: str, password: str, db: Session) -> Optional[Users]:
-    user = get_user_by_email(email=email, db=db)
+async def authenticate(
+    email: str,
+    password: str,
+    db: AsyncSession,
+    rehash: Optional[Callable[[int, str], Any]] = None,
+) -> Optional[Users]:
+    """Check the password of a user, and update its hash when outdated
+
+    Args:
+        email (str): user email
+        password (str): plain password
+        db (AsyncSession): database session
+        rehash (Callable[[int, str], Any], optional): called with the user id and
+            its new password hash, to save it later (off the request path). By
+            default, the new hash is saved right away.
+
+    Returns:
+        Optional[Users]: the user, None if unknown or if the password is wrong
+    """
+    user = await get_user_by_email(email=email, db=db)
     if not user:
         return None
-    if not Hasher.verify_password(
+    verified, new_hash = await hashing_service.verify_and_update(
         plain_password=password, hash_password=user.hashed_password
-    ):
+    )
+    if not verified:
         return None
+
+    if new_hash:
+        if rehash:
+            rehash(user.id, new_hash)
+        else:
+            await update_password_hash(user_id=user.id, hashed_password=new_hash, db=db)
     return user
 
 
+async def update_password_hash(
+    user_id: int, hashed_password: str, db: AsyncSession
+) -> None:
+    await db.execute(
+        update(Users)
+        .where(Users.id == user_id)
+        .values(hashed_password=hashed_password)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
 def is_active(user: Users) -> bool:
     return user.is_active
 
@@ -67,15 +243,91 @@ def is_verified(user: Users) -> bool:
     return user.is_verified
 
 
-def retrieve_all_users(db: Session):
-    return db.query(Users).filter(Users.is_active.is_(True)).all()
+def select_active_users(after_id: Optional[int] = None) -> Select:
+    """
+    Active users ordered by id, starting after the given id (keyset pagination on
+    the primary key index, instead of an OFFSET scan)
+    """
+    query = select(Users).where(Users.is_active.is_(True)).order_by(Users.id)
+    if after_id is not None:
+        query = query.where(Users.id > after_id)
+    return query
+
+
+async def retrieve_all_users(
+    db: AsyncSession, after_id: Optional[int] = None, limit: Optional[int] = None
+) -> List[Users]:
+    query = select_active_users(after_id=after_id)
+    if limit:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return result.scalars().all()
 
 
-def delete_user_by_id(user_id: int, db: Session):
-    existing_user = db.query(Users).filter(Users.id == user_id)
-    if not existing_user.first():
-        return False
+async def stream_all_users(
+    db: AsyncSession, after_id: Optional[int] = None, batch_size: int = 500
+) -> AsyncIterator[Users]:
+    """
+    Yield active users from a server-side cursor, fetching batch_size rows per
+    round trip, so memory doesn't grow with the size of the table
+    """
+    query = select_active_users(after_id=after_id).execution_options(
+        yield_per=batch_size
+    )
+    result = await db.stream(query)
+    async for user in result.scalars():
+        yield user
+
+
+# Exportable columns, the password hash never leaves the database
+EXPORT_COLUMNS = (
+    "id",
+    "email",
+    "is_active",
+    "is_verified",
+    "is_validation_mail_send",
+    "validation_date",
+)
+
+
+def select_users_export(columns: Sequence[str], filters: UserExportFilters) -> Select:
+    """Selected columns of the users matching the filters, ordered by id"""
+    query = select(*(Users.__table__.c[column] for column in columns)).order_by(
+        Users.id
+    )
+    if filters.is_active is not None:
+        query = query.where(Users.is_active.is_(filters.is_active))
+    if filters.is_verified is not None:
+        query = query.where(Users.is_verified.is_(filters.is_verified))
+    if filters.validated_after:
+        query = query.where(Users.validation_date >= filters.validated_after)
+    if filters.validated_before:
+        query = query.where(Users.validation_date < filters.validated_before)
+    return query
+
+
+async def stream_users_export(
+    db: AsyncSession,
+    columns: Sequence[str],
+    filters: UserExportFilters,
+    batch_size: int = 5000,
+) -> AsyncIterator[List[Row]]:
+    """Yield batches of exported rows, read from a server-side cursor"""
+    query = select_users_export(columns=columns, filters=filters).execution_options(
+        yield_per=batch_size
+    )
+    result = await db.stream(query)
+    async for rows in result.partitions(batch_size):
+        yield rows
+
 
-    existing_user.delete(synchronize_session=False)
-    db.commit()
-    return True
+async def delete_user_by_id(user_id: int, db: AsyncSession) -> bool:
+    """
+    Delete a user in a single DELETE round trip, and return False when no user
+    has this id
+    """
+    query = delete(Users).where(Users.id == user_id)
+    result = await db.execute(query.execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount > 0
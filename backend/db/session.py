@@ -1,14 +1,90 @@
-from typing import Generator
+import asyncio
+from typing import Any, AsyncGenerator, Dict, Generator, Type
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
 
 from backend.core.configs import settings
+from backend.core.metrics import track_query_metrics
+from backend.db.pool import (
+    PoolStats,
+    async_pool_stats,
+    instrumented_pool_class,
+    sync_pool_stats,
+    track_pool_stats,
+)
 
-engine = create_engine(settings.DATABASE_URL)
+
+def get_engine_options(
+    database_url: str, pool_class: Type[Pool], stats: PoolStats
+) -> Dict[str, Any]:
+    """Build the pool options of an engine from the settings
+
+    Args:
+        database_url (str): database URL of the engine
+        pool_class (Type[Pool]): default pool class of the engine (sync or async)
+        stats (PoolStats): counters updated by the pool
+
+    Returns:
+        Dict[str, Any]: keyword arguments for create_engine / create_async_engine
+    """
+    url = make_url(database_url)
+
+    # SQLite picks its own pool implementation, which takes none of these options
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    if settings.DATABASE_POOL_MODE == "pgbouncer":
+        options = {"poolclass": instrumented_pool_class(NullPool, stats)}
+        # Prepared statements don't survive PgBouncer transaction mode
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+            }
+        return options
+
+    return {
+        "poolclass": instrumented_pool_class(pool_class, stats),
+        "pool_size": settings.DATABASE_POOL_SIZE,
+        "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+        "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": settings.DATABASE_POOL_PRE_PING,
+    }
+
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    **get_engine_options(settings.DATABASE_URL, QueuePool, sync_pool_stats),
+)
+track_pool_stats(engine, sync_pool_stats)
+track_query_metrics(engine, "sync")
 
 SessionLocal = sessionmaker(autoflush=False, autocommit=False, bind=engine)
 
+# Async stack used by the API, so database round trips don't block the event loop.
+# Objects must stay readable after commit without an implicit (blocking) refresh.
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    **get_engine_options(
+        settings.ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, async_pool_stats
+    ),
+)
+track_pool_stats(async_engine.sync_engine, async_pool_stats)
+track_query_metrics(async_engine.sync_engine, "async")
+
+AsyncSessionLocal = sessionmaker(
+    autoflush=False,
+    autocommit=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
 
 def get_db() -> Generator:
     try:
@@ -16,3 +92,25 @@ def get_db() -> Generator:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def open_pool_connections(engine: AsyncEngine, count: int) -> int:
+    """
+    Open 'count' connections at once and give them back to the pool, so the first
+    requests don't pay for the connection. A single one without a connection pool
+    (PgBouncer profile, SQLite), which still checks the database is reachable
+    """
+    if not isinstance(engine.pool, QueuePool):
+        count = 1
+    # The first connection initializes the dialect, under a lock which concurrent
+    # first connections would wait for forever (same thread)
+    connections = [await engine.connect()]
+    connections += await asyncio.gather(*(engine.connect() for _ in range(count - 1)))
+    for connection in connections:
+        await connection.close()
+    return len(connections)
@@ -1,18 +1,113 @@
-from fastapi import FastAPI
+import logging
+import math
+import time
+
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import inspect
 
 from backend.api.base import api_router
+from backend.api.metrics import MetricsMiddleware
+from backend.api.metrics import router as metrics_router
+from backend.api.profiling import ProfilingMiddleware
 from backend.core.configs import settings
+from backend.core.email_templates import email_templates
+from backend.core.hashing import HashingQueueFull, hashing_service
+from backend.core.rate_limit import RateLimitExceeded, rate_limit_backend
+from backend.core.revocation import refresh_token_store, token_denylist
+from backend.core.verification import verification_store
 from backend.db.base import Base
-from backend.db.session import engine
+from backend.db.session import async_engine, open_pool_connections
+
+logger = logging.getLogger(__name__)
+
+# Created by 'alembic upgrade', the schema is then managed by the migrations
+ALEMBIC_VERSION_TABLE = "alembic_version"
+
 
+def create_tables_if_unmanaged(connection) -> None:
+    if inspect(connection).has_table(ALEMBIC_VERSION_TABLE):
+        return
+    Base.metadata.create_all(bind=connection)
 
-def create_tables():
-    # Connect FastAPI to the database engine, so the DB will automatically creating when destruct the project.
-    Base.metadata.create_all(bind=engine)
+
+async def create_tables():
+    """
+    Create the missing tables (development, tests, SQLite) on startup, never on
+    import, unless Alembic manages the schema or DATABASE_CREATE_TABLES is off
+    """
+    if not settings.DATABASE_CREATE_TABLES:
+        return
+    async with async_engine.begin() as connection:
+        await connection.run_sync(create_tables_if_unmanaged)
+
+
+async def warm_up():
+    """
+    Pay the cold start costs before serving, when WARMUP_ENABLED: open the pooled
+    database connections and spawn the hashing workers
+    """
+    if not settings.WARMUP_ENABLED:
+        return
+    start = time.perf_counter()
+    connections = await open_pool_connections(async_engine, settings.DATABASE_POOL_SIZE)
+    await hashing_service.warm_up()
+    logger.info(
+        f"Warmed up in {time.perf_counter() - start:.2f}s: {connections} database "
+        f"connections, {hashing_service.pool_size if hashing_service.started else 0} "
+        "hashing workers"
+    )
 
 
 def include_router(app):
     app.include_router(api_router)
+    if settings.METRICS_ENABLED:
+        app.include_router(metrics_router)
+
+
+def add_middlewares(app):
+    # The last added middleware is the outermost one
+    if settings.PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware)
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+
+
+def add_event_handlers(app):
+    # Database work waits for the startup: importing the application is cheap
+    app.add_event_handler("startup", create_tables)
+    # Hashing workers live as long as the application
+    app.add_event_handler("startup", hashing_service.start)
+    app.add_event_handler("shutdown", hashing_service.shutdown)
+    # Compile the email templates once, before serving
+    app.add_event_handler("startup", email_templates.load)
+    # Last: the worker only accepts connections once the startup is over
+    app.add_event_handler("startup", warm_up)
+    # Pooled connections are bound to the event loop which opened them
+    app.add_event_handler("shutdown", async_engine.dispose)
+    app.add_event_handler("shutdown", rate_limit_backend.close)
+    app.add_event_handler("shutdown", verification_store.close)
+    app.add_event_handler("shutdown", token_denylist.close)
+    app.add_event_handler("shutdown", refresh_token_store.close)
+
+
+def add_exception_handlers(app):
+    async def hashing_queue_full_handler(request: Request, exc: HashingQueueFull):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Server is busy, please retry later"},
+            headers={"Retry-After": "1"},
+        )
+
+    async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": "Too many requests, please retry later"},
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+
+    app.add_exception_handler(HashingQueueFull, hashing_queue_full_handler)
+    app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
 
 def start_application():
@@ -22,9 +117,13 @@ def start_application():
         description=settings.PROJECT_DESCRIPTION,
         openapi_url=f"{settings.API_V1_STR}/openapi.json",
     )
-    create_tables()
     include_router(start_app)
+    add_middlewares(start_app)
+    add_event_handlers(start_app)
+    add_exception_handlers(start_app)
     return start_app
 
 
+# Building the application has no side effect, it can also be built by the
+# server: uvicorn --factory backend.main:start_application
 app = start_application()
@@ -0,0 +1,8 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class ProfilingUpdate(BaseModel):
+    profile_all: Optional[bool] = None
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
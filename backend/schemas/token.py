@@ -7,9 +7,19 @@ from pydantic import BaseModel
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 
 # We will also used TokenData as a schema to validate user code
 class TokenData(BaseModel):
     email: Optional[str] = None
     code: Optional[str] = None
+
+
+class CurrentPrincipal(BaseModel):
+    """Authenticated user, as described by its access token claims"""
+
+    id: int
+    email: str
+    is_active: bool
+    is_verified: bool
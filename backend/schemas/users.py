@@ -1,7 +1,9 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Literal, Optional
 
-from pydantic import UUID4, BaseModel, EmailStr, Field
+from pydantic import UUID4, BaseModel, EmailStr, Field, root_validator, validator
+
+from backend.core.hashing import pwd_context
 
 
 class CreateUpdateDictModel(BaseModel):
@@ -23,6 +25,11 @@ class BaseUser(CreateUpdateDictModel):
 
     email: EmailStr
 
+    @validator("email")
+    def normalize_email(cls, value):
+        # 'Foo@example.com' and 'foo@example.com' are the same account
+        return value.lower()
+
 
 class UserCreate(BaseUser):
     """Create User model"""
@@ -30,6 +37,28 @@ class UserCreate(BaseUser):
     password: str
 
 
+class UserImport(BaseUser):
+    """User imported from a legacy system, with a plain or an already hashed password"""
+
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None
+    is_active: bool = True
+    is_verified: bool = False
+
+    @validator("hashed_password")
+    def check_hash_scheme(cls, value):
+        # A hash the application can't verify would lock its user out
+        if value is not None and not pwd_context.identify(value):
+            raise ValueError("unsupported password hash")
+        return value
+
+    @root_validator(skip_on_failure=True)
+    def check_password(cls, values):
+        if not values.get("password") and not values.get("hashed_password"):
+            raise ValueError("password or hashed_password is required")
+        return values
+
+
 # Properties to receive via API on update
 class UserUpdate(CreateUpdateDictModel):
     """Update User model"""
@@ -50,6 +79,7 @@ class UserAPI(BaseUser):
 
 
 class UserShow(BaseUser):
+    id: Optional[int] = None
     is_active: bool
     is_verified: Optional[bool] = False
     is_validation_mail_send: Optional[bool] = False
@@ -57,3 +87,22 @@ class UserShow(BaseUser):
 
     class Config:
         orm_mode = True
+
+
+class UserExportFilters(BaseModel):
+    """Filters of a users export, validation dates are [after, before)"""
+
+    is_active: Optional[bool] = None
+    is_verified: Optional[bool] = None
+    validated_after: Optional[datetime] = None
+    validated_before: Optional[datetime] = None
+
+
+class BulkRegisterResult(BaseModel):
+    """Outcome of one user of a bulk registration"""
+
+    index: int
+    email: Optional[str] = None
+    status: Literal["created", "duplicate", "invalid"]
+    id: Optional[int] = None
+    errors: Optional[List[Dict[str, Any]]] = None
@@ -0,0 +1,299 @@
+"""
+Production server: pre-forked uvicorn workers, warmed up before serving.
+
+    python -m backend.serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+        [--max-requests 10000] [--max-requests-jitter 1000] [--graceful-timeout 30]
+
+The parent process binds the socket and supervises the workers (WEB_CONCURRENCY,
+the available CPUs by default), which run the application with uvloop and
+httptools when they are installed. A worker accepts connections once its startup
+is over: pooled database connections opened, email templates compiled, hashing
+workers spawned. A worker which exits, after --max-requests requests or on a
+crash, is replaced.
+
+Several workers need shared signing keys (JWT_KEYS_FILE, JWT_KEYS or
+JWT_SECRET_KEY) and Redis (REDIS_URL): the server refuses to start otherwise.
+
+On SIGTERM or SIGINT, the workers stop accepting connections and finish their
+requests, they are killed after --graceful-timeout seconds.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from multiprocessing.context import SpawnProcess
+from multiprocessing.synchronize import Event
+from socket import socket
+from typing import Callable, List, Optional
+
+import uvicorn
+from uvicorn.subprocess import get_subprocess
+
+from backend.core.configs import settings
+
+# Formatted like the workers logs
+logger = logging.getLogger("uvicorn.error")
+
+APP = "backend.main:app"
+# A worker failing to start (database down...) is replaced after a delay, doubled
+# each time up to MAX_RESPAWN_DELAY_SECONDS
+MAX_RESPAWN_DELAY_SECONDS = 30.0
+
+spawn = multiprocessing.get_context("spawn")
+
+
+class ServerConfigurationError(Exception):
+    """Raised when the settings don't allow running several workers"""
+
+
+def check_shared_state(workers: int) -> None:
+    """
+    Several workers must share the token signing keys and the state kept in the
+    worker process otherwise (email verifications, revoked tokens, rate limits)
+    """
+    if workers <= 1:
+        return
+    problems = []
+    if not (
+        settings.JWT_KEYS_FILE
+        or settings.JWT_KEYS
+        # Otherwise a random secret, generated by each worker
+        or os.getenv("JWT_SECRET_KEY")
+    ):
+        problems.append(
+            "no JWT_KEYS_FILE, JWT_KEYS or JWT_SECRET_KEY: each worker would sign "
+            "tokens with its own random secret"
+        )
+    if not settings.REDIS_URL:
+        problems.append(
+            "no REDIS_URL: verifications, revoked tokens and rate limits would be "
+            "kept per worker"
+        )
+    if problems:
+        raise ServerConfigurationError(
+            f"Can't run {workers} workers: {'; '.join(problems)}. "
+            "Set them, or run a single worker (--workers 1)"
+        )
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (container cpusets), or the machine's"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def prepare_workers(workers: int, cpus: int) -> None:
+    """
+    Create the missing tables once, before the workers would race to create them,
+    and set the settings read by each worker on start: warm up before serving,
+    share the CPUs between the hashing pools, and one bcrypt cost calibrated here
+    for all of them (workers with different costs would rehash each other's
+    passwords on login)
+    """
+    if settings.DATABASE_CREATE_TABLES:
+        from backend.db.session import engine
+        from backend.main import create_tables_if_unmanaged
+
+        with engine.begin() as connection:
+            create_tables_if_unmanaged(connection)
+        engine.dispose()
+        os.environ["DATABASE_CREATE_TABLES"] = "false"
+
+    os.environ.setdefault("WARMUP_ENABLED", "true")
+    os.environ.setdefault("HASHING_POOL_SIZE", str(max(1, cpus // workers)))
+    if not settings.BCRYPT_ROUNDS:
+        from backend.core.hashing import calibrate_bcrypt_rounds
+
+        rounds = calibrate_bcrypt_rounds(settings.HASHING_TARGET_MS)
+        os.environ["BCRYPT_ROUNDS"] = str(rounds)
+
+
+def max_requests_of_worker(max_requests: int, jitter: int) -> Optional[int]:
+    if max_requests <= 0:
+        return None
+    return max_requests + random.randint(0, max(jitter, 0))
+
+
+class WorkerServer(uvicorn.Server):
+    """Server telling the supervisor it's ready, once its startup is over"""
+
+    def __init__(self, config: uvicorn.Config, ready: Event):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets: Optional[List[socket]] = None) -> None:
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self.ready.set()
+
+
+class WorkersSupervisor:
+    """Keep 'workers' server processes running on the sockets bound by the parent"""
+
+    def __init__(
+        self,
+        config_factory: Callable[[], uvicorn.Config],
+        sockets: List[socket],
+        workers: int,
+        graceful_timeout: float,
+    ):
+        self.config_factory = config_factory
+        self.sockets = sockets
+        self.graceful_timeout = graceful_timeout
+        self.processes: List[Optional[SpawnProcess]] = [None] * workers
+        self.ready: List[Optional[Event]] = [None] * workers
+        self.respawn_at = [0.0] * workers
+        self.respawn_delay = [0.0] * workers
+        self.should_exit = threading.Event()
+
+    def handle_exit(self, sig, frame) -> None:
+        self.should_exit.set()
+
+    def run(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_exit)
+        logger.info(f"Started parent process [{os.getpid()}]")
+
+        self.check_workers()
+        while not self.should_exit.wait(0.5):
+            self.check_workers()
+        self.shutdown()
+
+    def spawn(self, index: int) -> None:
+        config = self.config_factory()
+        ready = spawn.Event()
+        process = get_subprocess(
+            config=config, target=WorkerServer(config, ready).run, sockets=self.sockets
+        )
+        process.start()
+        self.processes[index] = process
+        self.ready[index] = ready
+
+    def check_workers(self) -> None:
+        """Replace the workers which exited"""
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                continue
+
+            if process is not None:
+                process.join()
+                delay = 0.0
+                if self.ready[index].is_set():
+                    # Recycled after its max requests, or crashed while serving
+                    logger.info(
+                        f"Worker [{process.pid}] exited (code {process.exitcode}), "
+                        "replaced"
+                    )
+                else:
+                    delay = min(
+                        max(1.0, self.respawn_delay[index] * 2),
+                        MAX_RESPAWN_DELAY_SECONDS,
+                    )
+                    logger.error(
+                        f"Worker [{process.pid}] failed to start "
+                        f"(code {process.exitcode}), replaced in {delay:.0f}s"
+                    )
+                self.respawn_delay[index] = delay
+                self.respawn_at[index] = now + delay
+                self.processes[index] = None
+
+            if now >= self.respawn_at[index]:
+                self.spawn(index)
+
+    def shutdown(self) -> None:
+        """Let the workers finish their requests, up to 'graceful_timeout' seconds"""
+        processes = [process for process in self.processes if process is not None]
+        for process in processes:
+            process.terminate()
+
+        deadline = time.monotonic() + self.graceful_timeout
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker [{process.pid}] killed after graceful timeout")
+                process.kill()
+                process.join()
+        logger.info(f"Stopping parent process [{os.getpid()}]")
+
+
+def serve(
+    host: str = settings.SERVER_HOST,
+    port: int = settings.SERVER_PORT,
+    workers: Optional[int] = None,
+    max_requests: int = settings.SERVER_MAX_REQUESTS,
+    max_requests_jitter: int = settings.SERVER_MAX_REQUESTS_JITTER,
+    graceful_timeout: float = settings.SERVER_GRACEFUL_TIMEOUT,
+) -> None:
+    """Run the application in 'workers' processes until SIGTERM or SIGINT
+
+    Args:
+        host (str): interface to listen on
+        port (int): port to listen on
+        workers (int, optional): worker processes, WEB_CONCURRENCY or the CPUs
+        max_requests (int): requests before a worker is replaced, 0 for never
+        max_requests_jitter (int): random extra requests, per worker
+        graceful_timeout (float): seconds to finish the requests on shutdown
+    """
+    cpus = available_cpus()
+    workers = workers or settings.SERVER_WORKERS or cpus
+    check_shared_state(workers)
+    prepare_workers(workers, cpus)
+
+    def config_factory() -> uvicorn.Config:
+        return uvicorn.Config(
+            APP,
+            host=host,
+            port=port,
+            # uvloop and httptools when installed
+            loop="auto",
+            http="auto",
+            limit_max_requests=max_requests_of_worker(
+                max_requests, max_requests_jitter
+            ),
+        )
+
+    sockets = [config_factory().bind_socket()]
+    logger.info(f"Serving on {host}:{port} with {workers} workers")
+    WorkersSupervisor(config_factory, sockets, workers, graceful_timeout).run()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the API in worker processes")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument(
+        "--workers", type=int, help="WEB_CONCURRENCY or the available CPUs"
+    )
+    parser.add_argument(
+        "--max-requests", type=int, default=settings.SERVER_MAX_REQUESTS
+    )
+    parser.add_argument(
+        "--max-requests-jitter", type=int, default=settings.SERVER_MAX_REQUESTS_JITTER
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=settings.SERVER_GRACEFUL_TIMEOUT
+    )
+    args = parser.parse_args()
+
+    try:
+        serve(
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            max_requests=args.max_requests,
+            max_requests_jitter=args.max_requests_jitter,
+            graceful_timeout=args.graceful_timeout,
+        )
+    except ServerConfigurationError as exc:
+        parser.error(str(exc))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 import json
 
 import pytest
+from mock import patch
 
+from backend.api.utils import get_token_claims
 from backend.core.configs import settings
-from backend.tests.conftest import normal_user_token_headers
+from backend.core.hashing import pwd_context
+from backend.core.principal_cache import principal_cache
+from backend.db.repository.users import (
+    get_user_by_email,
+    update_password_hash,
+    update_user_by_id,
+)
+from backend.schemas.users import UserUpdate
 from backend.tests.utils.utils import random_email, random_lower_string
 
 
@@ -20,33 +29,192 @@ def test_login_for_access_token(client):  # FXIME
     assert response.token_type == "bearer"
 
 
-@pytest.mark.skip
-def test_get_current_user_from_token(client):  # FXIME
-    """
-    Check user login using API
-    """
-    test_email = random_email()
-    test_password = random_lower_string()
-
-    # Create a new user
+def register_and_login(client):
+    email = random_email()
+    password = random_lower_string()
     user_response = client.post(
         f"{settings.API_V1_STR}/users/register",
-        json.dumps({"email": test_email, "password": test_password}),
+        json.dumps({"email": email, "password": password}),
     )
     assert user_response.status_code == 200
 
-    # We used 'username' instead of 'email' field for OAuth2PasswordRequestForm
-    login_data = {
-        "username": test_email,
-        "password": test_password,
-    }
+    # The access token is stored in the client cookies
+    response = client.post(
+        f"{settings.API_V1_STR}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+    assert response.status_code == 200
+    return user_response.json()["id"], response.json()
+
+
+@pytest.mark.anyio
+async def test_principal_authorized_from_token_claims(client, db, query_budget):
+    user_id, tokens = register_and_login(client)
+
+    # No user lookup
+    with query_budget(0):
+        for _ in range(2):
+            # Unverified users can't delete users
+            response = client.delete(f"{settings.API_V1_STR}/users/delete/0")
+            assert response.status_code == 401
+
+    # Authorizations changes are seen once the access token is refreshed
+    await update_user_by_id(user_id=user_id, user=UserUpdate(is_verified=True), db=db)
+    response = client.delete(f"{settings.API_V1_STR}/users/delete/0")
+    assert response.status_code == 401
+
+    response = client.post(f"{settings.API_V1_STR}/auth/refresh")
+    assert response.status_code == 200
+    response = client.delete(f"{settings.API_V1_STR}/users/delete/0")
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_token_claims_are_cached(client):
+    user_id, tokens = register_and_login(client)
+
+    principal_cache.clear()
+    counters = dict(principal_cache.counters)
+    for _ in range(2):
+        claims = await get_token_claims(tokens["access_token"])
+        assert claims["uid"] == user_id
+
+    assert principal_cache.counters["claims_misses"] == counters["claims_misses"] + 1
+    assert principal_cache.counters["claims_hits"] == counters["claims_hits"] + 1
+
+
+def test_refresh_token_used_once(client):
+    user_id, tokens = register_and_login(client)
+    url = f"{settings.API_V1_STR}/auth/refresh"
+
+    response = client.post(url, data={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] != tokens["refresh_token"]
+
+    response = client.post(url, data={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 403
+
+    # Access and refresh tokens aren't interchangeable
+    response = client.post(url, data={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 403
+    response = client.delete(
+        f"{settings.API_V1_STR}/users/delete/0",
+        cookies={"access_token": f"Bearer {tokens['refresh_token']}"},
+    )
+    assert response.status_code == 403
+
+
+def test_logout_ends_refresh_token(client):
+    user_id, tokens = register_and_login(client)
+
+    # The refresh token is sent in its cookie
+    response = client.post(f"{settings.API_V1_STR}/auth/logout")
+    assert response.status_code == 200
+
+    response = client.post(
+        f"{settings.API_V1_STR}/auth/refresh",
+        data={"refresh_token": tokens["refresh_token"]},
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_password_change_ends_sessions(client, db):
+    user_id, tokens = register_and_login(client)
 
-    r = client.post(
+    await update_user_by_id(
+        user_id=user_id, user=UserUpdate(password=random_lower_string()), db=db
+    )
+    response = client.post(
+        f"{settings.API_V1_STR}/auth/refresh",
+        data={"refresh_token": tokens["refresh_token"]},
+    )
+    assert response.status_code == 401
+
+
+@patch("backend.api.v1.route_auth.authenticate")
+def test_login_rate_limited_by_email(mock_authenticate, client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    mock_authenticate.return_value = None
+    login_data = {"username": random_email(), "password": random_lower_string()}
+
+    for _ in range(settings.LOGIN_RATE_LIMIT_PER_EMAIL):
+        response = client.post(
+            f"{settings.API_V1_STR}/auth/access-token", data=login_data
+        )
+        assert response.status_code == 400
+
+    mock_authenticate.reset_mock()
+    response = client.post(f"{settings.API_V1_STR}/auth/access-token", data=login_data)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    # Rejected before any password verification
+    assert not mock_authenticate.called
+
+    # Other emails are still accepted
+    login_data["username"] = random_email()
+    response = client.post(f"{settings.API_V1_STR}/auth/access-token", data=login_data)
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_login_updates_outdated_password_hash(client, db):
+    email = random_email()
+    password = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": email, "password": password}),
+    )
+    user = await get_user_by_email(email=email, db=db)
+    outdated_hash = pwd_context.handler("bcrypt").using(rounds=4).hash(password)
+    await update_password_hash(user_id=user.id, hashed_password=outdated_hash, db=db)
+
+    response = client.post(
+        f"{settings.API_V1_STR}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+    assert response.status_code == 200
+
+    # The new hash was saved by a background task, once the response was sent
+    await db.refresh(user)
+    assert user.hashed_password != outdated_hash
+    assert pwd_context.verify(password, user.hashed_password)
+    assert not pwd_context.needs_update(user.hashed_password)
+
+
+def test_logout_revokes_token(client):
+    email = random_email()
+    password = random_lower_string()
+    response = client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": email, "password": password}),
+    )
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    response = client.post(
         f"{settings.API_V1_STR}/auth/access-token",
-        data=json.dumps(login_data),
-        headers=normal_user_token_headers,
+        data={"username": email, "password": password},
     )
-    tokens = r.json()
-    assert r.status_code == 200
-    assert "access_token" in tokens
-    assert tokens["access_token"]
+    assert response.status_code == 200
+    cookies = {"access_token": f"Bearer {response.json()['access_token']}"}
+    url = f"{settings.API_V1_STR}/users/delete/{user_id}"
+
+    # Authenticated, but unverified
+    response = client.delete(url, cookies=cookies)
+    assert response.status_code == 401
+
+    response = client.post(f"{settings.API_V1_STR}/auth/logout", cookies=cookies)
+    assert response.status_code == 200
+    assert not client.cookies.get("access_token")
+
+    response = client.delete(url, cookies=cookies)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Token has been revoked"
+
+
+def test_jwks(client):
+    response = client.get(f"{settings.API_V1_STR}/auth/jwks.json")
+    assert response.status_code == 200
+    # The default keyring is a secret, which isn't published
+    assert response.json() == {"keys": []}
@@ -0,0 +1,117 @@
+import pstats
+
+from fastapi.testclient import TestClient
+
+from backend.api.profiling import ProfilingMiddleware
+from backend.core.configs import settings
+from backend.core.profiling import (
+    ProfileStore,
+    RequestProfiler,
+    generate_profiling_token,
+    request_profiler,
+)
+from backend.main import app
+
+
+def internal_headers():
+    return {"X-Profile-Token": generate_profiling_token()}
+
+
+def test_api_internal_requires_token(client):
+    response = client.get(f"{settings.API_V1_STR}/internal/pool")
+    assert response.status_code == 403
+
+    response = client.get(
+        f"{settings.API_V1_STR}/internal/pool", headers={"X-Profile-Token": "x"}
+    )
+    assert response.status_code == 403
+
+
+def test_api_pool_stats(client):
+    # Make sure the async pool served at least one request
+    client.get(f"{settings.API_V1_STR}/users/get/1")
+
+    response = client.get(
+        f"{settings.API_V1_STR}/internal/pool", headers=internal_headers()
+    )
+    assert response.status_code == 200
+
+    stats = response.json()
+    assert set(stats) == {"sync", "async"}
+    assert stats["async"]["checkouts"] >= 1
+    assert stats["async"]["checkins"] >= 1
+    assert "buckets" in stats["async"]["wait_seconds"]
+
+
+def test_api_hashing_stats(client):
+    response = client.get(
+        f"{settings.API_V1_STR}/internal/hashing", headers=internal_headers()
+    )
+    assert response.status_code == 200
+    assert "operations" in response.json()
+
+
+def test_api_metrics(client):
+    client.get(f"{settings.API_V1_STR}/users/get/1")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    metrics = response.text
+    route = f"{settings.API_V1_STR}/users/get/{{user_id}}"
+    assert f'http_requests_total{{method="GET",route="{route}",status=' in metrics
+    assert f'db_request_queries_count{{route="{route}"}}' in metrics
+    assert 'db_queries_total{engine="async"}' in metrics
+
+
+def test_api_profiling_middleware(tmp_path):
+    profiler = RequestProfiler(ProfileStore(str(tmp_path), max_files=10))
+    client = TestClient(ProfilingMiddleware(app, profiler=profiler))
+    url = f"{settings.API_V1_STR}/internal/pool"
+
+    response = client.get(url)
+    assert "x-profile-id" not in response.headers
+
+    response = client.get(url, headers=internal_headers())
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    stats = pstats.Stats(profiler.store.path(profile_id))
+    assert stats.total_calls > 0
+
+
+def test_api_profiling_toggle_disabled(client):
+    response = client.put(
+        f"{settings.API_V1_STR}/internal/profiling",
+        json={"profile_all": True},
+        headers=internal_headers(),
+    )
+    assert response.status_code == 409
+
+    response = client.get(
+        f"{settings.API_V1_STR}/internal/profiles/{'0' * 32}",
+        headers=internal_headers(),
+    )
+    assert response.status_code == 404
+
+
+def test_api_profiling_toggle(client, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(request_profiler, "profile_all", False)
+    monkeypatch.setattr(request_profiler, "sample_rate", 0.0)
+
+    response = client.put(
+        f"{settings.API_V1_STR}/internal/profiling",
+        json={"profile_all": True, "sample_rate": 0.01},
+        headers=internal_headers(),
+    )
+    assert response.status_code == 200
+    assert response.json()["profile_all"] is True
+    assert request_profiler.sample_rate == 0.01
+
+    response = client.put(
+        f"{settings.API_V1_STR}/internal/profiling",
+        json={"sample_rate": 2},
+        headers=internal_headers(),
+    )
+    assert response.status_code == 422
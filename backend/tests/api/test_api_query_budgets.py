@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from backend.core.configs import settings
+from backend.core.verification import new_verification_id, verification_store
+from backend.db.session import async_engine
+from backend.tests.utils.utils import random_email, random_lower_string
+
+# Maximum number of SQL queries per endpoint: a handler doing redundant queries
+# (a lookup repeated by the repository, an N+1 loop...) fails here
+QUERY_BUDGETS = {
+    # The user, then its verification email in the outbox
+    "register": 2,
+    "login": 1,
+    "get": 1,
+    "all": 1,
+    "update": 1,
+    # The verification comes from its store: UPDATE ... RETURNING by primary key
+    "verify": 1,
+    # The user for its current authorizations
+    "refresh": 1,
+    # Authorized from the token claims: DELETE ... RETURNING only
+    "delete": 1,
+}
+# Without RETURNING (SQLite), the written row is read back with another query
+NO_RETURNING_EXTRA_QUERIES = {"register": 1, "update": 1, "verify": 1, "delete": 1}
+
+
+def query_budget_of(endpoint: str) -> int:
+    budget = QUERY_BUDGETS[endpoint]
+    if not async_engine.dialect.full_returning:
+        budget += NO_RETURNING_EXTRA_QUERIES.get(endpoint, 0)
+    return budget
+
+
+@pytest.mark.anyio
+async def test_api_users_query_budgets(client, query_budget, monkeypatch):
+    monkeypatch.setattr(settings, "EMAILS_ENABLED", True)
+    api = settings.API_V1_STR
+    email, password = random_email(), random_lower_string()
+
+    def request(endpoint, method, url, **kwargs):
+        with query_budget(query_budget_of(endpoint)):
+            return client.request(method, url, **kwargs)
+
+    # The first connection of the engine runs the dialect initialization queries
+    client.get(f"{api}/users/get/0")
+
+    response = request(
+        "register",
+        "POST",
+        f"{api}/users/register",
+        data=json.dumps({"email": email, "password": password}),
+    )
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    response = request(
+        "login",
+        "POST",
+        f"{api}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+    assert response.status_code == 200
+    refresh_token = response.json()["refresh_token"]
+
+    response = request("get", "GET", f"{api}/users/get/{user_id}")
+    assert response.status_code == 200
+
+    response = request("all", "GET", f"{api}/users/all")
+    assert response.status_code == 200
+
+    response = request(
+        "update",
+        "PUT",
+        f"{api}/users/update/{user_id}",
+        data=json.dumps({"is_active": True}),
+    )
+    assert response.status_code == 200
+
+    # Only verified users can delete
+    verification_id = new_verification_id()
+    await verification_store.save(verification_id, user_id=user_id, code="ABCD")
+    response = request(
+        "verify",
+        "POST",
+        f"{api}/users/verify/{verification_id}",
+        data={"code": "ABCD"},
+    )
+    assert response.status_code == 200
+
+    response = request(
+        "refresh", "POST", f"{api}/auth/refresh", data={"refresh_token": refresh_token}
+    )
+    assert response.status_code == 200
+    cookies = {"access_token": response.cookies.get("access_token")}
+
+    response = request(
+        "delete", "DELETE", f"{api}/users/delete/{user_id}", cookies=cookies
+    )
+    assert response.status_code == 200
+
+
+def test_query_budget_exceeded(client, query_budget):
+    with pytest.raises(AssertionError, match="over the budget of 0"):
+        with query_budget(0):
+            client.get(f"{settings.API_V1_STR}/users/get/1")
@@ -0,0 +1,104 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from backend.core.configs import settings
+from backend.serve import (
+    ServerConfigurationError,
+    check_shared_state,
+    max_requests_of_worker,
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+
+def test_max_requests_of_worker():
+    assert max_requests_of_worker(0, 100) is None
+    assert max_requests_of_worker(100, 0) == 100
+    assert {max_requests_of_worker(100, 10) for _ in range(200)} <= set(range(100, 111))
+
+
+def test_check_shared_state(monkeypatch):
+    monkeypatch.setattr(settings, "JWT_KEYS_FILE", "")
+    monkeypatch.setattr(settings, "JWT_KEYS", "")
+    monkeypatch.delenv("JWT_SECRET_KEY", raising=False)
+    monkeypatch.setattr(settings, "REDIS_URL", "")
+
+    # A single worker keeps its state in its process
+    check_shared_state(1)
+    with pytest.raises(ServerConfigurationError, match="JWT_SECRET_KEY"):
+        check_shared_state(2)
+
+    monkeypatch.setenv("JWT_SECRET_KEY", "secret")
+    with pytest.raises(ServerConfigurationError, match="REDIS_URL"):
+        check_shared_state(2)
+
+    monkeypatch.setattr(settings, "REDIS_URL", "redis://redis:6379/0")
+    check_shared_state(2)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_serving(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert process.poll() is None, process.stdout.read()
+        try:
+            return httpx.get(url)
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise TimeoutError(url)
+
+
+def test_serve_recycles_workers_and_stops_gracefully(tmp_path):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{tmp_path / 'serve.db'}",
+        ASYNC_DATABASE_URL="",
+        BCRYPT_ROUNDS="4",
+        HASHING_POOL_SIZE="1",
+        PYTHONPATH=ROOT_DIR,
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "backend.serve", "--host", "127.0.0.1"]
+        + ["--port", str(port), "--workers", "1", "--max-requests", "2"]
+        + ["--max-requests-jitter", "0", "--graceful-timeout", "10"],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{settings.API_V1_STR}/openapi.json"
+        assert wait_until_serving(url, process).status_code == 200
+
+        # The worker leaves after 2 requests, and is replaced: no request is lost,
+        # connections wait in the socket backlog
+        for _ in range(3):
+            assert httpx.get(url, timeout=60).status_code == 200
+            # Workers check their requests count every 0.1s
+            time.sleep(0.2)
+
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    assert process.returncode == 0
+    assert "failed to start" not in output
+    assert "replaced" in output
+    assert "Stopping parent process" in output
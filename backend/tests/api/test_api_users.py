@@ -1,10 +1,19 @@
+import gzip
 import json
 
 import pytest
+from mock import patch
+from sqlalchemy import select
 
 from backend.core.configs import settings
-from backend.db.repository.users import get_user_by_email
-from backend.schemas.users import UserCreate
+from backend.core.verification import new_verification_id, verification_store
+from backend.db.models.outbox import OUTBOX_PENDING, EmailOutbox
+from backend.db.repository.users import (
+    get_user_by_email,
+    get_user_by_id,
+    update_user_by_id,
+)
+from backend.schemas.users import UserCreate, UserUpdate
 from backend.tests.utils.utils import random_email, random_lower_string
 
 
@@ -20,6 +29,45 @@ def test_api_register(client):
     assert not response.json().get("password")
 
 
+@pytest.mark.anyio
+@patch("emails.Message")
+async def test_api_register_queues_verification_email(mock_sendmail, client, db):
+    settings.EMAILS_ENABLED = True
+    data = {
+        "email": random_email(),
+        "password": random_lower_string(),
+    }
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 200
+
+    # The email is sent later by the outbox worker
+    assert not mock_sendmail.called
+    result = await db.execute(
+        select(EmailOutbox).where(EmailOutbox.email_to == data.get("email"))
+    )
+    email = result.scalars().one()
+    assert email.status == OUTBOX_PENDING
+    assert email.environment.get("verification_code")
+
+
+def test_api_register_duplicate_email(client):
+    data = {
+        "email": random_email(),
+        "password": random_lower_string(),
+    }
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 200
+
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Email '{data['email']}' already exist"
+
+    # Emails are case insensitive
+    data["email"] = data["email"].upper()
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 400
+
+
 def test_api_get_user(client):
     data = {
         "email": random_email(),
@@ -31,9 +79,9 @@ def test_api_get_user(client):
 
 def test_api_all_users(client):
     # Check actual users store in the database
-    first_response = client.get(f"{settings.API_V1_STR}/users/all")
+    first_response = client.get(f"{settings.API_V1_STR}/users/all?stream=true")
     assert first_response.status_code == 200
-    first_len = len(first_response.json())
+    first_len = len(first_response.text.splitlines())
 
     # Create 10 users
     for i in range(10):
@@ -48,10 +96,142 @@ def test_api_all_users(client):
     response = client.get(f"{settings.API_V1_STR}/users/all")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
-    assert len(response.json()) == 10 + first_len
+
+    # The whole table is only available as a stream of JSON lines
+    response = client.get(f"{settings.API_V1_STR}/users/all?stream=true")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert len(users) == 10 + first_len
+    assert all(user.get("email") for user in users)
+
+
+@pytest.mark.anyio
+async def test_api_all_users_pagination(client, db):
+    emails = [random_email() for _ in range(3)]
+    for email in emails:
+        data = {"email": email, "password": random_lower_string()}
+        client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    first_user = await get_user_by_email(email=emails[0], db=db)
+
+    response = client.get(
+        f"{settings.API_V1_STR}/users/all",
+        params={"after_id": first_user.id - 1, "limit": 2},
+    )
+    assert response.status_code == 200
+    assert [user["email"] for user in response.json()] == emails[:2]
+    next_after_id = response.headers["X-Next-After-Id"]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/users/all",
+        params={"after_id": next_after_id, "limit": 2},
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["email"] == emails[2]
+    assert "X-Next-After-Id" not in response.headers
+
+    # An exhausted cursor gives an empty page
+    response = client.get(
+        f"{settings.API_V1_STR}/users/all", params={"after_id": 2**31 - 1}
+    )
+    assert response.status_code == 200
+    assert response.json() == []
+
+    # Page size is bounded
+    response = client.get(f"{settings.API_V1_STR}/users/all", params={"limit": 10**6})
+    assert response.status_code == 422
+
+
+async def login_verified_user(client, db) -> str:
+    """Register a verified user, logged in through the client cookies"""
+    email = random_email()
+    password = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": email, "password": password}),
+    )
+    user = await get_user_by_email(email=email, db=db)
+    await update_user_by_id(user_id=user.id, user=UserUpdate(is_verified=True), db=db)
+    client.post(
+        f"{settings.API_V1_STR}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+    return email
+
+
+@pytest.mark.anyio
+async def test_api_bulk_register(client, db, monkeypatch):
+    email = await login_verified_user(client, db)
+    monkeypatch.setattr(settings, "BULK_REGISTER_ALLOWED_EMAILS", [email.lower()])
+
+    existing_email = random_email()
+    client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": existing_email, "password": random_lower_string()}),
+    )
+    new_email = random_email()
+    data = [
+        {"email": new_email, "password": random_lower_string()},
+        {"email": existing_email, "password": random_lower_string()},
+        {"email": "not-an-email", "password": random_lower_string()},
+        {"email": new_email, "password": random_lower_string()},
+    ]
+
+    response = client.post(
+        f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data)
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status"] for result in results] == [
+        "created",
+        "duplicate",
+        "invalid",
+        "duplicate",
+    ]
+    assert results[2]["errors"]
+
+    created_user = await get_user_by_email(email=new_email, db=db)
+    assert created_user.id == results[0]["id"]
+    assert created_user.is_active is True
+
+    data = [{"email": random_email(), "password": random_lower_string()}] * (
+        settings.BULK_REGISTER_MAX_USERS + 1
+    )
+    response = client.post(
+        f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data)
+    )
+    assert response.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_api_bulk_register_restricted(client, db, monkeypatch):
+    data = [{"email": random_email(), "password": random_lower_string()}]
+
+    # Verified, but not in BULK_REGISTER_ALLOWED_EMAILS
+    await login_verified_user(client, db)
+    response = client.post(
+        f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data)
+    )
+    assert response.status_code == 403
+
+    client.post(f"{settings.API_V1_STR}/auth/logout")
+    response = client.post(
+        f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data)
+    )
+    assert response.status_code == 401
+
+    # Counted before the authorization, like the registrations of the client
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    for _ in range(settings.REGISTER_RATE_LIMIT_PER_IP):
+        client.post(f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data))
+    response = client.post(
+        f"{settings.API_V1_STR}/users/bulk-register", json.dumps(data)
+    )
+    assert response.status_code == 429
 
 
-def test_api_update_user(client, db):
+@pytest.mark.anyio
+async def test_api_update_user(client, db):
     data = {
         "email": random_email(),
         "password": random_lower_string(),
@@ -61,7 +241,7 @@ def test_api_update_user(client, db):
 
     response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
     assert response.status_code == 200
-    created_user = get_user_by_email(email=data.get("email"), db=db)
+    created_user = await get_user_by_email(email=data.get("email"), db=db)
 
     response_up = client.put(
         f"{settings.API_V1_STR}/users/update/{created_user.id}",
@@ -71,8 +251,80 @@ def test_api_update_user(client, db):
     assert response_up.json().get("detail") == "Successfully updated"
 
 
+def test_api_update_unknown_user(client):
+    response = client.put(
+        f"{settings.API_V1_STR}/users/update/{2**31 - 1}",
+        data=json.dumps({"is_verified": True}),
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_api_delete_user_as_verified_user(client, db):
+    email = random_email()
+    password = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": email, "password": password}),
+    )
+    user = await get_user_by_email(email=email, db=db)
+    await update_user_by_id(user_id=user.id, user=UserUpdate(is_verified=True), db=db)
+    client.post(
+        f"{settings.API_V1_STR}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+
+    data = {"email": random_email(), "password": random_lower_string()}
+    client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    user_to_delete = await get_user_by_email(email=data.get("email"), db=db)
+
+    response = client.delete(f"{settings.API_V1_STR}/users/delete/{user_to_delete.id}")
+    assert response.status_code == 200
+
+    response = client.delete(f"{settings.API_V1_STR}/users/delete/{user_to_delete.id}")
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_api_export_users(client, db):
+    email = random_email()
+    password = random_lower_string()
+    client.post(
+        f"{settings.API_V1_STR}/users/register",
+        json.dumps({"email": email, "password": password}),
+    )
+    user = await get_user_by_email(email=email, db=db)
+    await update_user_by_id(user_id=user.id, user=UserUpdate(is_verified=True), db=db)
+    client.post(
+        f"{settings.API_V1_STR}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+
+    response = client.get(
+        f"{settings.API_V1_STR}/users/export",
+        params={
+            "format": "ndjson",
+            "columns": ["id", "email"],
+            "gzip": True,
+            "is_verified": True,
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    lines = gzip.decompress(response.content).decode().splitlines()
+    users = [json.loads(line) for line in lines]
+    assert {"id": user.id, "email": email} in users
+    assert all(set(user) == {"id", "email"} for user in users)
+
+    response = client.get(
+        f"{settings.API_V1_STR}/users/export", params={"columns": "hashed_password"}
+    )
+    assert response.status_code == 400
+
+
 @pytest.mark.skip
-def test_api_delete_user(client, db, verified_user_token_headers):  # FIXME
+@pytest.mark.anyio
+async def test_api_delete_user(client, db, verified_user_token_headers):  # FIXME
     """
     Only users which have verified their email address can delete a record
     """
@@ -82,7 +334,7 @@ def test_api_delete_user(client, db, verified_user_token_headers):  # FIXME
     }
 
     response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
-    user_to_delete = get_user_by_email(email=data.get("email"), db=db)
+    user_to_delete = await get_user_by_email(email=data.get("email"), db=db)
 
     response = client.post(
         f"{settings.API_V1_STR}/users/delete/{user_to_delete.id}",
@@ -90,3 +342,57 @@ def test_api_delete_user(client, db, verified_user_token_headers):  # FIXME
         headers=verified_user_token_headers,
     )
     assert response.status_code == 200
+
+
+def test_api_register_rate_limited_by_email(client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    data = {"email": random_email(), "password": random_lower_string()}
+
+    for _ in range(settings.REGISTER_RATE_LIMIT_PER_EMAIL):
+        client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+@pytest.mark.anyio
+async def test_api_verify_email(client, db, monkeypatch):
+    monkeypatch.setattr(settings, "EMAILS_ENABLED", True)
+    data = {"email": random_email(), "password": random_lower_string()}
+    response = client.post(f"{settings.API_V1_STR}/users/register", json.dumps(data))
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    result = await db.execute(
+        select(EmailOutbox).where(EmailOutbox.email_to == data["email"])
+    )
+    environment = result.scalars().one().environment
+    url = f"{settings.API_V1_STR}/users/verify/{environment['verification_id']}"
+    assert environment["link"].endswith(url)
+
+    response = client.post(url, data={"code": "0000"})
+    assert response.status_code == 400
+    assert "attempts left" in response.json()["detail"]
+
+    response = client.post(url, data={"code": environment["verification_code"]})
+    assert response.status_code == 200
+    user = await get_user_by_id(user_id=user_id, db=db)
+    await db.refresh(user)
+    assert user.is_verified
+    assert user.validation_date
+
+    # A link is used once
+    response = client.post(url, data={"code": environment["verification_code"]})
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_api_verify_email_locked_after_max_attempts(client):
+    verification_id = new_verification_id()
+    await verification_store.save(verification_id, user_id=1, code="ABCD")
+    url = f"{settings.API_V1_STR}/users/verify/{verification_id}"
+
+    for _ in range(verification_store.max_attempts):
+        assert client.post(url, data={"code": "WXYZ"}).status_code == 400
+    assert client.post(url, data={"code": "ABCD"}).status_code == 404
@@ -1,10 +1,12 @@
 import os
 import sys
-from typing import Dict, Generator
+from contextlib import contextmanager
+from typing import AsyncGenerator, Callable, ContextManager, Dict, Generator
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
 
 # this is to include backend dir in sys.path so that we can import from db,main.py
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,15 +14,38 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 
 sys.path.append(BASE_DIR)
 
+# Tests register and log in many users from the same client
+os.environ.setdefault("RATE_LIMIT_ENABLED", "False")
+
 from core.configs import settings
-from db.session import SessionLocal
 from main import app
 from tests.utils.users import authentication_token_from_email
 
+from backend.db.base import Base
+from backend.db.query_counter import QueryCounter, count_queries
+from backend.db.session import async_engine, engine
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def create_tables() -> None:
+    # The application only creates them on startup
+    Base.metadata.create_all(bind=engine)
+
 
 @pytest.fixture(scope="session")
-def db() -> Generator:
-    yield SessionLocal()
+async def db(anyio_backend) -> AsyncGenerator:
+    # The application runs in the TestClient event loop, so tests use their own
+    # engine: pooled async connections can't be shared between event loops.
+    # Any async URL works, e.g. ASYNC_DATABASE_URL=sqlite+aiosqlite:///./test.db
+    engine = create_async_engine(settings.ASYNC_DATABASE_URL, poolclass=NullPool)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+    await engine.dispose()
 
 
 @pytest.fixture(scope="module")
@@ -30,14 +55,37 @@ def client() -> Generator:
 
 
 @pytest.fixture(scope="module")
-def normal_user_token_headers(client: TestClient, db: Session) -> Dict[str, str]:
-    return authentication_token_from_email(
+async def normal_user_token_headers(
+    client: TestClient, db: AsyncSession, anyio_backend
+) -> Dict[str, str]:
+    return await authentication_token_from_email(
         client=client, email=settings.EMAIL_TEST_USER, db=db
     )
 
 
 @pytest.fixture(scope="module")
-def verified_user_token_headers(client: TestClient, db: Session) -> Dict[str, str]:
-    return authentication_token_from_email(
+async def verified_user_token_headers(
+    client: TestClient, db: AsyncSession, anyio_backend
+) -> Dict[str, str]:
+    return await authentication_token_from_email(
         client=client, email=settings.EMAIL_TEST_USER, db=db, kwargs={"is_verify": True}
     )
+
+
+@pytest.fixture
+def query_budget() -> Callable[[int], ContextManager[QueryCounter]]:
+    """Fail when the block runs more than 'max_queries' queries in the application
+
+    with query_budget(2):
+        client.get(...)
+    """
+
+    @contextmanager
+    def budget(max_queries: int) -> Generator:
+        with count_queries(engine, async_engine.sync_engine) as counter:
+            yield counter
+        assert (
+            counter.count <= max_queries
+        ), f"{counter.count} queries, over the budget of {max_queries}:\n{counter}"
+
+    return budget
@@ -0,0 +1,20 @@
+from backend.core.configs import get_async_database_url
+
+
+def test_get_async_database_url():
+    assert (
+        get_async_database_url("postgresql://user:pw@db:5432/dailymotion")
+        == "postgresql+asyncpg://user:pw@db:5432/dailymotion"
+    )
+    assert (
+        get_async_database_url("postgresql+psycopg2://user:pw@db/dailymotion")
+        == "postgresql+asyncpg://user:pw@db/dailymotion"
+    )
+    assert (
+        get_async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    )
+    # Already async or unknown backends are kept as is
+    assert (
+        get_async_database_url("postgresql+asyncpg://db/dailymotion")
+        == "postgresql+asyncpg://db/dailymotion"
+    )
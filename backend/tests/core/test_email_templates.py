@@ -0,0 +1,71 @@
+import os
+
+from backend.core.email_templates import EmailTemplates, email_templates
+from backend.tests.utils.utils import random_email
+
+
+def test_render_verification_email():
+    email_templates.load()
+    assert "new_account.html" in email_templates.templates
+
+    html = email_templates.render(
+        "new_account.html",
+        {
+            "project_name": "Test project",
+            "verification_code": "ABCD",
+            "email": "user@dailymotion.local",
+            "link": "http://app/api/v1/verify/token",
+        },
+    )
+    assert "ABCD" in html
+    assert "http://app/api/v1/verify/token" in html
+
+
+def test_render_many(tmp_path):
+    (tmp_path / "notice.html").write_text("<p>{{ greeting }} {{ email }}</p>")
+    templates = EmailTemplates(directory=str(tmp_path))
+    templates.load()
+
+    recipients = [random_email() for _ in range(3)]
+    rendered = list(
+        templates.render_many(
+            "notice.html",
+            ({"email": email} for email in recipients),
+            common={"greeting": "Hello"},
+        )
+    )
+    assert rendered == [f"<p>Hello {email}</p>" for email in recipients]
+
+
+def test_loaded_templates_dont_read_files(tmp_path):
+    template_file = tmp_path / "notice.html"
+    template_file.write_text("<p>{{ email }}</p>")
+    templates = EmailTemplates(directory=str(tmp_path))
+    templates.load()
+
+    os.remove(template_file)
+    assert templates.render("notice.html", {"email": "a@b.c"}) == "<p>a@b.c</p>"
+
+
+def test_templates_auto_reload(tmp_path):
+    template_file = tmp_path / "notice.html"
+    template_file.write_text("<p>{{ email }}</p>")
+    templates = EmailTemplates(directory=str(tmp_path), auto_reload=True)
+    templates.load()
+    assert templates.render("notice.html", {"email": "a@b.c"}) == "<p>a@b.c</p>"
+
+    template_file.write_text("<div>{{ email }}</div>")
+    # Make sure the modification time changes
+    stat = os.stat(template_file)
+    os.utime(template_file, (stat.st_atime, stat.st_mtime + 10))
+    assert templates.render("notice.html", {"email": "a@b.c"}) == "<div>a@b.c</div>"
+
+
+def test_render_string_is_compiled_once():
+    subject = "{{ project_name }} - Activate your account"
+    assert email_templates.render_string(subject, {"project_name": "DM"}) == (
+        "DM - Activate your account"
+    )
+    assert email_templates.get_from_string(subject) is email_templates.get_from_string(
+        subject
+    )
@@ -0,0 +1,58 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+from backend.core.exports import ExportEncoder
+
+ROWS = [
+    (1, "user1@example.com", datetime(2022, 3, 27, 12, 30)),
+    (2, "user2@example.com", None),
+]
+COLUMNS = ["id", "email", "validation_date"]
+
+
+def encode(encoder: ExportEncoder) -> bytes:
+    return (
+        encoder.header()
+        + encoder.encode(ROWS[:1])
+        + encoder.encode(ROWS[1:])
+        + encoder.finish()
+    )
+
+
+def test_export_encoder_csv():
+    encoder = ExportEncoder(COLUMNS, file_format="csv")
+    rows = list(csv.reader(io.StringIO(encode(encoder).decode())))
+
+    assert encoder.media_type == "text/csv"
+    assert encoder.rows == 2
+    assert rows == [
+        COLUMNS,
+        ["1", "user1@example.com", "2022-03-27T12:30:00"],
+        ["2", "user2@example.com", ""],
+    ]
+
+
+def test_export_encoder_ndjson_gzip():
+    encoder = ExportEncoder(COLUMNS, file_format="ndjson", compress=True)
+    lines = gzip.decompress(encode(encoder)).decode().splitlines()
+
+    assert encoder.media_type == "application/gzip"
+    assert encoder.extension == "ndjson.gz"
+    assert [json.loads(line) for line in lines] == [
+        {
+            "id": 1,
+            "email": "user1@example.com",
+            "validation_date": "2022-03-27T12:30:00",
+        },
+        {"id": 2, "email": "user2@example.com", "validation_date": None},
+    ]
+
+
+def test_export_encoder_unknown_format():
+    with pytest.raises(ValueError):
+        ExportEncoder(COLUMNS, file_format="parquet")
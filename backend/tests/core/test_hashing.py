@@ -0,0 +1,120 @@
+import pytest
+
+from backend.core.hashing import (
+    BCRYPT_MAX_ROUNDS,
+    BCRYPT_MIN_ROUNDS,
+    Hasher,
+    HashingQueueFull,
+    HashingService,
+    calibrate_bcrypt_rounds,
+    pwd_context,
+)
+from backend.tests.utils.utils import random_lower_string
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_hashing_service_sync_fallback():
+    """
+    Without a started pool, the service hashes in the calling process
+    """
+    service = HashingService(pool_size=2, max_pending=10)
+    password = random_lower_string()
+
+    assert not service.started
+    hashed = await service.hash(password)
+
+    assert Hasher.verify_password(password, hashed)
+    assert await service.verify(password, hashed)
+    assert service.verify_sync(password, hashed)
+    assert not service.verify_sync(random_lower_string(), hashed)
+
+
+async def test_hashing_service_process_pool():
+    service = HashingService(pool_size=1, max_pending=10)
+    password = random_lower_string()
+
+    service.start()
+    try:
+        assert service.started
+        hashed = await service.hash(password)
+        assert await service.verify(password, hashed)
+        assert not await service.verify(random_lower_string(), hashed)
+    finally:
+        service.shutdown()
+
+    snapshot = service.snapshot()
+    assert snapshot["pending"] == 0
+    assert snapshot["operations"]["hash"]["calls"] == 1
+    assert snapshot["operations"]["verify"]["calls"] == 2
+    assert snapshot["operations"]["verify"]["total_seconds"] > 0
+
+
+async def test_hashing_service_warm_up():
+    service = HashingService(pool_size=2, max_pending=10)
+    # Nothing to warm up without a pool
+    await service.warm_up()
+
+    service.start()
+    try:
+        await service.warm_up()
+        assert len(service._executor._processes) == 2
+    finally:
+        service.shutdown()
+    # Not counted as hashing operations
+    assert service.snapshot()["operations"] == {}
+
+
+async def test_hashing_service_bounded_queue():
+    service = HashingService(pool_size=1, max_pending=0)
+
+    service.start()
+    try:
+        with pytest.raises(HashingQueueFull):
+            await service.hash(random_lower_string())
+    finally:
+        service.shutdown()
+
+
+async def test_hashing_service_hash_many():
+    service = HashingService(pool_size=2, max_pending=10)
+    passwords = [random_lower_string() for _ in range(5)]
+
+    assert await service.hash_many([]) == []
+
+    service.start()
+    try:
+        hashed_passwords = await service.hash_many(passwords)
+    finally:
+        service.shutdown()
+
+    assert len(hashed_passwords) == len(passwords)
+    for password, hashed in zip(passwords, hashed_passwords):
+        assert Hasher.verify_password(password, hashed)
+    # One job per worker
+    assert service.snapshot()["operations"]["hash_many"]["calls"] == 2
+
+
+def test_calibrate_bcrypt_rounds():
+    rounds = calibrate_bcrypt_rounds(target_ms=250)
+    assert BCRYPT_MIN_ROUNDS <= rounds <= BCRYPT_MAX_ROUNDS
+    assert calibrate_bcrypt_rounds(target_ms=10**6) == BCRYPT_MAX_ROUNDS
+    assert calibrate_bcrypt_rounds(target_ms=0.001) == BCRYPT_MIN_ROUNDS
+
+
+async def test_hashing_service_verify_and_update():
+    service = HashingService(pool_size=0, max_pending=10)
+    service.start()
+    password = random_lower_string()
+    outdated_hash = pwd_context.handler("bcrypt").using(rounds=4).hash(password)
+
+    verified, new_hash = await service.verify_and_update(password, outdated_hash)
+    assert verified
+    assert pwd_context.handler("bcrypt").from_string(new_hash).rounds == service.rounds
+
+    # Up to date hashes are kept
+    assert await service.verify_and_update(password, new_hash) == (True, None)
+    assert await service.verify_and_update(random_lower_string(), new_hash) == (
+        False,
+        None,
+    )
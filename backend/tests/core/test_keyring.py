@@ -0,0 +1,115 @@
+import json
+import os
+
+import pytest
+from jose import jwt
+from jose.exceptions import JWTError
+
+from backend.core.keyring import JWTKey, Keyring, KeyringError
+from backend.core.security import decode_jwt, generate_jwt
+from backend.tools.jwt_keys import generate_key_data
+
+
+def test_keyring_hmac():
+    keyring = Keyring([JWTKey("first", "HS256", "secret")])
+    token = keyring.encode({"sub": "user@example.com"})
+
+    assert jwt.get_unverified_header(token)["kid"] == "first"
+    assert keyring.decode(token) == {"sub": "user@example.com"}
+    # Secrets aren't published
+    assert keyring.jwks() == {"keys": []}
+
+    # Tokens without kid are checked with the signing key
+    assert keyring.decode(jwt.encode({"sub": "old"}, "secret")) == {"sub": "old"}
+    with pytest.raises(JWTError):
+        keyring.decode(jwt.encode({"sub": "old"}, "other secret"))
+
+
+def test_keyring_asymmetric():
+    private_key = JWTKey("ec", "ES256", generate_key_data("ES256"))
+    keyring = Keyring([private_key])
+    token = generate_jwt({"sub": "user@example.com"}, keyring=keyring)
+    assert decode_jwt(token, keyring=keyring)["sub"] == "user@example.com"
+
+    # Another service verifies the tokens with the public key only
+    (public_jwk,) = keyring.jwks()["keys"]
+    assert public_jwk["kid"] == "ec" and "d" not in public_jwk
+    public_key = JWTKey("ec", "ES256", public_jwk)
+    assert not public_key.can_sign
+    verifier = Keyring([public_key])
+    assert verifier.decode(token)["sub"] == "user@example.com"
+    with pytest.raises(KeyringError):
+        verifier.encode({"sub": "user@example.com"})
+
+    # A token can't pick the algorithm of another key
+    forged = jwt.encode({"sub": "admin@example.com"}, "secret", headers={"kid": "ec"})
+    with pytest.raises(JWTError):
+        keyring.decode(forged)
+
+
+def test_keyring_rotation():
+    now = [1000.0]
+    keyring = Keyring(
+        [
+            JWTKey("old", "HS256", "old secret", expires=2000.0),
+            JWTKey("new", "HS256", "new secret", not_before=1500.0),
+        ],
+        timer=lambda: now[0],
+    )
+    old_token = keyring.encode({"sub": "user@example.com"})
+    assert jwt.get_unverified_header(old_token)["kid"] == "old"
+
+    # The next key is accepted before it signs, the old one until it expires
+    now[0] = 1500.0
+    new_token = keyring.encode({"sub": "user@example.com"})
+    assert jwt.get_unverified_header(new_token)["kid"] == "new"
+    assert keyring.decode(old_token) and keyring.decode(new_token)
+
+    now[0] = 2000.0
+    with pytest.raises(JWTError):
+        keyring.decode(old_token)
+    assert keyring.decode(new_token)
+
+
+def test_keyring_invalid_keys():
+    with pytest.raises(KeyringError):
+        JWTKey("aes", "A128GCM", "secret")
+    with pytest.raises(KeyringError):
+        JWTKey("ec", "ES256", "not a PEM key")
+    with pytest.raises(KeyringError):
+        Keyring([JWTKey("same", "HS256", "a"), JWTKey("same", "HS256", "b")])
+
+
+def test_keyring_file_reload(tmp_path):
+    now = [0.0]
+    path = tmp_path / "keys.json"
+    (tmp_path / "ec.pem").write_text(generate_key_data("ES256"))
+    path.write_text(json.dumps({"keys": [{"kid": "a", "alg": "HS256", "key": "a"}]}))
+    keyring = Keyring.from_file(str(path), reload_seconds=10, timer=lambda: now[0])
+    assert keyring.signing_key().kid == "a"
+
+    config = {
+        "keys": [
+            {"kid": "a", "alg": "HS256", "key": "a", "expires": 100},
+            {
+                "kid": "b",
+                "alg": "ES256",
+                "key_file": "ec.pem",
+                "not_before": "1970-01-01T00:00:50",
+            },
+        ]
+    }
+    path.write_text(json.dumps(config))
+    os.utime(path, (1, 1))
+    # Checked every 'reload_seconds'
+    now[0] = 5.0
+    assert sorted(keyring.keys) == ["a"]
+    now[0] = 60.0
+    assert keyring.signing_key().kid == "b"
+    assert sorted(keyring.keys) == ["a", "b"]
+
+    # An invalid file is ignored, the keys are kept
+    path.write_text("{")
+    os.utime(path, (2, 2))
+    now[0] = 80.0
+    assert keyring.signing_key().kid == "b"
@@ -0,0 +1,49 @@
+from backend.core.metrics import Counter, Histogram, Registry
+
+
+def test_counter_samples():
+    counter = Counter("requests_total", "Requests", ["method"])
+    counter.inc(method="GET")
+    counter.inc(2, method="GET")
+    counter.inc(method="POST")
+
+    assert list(counter.samples()) == [
+        'requests_total{method="GET"} 3',
+        'requests_total{method="POST"} 1',
+    ]
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    assert list(histogram.samples()) == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_histogram_time():
+    histogram = Histogram("task_seconds", "Task", ["task"])
+    with histogram.time(task="sleep"):
+        pass
+
+    assert 'task_seconds_count{task="sleep"} 1' in histogram.samples()
+
+
+def test_registry_render():
+    registry = Registry()
+    counter = registry.register(Counter("errors_total", 'Errors, "quoted"', ["path"]))
+    counter.inc(path='/a"b')
+
+    assert registry.render() == (
+        '# HELP errors_total Errors, "quoted"\n'
+        "# TYPE errors_total counter\n"
+        'errors_total{path="/a\\"b"} 1\n'
+    )
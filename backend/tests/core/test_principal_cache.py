@@ -0,0 +1,31 @@
+from backend.core.principal_cache import PrincipalCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_claims_never_outlive_token_expiration():
+    timer = FakeTimer()
+    cache = PrincipalCache(maxsize=10, claims_ttl=300, timer=timer)
+
+    cache.set_claims("token", {"sub": "user", "exp": timer.now + 10})
+    assert cache.get_claims("token")
+
+    timer.now += 11
+    assert cache.get_claims("token") is None
+    assert cache.counters["claims_hits"] == 1
+    assert cache.counters["claims_misses"] == 1
+
+
+def test_claims_ttl():
+    timer = FakeTimer()
+    cache = PrincipalCache(maxsize=10, claims_ttl=300, timer=timer)
+
+    cache.set_claims("token", {"sub": "user", "exp": timer.now + 3600})
+    timer.now += 301
+    assert cache.get_claims("token") is None
@@ -0,0 +1,67 @@
+import cProfile
+import os
+from datetime import timedelta
+
+from backend.core.profiling import (
+    ProfileStore,
+    RequestProfiler,
+    generate_profiling_token,
+    is_valid_profiling_token,
+)
+from backend.core.security import generate_jwt
+
+
+def save_profile(store, profile_id, mtime):
+    store.save(cProfile.Profile(), profile_id)
+    os.utime(store.path(profile_id), (mtime, mtime))
+
+
+def test_profile_store_ring(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=2)
+    first, second, third = ("a" * 32, "b" * 32, "c" * 32)
+    save_profile(store, first, 1000)
+    save_profile(store, second, 2000)
+    save_profile(store, third, 3000)
+
+    # The oldest profile was removed
+    assert store.profile_ids() == [third, second]
+    assert store.path(first) is None
+    assert store.path(third).endswith(f"{third}.pstats")
+
+
+def test_profile_store_rejects_invalid_ids(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=2)
+    assert store.path("../../etc/passwd") is None
+    assert ProfileStore(str(tmp_path / "missing"), max_files=2).profile_ids() == []
+
+
+def test_profiling_token():
+    assert is_valid_profiling_token(generate_profiling_token())
+    assert not is_valid_profiling_token("not a token")
+    assert not is_valid_profiling_token(
+        generate_profiling_token(expires_delta=timedelta(seconds=-1))
+    )
+    # Access tokens don't enable profiling
+    assert not is_valid_profiling_token(generate_jwt({"sub": "user@example.com"}))
+
+
+def test_request_profiler_selection(tmp_path):
+    draws = [0.5, 0.05]
+    profiler = RequestProfiler(
+        ProfileStore(str(tmp_path), max_files=2),
+        sample_rate=0.1,
+        random=lambda: draws.pop(0),
+    )
+
+    assert profiler.should_profile(generate_profiling_token())
+    assert not profiler.should_profile(None)
+    assert profiler.should_profile(None)
+
+    profiler.sample_rate = 0
+    assert not profiler.should_profile("invalid")
+    profiler.profile_all = True
+    assert profiler.should_profile(None)
+
+    # One profile at a time
+    profiler.running = True
+    assert not profiler.should_profile(generate_profiling_token())
@@ -0,0 +1,61 @@
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.core.configs import settings
+from backend.core.rate_limit import (
+    MemoryRateLimitBackend,
+    RateLimiter,
+    RateLimitExceeded,
+    RedisRateLimitBackend,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def rate_limit_enabled(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+
+
+async def test_memory_backend_sliding_window():
+    now = [1000.0]
+    backend = MemoryRateLimitBackend(window=60, timer=lambda: now[0])
+    limiter = RateLimiter("test", limit=2, window=60, backend=backend)
+
+    await limiter.check("127.0.0.1")
+    now[0] += 30
+    await limiter.check("127.0.0.1")
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.check("127.0.0.1")
+    # The first hit leaves the window in 30 seconds
+    assert exc_info.value.retry_after == pytest.approx(30)
+
+    # Keys are counted separately
+    await limiter.check("10.0.0.1")
+
+    now[0] += 31
+    await limiter.check("127.0.0.1")
+
+
+async def test_redis_backend_sliding_window():
+    backend = RedisRateLimitBackend(FakeRedis())
+    limiter = RateLimiter("test", limit=2, window=60, backend=backend)
+
+    await limiter.check("user@example.com")
+    await limiter.check("user@example.com")
+    for _ in range(3):
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            await limiter.check("user@example.com")
+        assert 0 < exc_info.value.retry_after <= 60
+
+    # Rejected hits aren't recorded
+    assert await backend.redis.zcard("rate-limit:test:user@example.com") == 2
+    await backend.close()
+
+
+async def test_rate_limit_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    limiter = RateLimiter(
+        "test", limit=0, window=60, backend=MemoryRateLimitBackend(window=60)
+    )
+    await limiter.check("127.0.0.1")
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.core.revocation import (
+    BloomFilter,
+    MemoryRevocationStore,
+    MemoryUsedTokenStore,
+    RedisRevocationStore,
+    RedisUsedTokenStore,
+    TokenDenylist,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    for index in range(1000):
+        bloom_filter.add(f"revoked-{index}")
+
+    # No false negatives, and about 'error_rate' false positives
+    assert all(f"revoked-{index}" in bloom_filter for index in range(1000))
+    false_positives = sum(f"valid-{index}" in bloom_filter for index in range(10000))
+    assert false_positives < 300
+    # About 1.2 bytes per item at 1%
+    assert len(bloom_filter.bits) < 1300
+
+
+def make_denylist(store, now):
+    return TokenDenylist(
+        store,
+        bucket_seconds=1800,
+        capacity=1000,
+        error_rate=0.01,
+        sync_seconds=1,
+        timer=lambda: now[0],
+    )
+
+
+async def test_denylist_revoke():
+    now = [1_000_000.0]
+    denylist = make_denylist(MemoryRevocationStore(timer=lambda: now[0]), now)
+    exp = now[0] + 1800
+
+    assert not await denylist.is_revoked("jti", exp)
+    await denylist.revoke("jti", exp)
+    assert await denylist.is_revoked("jti", exp)
+    assert not await denylist.is_revoked("other-jti", exp)
+
+
+async def test_denylist_shared_between_workers():
+    now = [1_000_000.0]
+    redis = FakeRedis()
+    worker_1 = make_denylist(RedisRevocationStore(redis, max_token_seconds=1800), now)
+    worker_2 = make_denylist(RedisRevocationStore(redis, max_token_seconds=1800), now)
+    exp = now[0] + 1800
+
+    assert not await worker_2.is_revoked("jti", exp)
+    await worker_1.revoke("jti", exp)
+
+    # Seen by the other worker at its next sync
+    now[0] += 1
+    assert await worker_2.is_revoked("jti", exp)
+    assert worker_2.snapshot()["bloom_hits"] == 1
+
+
+async def test_denylist_drops_expired_filters():
+    now = [1_000_000.0]
+    denylist = make_denylist(MemoryRevocationStore(timer=lambda: now[0]), now)
+    await denylist.revoke("jti", now[0] + 1800)
+    assert denylist.snapshot()["filters"] == 1
+
+    now[0] += 3600
+    await denylist.sync()
+    assert denylist.snapshot()["filters"] == 0
+
+
+async def test_memory_store_drops_expired_revocations():
+    now = [1_000_000.0]
+    store = MemoryRevocationStore(timer=lambda: now[0])
+    await store.revoke("old", now[0] + 10)
+    await store.revoke("new", now[0] + 1800)
+
+    now[0] += 60
+    await store.revoke("last", now[0] + 1800)
+    assert set(store.revoked) == {"new", "last"}
+
+
+async def test_memory_used_token_store():
+    now = [1_000_000.0]
+    store = MemoryUsedTokenStore(timer=lambda: now[0])
+    exp = now[0] + 60
+
+    assert await store.use("jti", exp)
+    assert not await store.use("jti", exp)
+    assert await store.use("other-jti", exp)
+
+    # Forgotten once expired
+    now[0] += 120
+    await store.use("new-jti", now[0] + 60)
+    assert set(store.used) == {"new-jti"}
+
+
+async def test_redis_used_token_store_single_winner():
+    redis = FakeRedis()
+    workers = [RedisUsedTokenStore(redis), RedisUsedTokenStore(redis)]
+    exp = time.time() + 60
+
+    uses = await asyncio.gather(*(worker.use("jti", exp) for worker in workers * 5))
+    assert uses.count(True) == 1
+    assert 0 < await redis.ttl("used-token:jti") <= 60
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from backend.core.verification import (
+    InvalidVerificationCode,
+    MemoryVerificationStore,
+    RedisVerificationStore,
+    VerificationNotFound,
+    new_verification_id,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request, anyio_backend):
+    if request.param == "memory":
+        return MemoryVerificationStore(ttl=60, max_attempts=3)
+    return RedisVerificationStore(FakeRedis(), ttl=60, max_attempts=3)
+
+
+async def test_verification_is_consumed_once(store):
+    verification_id = new_verification_id()
+    await store.save(verification_id, user_id=42, code="ABCD")
+
+    # Codes are case insensitive
+    assert await store.consume(verification_id, "abcd") == 42
+    with pytest.raises(VerificationNotFound):
+        await store.consume(verification_id, "ABCD")
+
+
+async def test_verification_locked_after_max_attempts(store):
+    verification_id = new_verification_id()
+    await store.save(verification_id, user_id=42, code="ABCD")
+
+    for attempts_left in (2, 1, 0):
+        with pytest.raises(InvalidVerificationCode) as exc_info:
+            await store.consume(verification_id, "WXYZ")
+        assert exc_info.value.attempts_left == attempts_left
+
+    # Even the right code is rejected once locked
+    with pytest.raises(VerificationNotFound):
+        await store.consume(verification_id, "ABCD")
+
+
+async def test_concurrent_consumes_succeed_once(store):
+    verification_id = new_verification_id()
+    await store.save(verification_id, user_id=42, code="ABCD")
+
+    results = await asyncio.gather(
+        *(store.consume(verification_id, "ABCD") for _ in range(5)),
+        return_exceptions=True,
+    )
+    assert results.count(42) == 1
+    assert all(
+        isinstance(result, VerificationNotFound) for result in results if result != 42
+    )
+
+
+async def test_save_many(store):
+    await store.save_many([("first", 1, "AAAA"), ("second", 2, "BBBB")])
+    assert await store.consume("second", "BBBB") == 2
+    assert await store.consume("first", "AAAA") == 1
+
+
+async def test_memory_verification_expires():
+    now = [1000.0]
+    store = MemoryVerificationStore(ttl=60, max_attempts=3, timer=lambda: now[0])
+    await store.save("verification", user_id=42, code="ABCD")
+
+    now[0] += 61
+    with pytest.raises(VerificationNotFound):
+        await store.consume("verification", "ABCD")
+
+
+async def test_redis_verification_expires():
+    store = RedisVerificationStore(FakeRedis(), ttl=60, max_attempts=3)
+    await store.save("verification", user_id=42, code="ABCD")
+    assert 0 < await store.redis.ttl("verification:verification") <= 60
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from backend.core.configs import settings
+from backend.db.pool import PoolStats, instrumented_pool_class, track_pool_stats
+from backend.db.session import get_engine_options, open_pool_connections
+
+
+def test_pool_stats_wait_histogram():
+    stats = PoolStats("test")
+    stats.observe_wait(0.0005)
+    stats.observe_wait(0.2)
+    stats.observe_wait(60)
+
+    snapshot = stats.snapshot()
+    buckets = snapshot["wait_seconds"]["buckets"]
+    assert buckets["0.001"] == 1
+    assert buckets["0.5"] == 1
+    assert buckets["inf"] == 1
+    assert snapshot["wait_seconds"]["max"] == 60
+
+
+def test_instrumented_pool_tracks_checkouts_and_churn():
+    stats = PoolStats("test")
+    engine = create_engine(
+        "sqlite://", poolclass=instrumented_pool_class(QueuePool, stats), pool_size=1
+    )
+    track_pool_stats(engine, stats)
+
+    for _ in range(3):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            assert stats.snapshot()["checked_out"] == 1
+
+    engine.dispose()
+    snapshot = stats.snapshot()
+    assert snapshot["checkouts"] == 3
+    assert snapshot["checkins"] == 3
+    assert snapshot["connects"] == 1
+    assert snapshot["closes"] == 1
+    assert snapshot["checked_out"] == 0
+    assert sum(snapshot["wait_seconds"]["buckets"].values()) == 3
+
+
+def test_engine_options_pgbouncer_profile():
+    stats = PoolStats("test")
+    pool_mode = settings.DATABASE_POOL_MODE
+    settings.DATABASE_POOL_MODE = "pgbouncer"
+    try:
+        options = get_engine_options(
+            "postgresql+asyncpg://user:pw@pgbouncer/db", QueuePool, stats
+        )
+    finally:
+        settings.DATABASE_POOL_MODE = pool_mode
+
+    assert issubclass(options["poolclass"], NullPool)
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert "pool_size" not in options
+
+
+def test_engine_options_default_profile():
+    options = get_engine_options(
+        "postgresql://user:pw@db/db", QueuePool, PoolStats("test")
+    )
+
+    assert issubclass(options["poolclass"], QueuePool)
+    assert options["pool_size"] == settings.DATABASE_POOL_SIZE
+    assert options["pool_pre_ping"] == settings.DATABASE_POOL_PRE_PING
+
+
+@pytest.mark.anyio
+async def test_open_pool_connections(tmp_path):
+    stats = PoolStats("test")
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=instrumented_pool_class(AsyncAdaptedQueuePool, stats),
+        pool_size=3,
+    )
+    track_pool_stats(engine.sync_engine, stats)
+
+    assert await open_pool_connections(engine, 3) == 3
+    # Kept open in the pool, for the first requests
+    assert stats.snapshot()["connects"] == 3
+    assert engine.pool.checkedin() == 3
+    await engine.dispose()
+
+    # Nothing to keep without a pool: a single connection checks the database
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", poolclass=NullPool
+    )
+    assert await open_pool_connections(engine, 3) == 1
+    await engine.dispose()
@@ -0,0 +1,17 @@
+from sqlalchemy import create_engine, text
+
+from backend.db.query_counter import count_queries
+
+
+def test_count_queries():
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        with count_queries(engine) as counter:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        # Statements after the block aren't recorded
+        connection.execute(text("SELECT 3"))
+
+    assert counter.count == 2
+    assert counter.statements == ["SELECT 1", "SELECT 2"]
+    assert str(counter) == "1. SELECT 1\n2. SELECT 2"
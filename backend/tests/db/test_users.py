@@ -1,5 +1,10 @@
+import asyncio
+
+import pytest
 from mock import patch
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.core.configs import settings
 from backend.core.hashing import Hasher
@@ -7,8 +12,11 @@ from backend.db.models.users import Users
 from backend.db.repository.users import (
     authenticate,
     create_new_user,
+    delete_user_by_id,
+    get_user_by_email,
     get_user_by_id,
     is_active,
+    select_user_by_email,
     update_user_by_id,
 )
 from backend.schemas.users import UserCreate, UserUpdate
@@ -19,88 +27,159 @@ from backend.tests.utils.users import (
 )
 from backend.tests.utils.utils import random_email, random_lower_string
 
+pytestmark = pytest.mark.anyio
+
 
-def test_create_user(db: Session) -> None:
+async def test_create_user(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = create_new_user(user=user_in, db=db)
+    user = await create_new_user(user=user_in, db=db)
     assert user.email == email
     assert hasattr(user, "hashed_password")
 
 
-def test_authenticate_user(db: Session) -> None:
+async def test_create_user_duplicate_email(db: AsyncSession) -> None:
+    user_in = UserCreate(email=random_email(), password=random_lower_string())
+    user = await create_new_user(user=user_in, db=db)
+    assert user.id
+    assert user.is_active is True
+
+    assert await create_new_user(user=user_in, db=db) is None
+    # The session is still usable after the conflict
+    assert (await get_user_by_id(user_id=user.id, db=db)).email == user_in.email
+
+
+async def test_create_user_concurrently(db: AsyncSession) -> None:
+    user_in = UserCreate(email=random_email(), password=random_lower_string())
+
+    async def register():
+        async with AsyncSession(db.bind, expire_on_commit=False) as session:
+            return await create_new_user(user=user_in, db=session)
+
+    users = await asyncio.gather(register(), register())
+    assert sorted(user is None for user in users) == [False, True]
+
+
+async def test_email_is_case_insensitive(db: AsyncSession) -> None:
+    email = random_email()
+    user_in = UserCreate(email=email.upper(), password=random_lower_string())
+    assert user_in.email == email
+
+    user = await create_new_user(user=user_in, db=db)
+    assert (await get_user_by_email(email=email.upper(), db=db)).id == user.id
+    # The unique index rejects the same email with another case
+    query = insert(Users).values(email=email.title(), hashed_password="hash")
+    with pytest.raises(IntegrityError):
+        await db.execute(query)
+    await db.rollback()
+
+
+async def test_get_user_by_email_uses_index(db: AsyncSession) -> None:
+    query = select_user_by_email(random_email()).compile(
+        dialect=db.bind.dialect, compile_kwargs={"literal_binds": True}
+    )
+    if db.bind.dialect.name == "sqlite":
+        result = await db.execute(text(f"EXPLAIN QUERY PLAN {query}"))
+        plan = " ".join(row[-1] for row in result.all())
+    else:
+        # The table is small, the planner would rather scan it otherwise
+        await db.execute(text("SET enable_seqscan = off"))
+        result = await db.execute(text(f"EXPLAIN {query}"))
+        plan = " ".join(row[0] for row in result.all())
+        await db.execute(text("RESET enable_seqscan"))
+
+    assert "ix_users_email_lower" in plan
+    assert "Seq Scan" not in plan
+
+
+async def test_authenticate_user(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = create_new_user(user=user_in, db=db)
-    authenticated_user = authenticate(email=email, password=password, db=db)
+    user = await create_new_user(user=user_in, db=db)
+    authenticated_user = await authenticate(email=email, password=password, db=db)
     assert authenticated_user
     assert user.email == authenticated_user.email
 
 
-def test_not_authenticate_user(db: Session) -> None:
+async def test_not_authenticate_user(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
-    user = authenticate(email=email, password=password, db=db)
+    user = await authenticate(email=email, password=password, db=db)
     assert user is None
 
 
-def test_check_if_user_is_active(db: Session) -> None:
+async def test_check_if_user_is_active(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = create_new_user(user=user_in, db=db)
+    user = await create_new_user(user=user_in, db=db)
     activate_user = is_active(user)
     assert activate_user is True
 
 
-def test_check_if_user_is_active_inactive(db: Session) -> None:
+async def test_check_if_user_is_active_inactive(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password, disabled=True)
-    user = create_new_user(user=user_in, db=db)
+    user = await create_new_user(user=user_in, db=db)
 
     activate_user = is_active(user)
     assert activate_user
 
 
-def test_user_isnt_automatically_verified(db: Session) -> None:
+async def test_user_isnt_automatically_verified(db: AsyncSession) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = create_new_user(user=user_in, db=db)
+    user = await create_new_user(user=user_in, db=db)
 
     assert user.is_verified is False
 
 
-def test_update_user(db: Session) -> None:
+async def test_update_user(db: AsyncSession) -> None:
     password = random_lower_string()
     email = random_email()
     user_in = UserCreate(email=email, password=password)
-    user = create_new_user(user=user_in, db=db)
+    user = await create_new_user(user=user_in, db=db)
     assert user.id
 
     new_password = random_lower_string()
     user_up = UserUpdate(password=new_password)
-    update_user_by_id(user_id=user.id, user=user_up, db=db)
+    await update_user_by_id(user_id=user.id, user=user_up, db=db)
 
-    user_2 = get_user_by_id(user_id=user.id, db=db)
+    user_2 = await get_user_by_id(user_id=user.id, db=db)
 
     assert user_2
     assert user.email == user_2.email
     assert Hasher.verify_password(new_password, user_2.hashed_password)
 
 
-def test_create_random_user(db: Session):
-    random_user = create_random_user(db=db)
+async def test_update_unknown_user(db: AsyncSession) -> None:
+    user_up = UserUpdate(is_verified=True)
+    assert await update_user_by_id(user_id=2**31 - 1, user=user_up, db=db) is None
+
+
+async def test_delete_user(db: AsyncSession) -> None:
+    user = await create_random_user(db=db)
+
+    assert await delete_user_by_id(user_id=user.id, db=db)
+    assert await get_user_by_id(user_id=user.id, db=db) is None
+    assert not await delete_user_by_id(user_id=user.id, db=db)
+
+
+async def test_create_random_user(db: AsyncSession):
+    random_user = await create_random_user(db=db)
     assert isinstance(random_user, Users)
 
 
-def test_authentication_token_from_email(client, db):
-    user = create_random_user(db=db)
+async def test_authentication_token_from_email(client, db):
+    user = await create_random_user(db=db)
 
-    user_token = authentication_token_from_email(client=client, db=db, email=user.email)
+    user_token = await authentication_token_from_email(
+        client=client, db=db, email=user.email
+    )
     assert user_token.get("Authorization")
 
 
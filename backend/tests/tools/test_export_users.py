@@ -0,0 +1,39 @@
+import csv
+import io
+
+import pytest
+
+from backend.db.repository.users import create_new_user, update_user_by_id
+from backend.schemas.users import UserCreate, UserExportFilters, UserUpdate
+from backend.tests.utils.utils import random_email, random_lower_string
+from backend.tools.export_users import export_users
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_export_users_csv(db):
+    user = await create_new_user(
+        user=UserCreate(email=random_email(), password=random_lower_string()), db=db
+    )
+    await update_user_by_id(
+        user_id=user.id, user=UserUpdate(is_active=False, is_verified=False), db=db
+    )
+
+    output = io.BytesIO()
+    report = export_users(
+        output,
+        columns=["id", "email"],
+        filters=UserExportFilters(is_active=False),
+        batch_size=2,
+    )
+
+    rows = list(csv.reader(io.StringIO(output.getvalue().decode())))
+    assert rows[0] == ["id", "email"]
+    assert [str(user.id), user.email] in rows[1:]
+    assert report["rows"] == len(rows) - 1
+    assert report["rows_per_second"] > 0
+
+
+def test_export_users_unknown_column():
+    with pytest.raises(ValueError):
+        export_users(io.BytesIO(), columns=["email", "hashed_password"])
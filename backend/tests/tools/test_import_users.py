@@ -0,0 +1,79 @@
+import csv
+import json
+
+import pytest
+
+from backend.core.hashing import Hasher
+from backend.db.repository.users import create_new_user, get_user_by_email
+from backend.schemas.users import UserCreate
+from backend.tests.utils.utils import random_email, random_lower_string
+from backend.tools.import_users import import_users, write_checkpoint
+
+pytestmark = pytest.mark.anyio
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(
+            file, fieldnames=["email", "password", "hashed_password", "is_verified"]
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+async def test_import_users_csv(db, tmp_path):
+    existing_user = UserCreate(email=random_email(), password=random_lower_string())
+    await create_new_user(user=existing_user, db=db)
+
+    password = random_lower_string()
+    hashed_password = Hasher.get_password_hash(random_lower_string())
+    emails = [random_email() for _ in range(2)]
+    path = tmp_path / "users.csv"
+    write_csv(
+        path,
+        [
+            {"email": emails[0], "password": password},
+            {"email": emails[1], "hashed_password": hashed_password, "is_verified": 1},
+            {"email": "not-an-email", "password": password},
+            {"email": emails[0], "password": random_lower_string()},
+            {"email": existing_user.email, "password": password},
+            {"email": random_email()},
+            # md5 crypt, not verified by the application
+            {
+                "email": random_email(),
+                "hashed_password": "$1$salt$qJH7.N4xYta3aEG/dfqo/0",
+            },
+        ],
+    )
+
+    report = import_users(str(path), chunk_size=2, workers=0)
+
+    assert report["rows"] == 7
+    assert report["imported"] == 2
+    assert report["duplicates"] == 2
+    assert report["invalid"] == 3
+    assert report["rows_per_second"] > 0
+    assert not (tmp_path / "users.csv.checkpoint").exists()
+
+    user = await get_user_by_email(email=emails[0], db=db)
+    assert Hasher.verify_password(password, user.hashed_password)
+    assert user.is_active is True
+    user = await get_user_by_email(email=emails[1], db=db)
+    assert user.hashed_password == hashed_password
+    assert user.is_verified is True
+
+
+async def test_import_users_resume_from_checkpoint(db, tmp_path):
+    emails = [random_email() for _ in range(3)]
+    path = tmp_path / "users.jsonl"
+    with open(path, "w") as file:
+        for email in emails:
+            file.write(json.dumps({"email": email, "password": "secret"}) + "\n")
+    write_checkpoint(f"{path}.checkpoint", rows=2)
+
+    report = import_users(str(path), workers=0)
+
+    assert report["rows"] == 1
+    assert report["imported"] == 1
+    assert not await get_user_by_email(email=emails[0], db=db)
+    assert await get_user_by_email(email=emails[2], db=db)
@@ -0,0 +1,47 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.core.configs import settings
+from backend.core.keyring import Keyring, KeyringError
+from backend.tools.jwt_keys import rotate_keyring, write_keyring
+
+
+def test_rotate_keyring(tmp_path):
+    now = datetime(2022, 5, 1, tzinfo=timezone.utc)
+    # The first key signs right away
+    config = rotate_keyring({"keys": []}, algorithm="ES256", now=now)
+    (first,) = config["keys"]
+    assert first["kid"] == "20220501000000"
+    assert first["not_before"] == now.isoformat()
+
+    rotated_at = now + timedelta(days=30)
+    config = rotate_keyring(
+        config,
+        algorithm="HS256",
+        activate_in=timedelta(minutes=5),
+        kid="second",
+        now=rotated_at,
+    )
+    first, second = config["keys"]
+    activation = rotated_at + timedelta(minutes=5)
+    assert second["kid"] == "second" and second["alg"] == "HS256"
+    assert second["not_before"] == activation.isoformat()
+    # The previous key verifies the tokens it signed until they expire
+    lifetime = timedelta(minutes=settings.JWT_REFRESH_TOKEN_EXPIRE_MINUTES)
+    assert first["expires"] == (activation + lifetime).isoformat()
+
+    with pytest.raises(KeyringError):
+        rotate_keyring(config, kid="second", now=rotated_at)
+
+    # Expired keys are removed
+    config = rotate_keyring(config, now=activation + timedelta(days=365))
+    assert [entry["kid"] for entry in config["keys"]][0] == "second"
+    assert len(config["keys"]) == 2
+
+    path = tmp_path / "keys.json"
+    write_keyring(str(path), config)
+    assert json.loads(path.read_text()) == config
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert Keyring.from_file(str(path)).signing_key().kid == config["keys"][-1]["kid"]
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from backend.tools.loadtest import ENDPOINTS, compare, percentile, run_load_test
+
+pytestmark = pytest.mark.anyio
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+async def test_run_load_test_in_process():
+    results = await run_load_test(users=3, concurrency=2, gets_per_user=2)
+
+    assert results["config"]["target"] == "in-process"
+    endpoints = results["endpoints"]
+    assert set(endpoints) == set(ENDPOINTS)
+    for endpoint, stats in endpoints.items():
+        assert stats["errors"] == 0, (endpoint, stats["status_codes"])
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+    assert endpoints["get"]["requests"] == 6
+    # Results are saved as JSON, to compare runs
+    assert compare(json.loads(json.dumps(results)), results)
@@ -4,11 +4,12 @@ from jose import jwt
 from mock import patch
 
 from backend.api.utils import (
+    build_verification_email,
     create_token,
-    generate_code_verification_token,
     generate_random_code,
     send_email,
     send_verification_email,
+    verification_of,
 )
 from backend.core.configs import settings
 from backend.core.security import decode_jwt
@@ -33,15 +34,6 @@ def test_create_token_with_fastapi_response():
     assert isinstance(result.access_token, str)
 
 
-def test_generate_code_verification_token():
-    code = generate_random_code()
-    email = random_email()
-    result = generate_code_verification_token(code=code, email=email)
-
-    assert isinstance(result, str)
-    assert len(result.split(".")) == 3  # JWT token format
-
-
 @patch("emails.Message")
 def test_send_mail_emails_not_enabled(mock_sendmail):
     """
@@ -144,76 +136,22 @@ def test_send_verification_email(mock_sendmail):
 
     assert instance.send.called
     assert instance.send.call_count == 1
-    # Return a JWT
+    # Return the activation link
     assert isinstance(result, str)
-    assert len(result.split(".")) == 3
+    assert f"{settings.API_V1_STR}/users/verify/" in result
 
 
-@patch("emails.Message")
-def test_check_verify_code_token(mock_sendmail):
-    """
-    In this test, we will send a verification email which a JWT,
-    and then, used the function check_verify_mode_token to ensure that
-    the given token is equal to the verify code
-    """
-
-    settings.EMAILS_ENABLED = True
-    settings.SMTP_HOST = "localhost"
-    settings.SMTP_USERNAME = "testuser"
-    settings.SMTP_PASSWORD = "TestUserp_W"
-
-    assert settings.EMAILS_ENABLED
-
+def test_build_verification_email():
     verif_code = generate_random_code()
-    email = random_email()
-
-    result_link = send_verification_email(email_to=email, verification_code=verif_code)
-    instance = mock_sendmail.return_value
-
-    assert instance.send.called
-    assert isinstance(result_link, str)
-
-    token_from_link = get_token_from_link(result_link)
-    assert len(token_from_link.split(".")) == 3
-
-    token_data = decode_jwt(token_from_link)
-
-    assert token_data.get("sub") == verif_code
-
-
-@pytest.mark.skip
-@patch("emails.Message")
-def test_check_verify_code_token_expired(mock_sendmail):  # FIXME
-
-    settings.EMAILS_ENABLED = True
-    settings.SMTP_HOST = "localhost"
-    settings.SMTP_USERNAME = "testuser"
-    settings.SMTP_PASSWORD = "TestUserp_W"
-    settings.JWT_EMAIL_TOKEN_EXPIRE_MINUTES = 0.1
-
-    assert settings.EMAILS_ENABLED
-
-    verif_code = generate_random_code()
-    email = random_email()
-
-    result_link = send_verification_email(email_to=email, verification_code=verif_code)
-    instance = mock_sendmail.return_value
-
-    assert instance.send.called
-    assert isinstance(result_link, str)
-
-    # Check raises and exception when sending the message
-
-    instance = mock_sendmail.return_value
-    instance.send.side_effect = jwt.JWTError({})
-
-    token_from_link = get_token_from_link(result_link)
-    assert len(token_from_link.split(".")) == 3
-
-    with pytest.raises(jwt.JWTError) as errmsg:
-        decode_jwt(token_from_link)
+    email = build_verification_email(
+        email_to=random_email(), verification_code=verif_code
+    )
 
-    assert "Signature has expired" in str(errmsg.value)
+    # The link only holds an opaque id, the code is in the email
+    verification_id = get_token_from_link(email.environment["link"])
+    assert verification_id == email.environment["verification_id"]
+    assert verif_code not in email.environment["link"]
+    assert verification_of(email, user_id=7) == (verification_id, 7, verif_code)
 
 
 @patch("emails.Message")
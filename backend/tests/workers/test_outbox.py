@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+from mock import patch
+
+from backend.api.utils import build_verification_email, generate_random_code
+from backend.core.configs import settings
+from backend.db.models.outbox import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT
+from backend.db.repository.outbox import get_email_by_id, mark_email_failed
+from backend.db.repository.users import create_new_user
+from backend.db.session import SessionLocal
+from backend.schemas.users import UserCreate
+from backend.tests.utils.utils import random_email, random_lower_string
+from backend.workers.outbox import process_batch
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_user_with_verification_email(db) -> int:
+    user_in = UserCreate(email=random_email(), password=random_lower_string())
+    email = build_verification_email(
+        email_to=user_in.email, verification_code=generate_random_code()
+    )
+    await create_new_user(user=user_in, db=db, emails=[email])
+    return email.id
+
+
+@patch("emails.Message")
+async def test_outbox_worker_sends_emails(mock_sendmail, db):
+    settings.EMAILS_ENABLED = True
+    settings.SMTP_HOST = "localhost"
+
+    instance = mock_sendmail.return_value
+    instance.send.return_value.status_code = 250
+
+    email_id = await create_user_with_verification_email(db)
+
+    with SessionLocal() as sync_db:
+        assert process_batch(db=sync_db, batch_size=1000) >= 1
+        email = get_email_by_id(email_id=email_id, db=sync_db)
+
+        assert email.status == OUTBOX_SENT
+        assert email.attempts == 1
+        assert email.sent_at
+
+        # Sent emails are not claimed again
+        instance.send.reset_mock()
+        process_batch(db=sync_db, batch_size=1000)
+        assert not instance.send.called
+
+
+@patch("emails.Message")
+async def test_outbox_worker_retries_failed_emails(mock_sendmail, db):
+    settings.EMAILS_ENABLED = True
+    settings.SMTP_HOST = "localhost"
+
+    instance = mock_sendmail.return_value
+    instance.send.return_value.status_code = None
+    instance.send.return_value.error = "Connection refused"
+
+    email_id = await create_user_with_verification_email(db)
+
+    with SessionLocal() as sync_db:
+        process_batch(db=sync_db, batch_size=1000)
+        email = get_email_by_id(email_id=email_id, db=sync_db)
+
+        assert email.status == OUTBOX_PENDING
+        assert email.attempts == 1
+        assert "Connection refused" in email.last_error
+        assert email.next_attempt_at > datetime.utcnow()
+
+
+def test_outbox_retry_backoff():
+    email = build_verification_email(
+        email_to=random_email(), verification_code=generate_random_code()
+    )
+    email.attempts = 0
+
+    mark_email_failed(email, error="timeout", max_attempts=3, retry_delay=10)
+    first_delay = email.next_attempt_at - datetime.utcnow()
+    mark_email_failed(email, error="timeout", max_attempts=3, retry_delay=10)
+    second_delay = email.next_attempt_at - datetime.utcnow()
+
+    assert 0 < first_delay.total_seconds() <= 10
+    assert 10 < second_delay.total_seconds() <= 20
+    assert email.status != OUTBOX_FAILED
+
+    mark_email_failed(email, error="timeout", max_attempts=3, retry_delay=10)
+    assert email.status == OUTBOX_FAILED
+    assert email.attempts == 3
@@ -0,0 +1,141 @@
+"""
+Users export: dump the users table as a CSV or NDJSON file, optionally gzipped.
+
+    python -m backend.tools.export_users users.csv.gz [--format csv|ndjson]
+        [--columns id,email] [--is-active true] [--is-verified false]
+        [--validated-after 2022-01-01] [--validated-before 2022-02-01]
+
+Rows are read from a server-side cursor by batches of --batch-size rows, so the
+memory used doesn't depend on the number of exported users. Use '-' as output
+to write to the standard output.
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Optional, Sequence
+
+from sqlalchemy.engine import Engine
+
+from backend.core.configs import settings
+from backend.core.exports import EXPORT_FORMATS, ExportEncoder
+from backend.db.repository.users import EXPORT_COLUMNS, select_users_export
+from backend.db.session import engine as default_engine
+from backend.schemas.users import UserExportFilters
+
+logger = logging.getLogger(__name__)
+
+
+def export_users(
+    output: BinaryIO,
+    columns: Sequence[str] = EXPORT_COLUMNS,
+    file_format: str = "csv",
+    compress: bool = False,
+    filters: Optional[UserExportFilters] = None,
+    batch_size: int = settings.USERS_EXPORT_BATCH_SIZE,
+    engine: Engine = default_engine,
+) -> Dict[str, Any]:
+    """Write the users matching the filters to a binary file
+
+    Args:
+        output (BinaryIO): file to write to
+        columns (Sequence[str]): exported columns, among EXPORT_COLUMNS
+        file_format (str): 'csv' or 'ndjson'
+        compress (bool): gzip the output
+        filters (UserExportFilters, optional): exported users, all by default
+        batch_size (int): rows fetched per round trip
+        engine (Engine): database to export from
+
+    Returns:
+        Dict[str, Any]: exported rows and throughput
+    """
+    unknown_columns = set(columns) - set(EXPORT_COLUMNS)
+    if unknown_columns:
+        raise ValueError(f"Unknown columns {sorted(unknown_columns)}")
+
+    encoder = ExportEncoder(columns, file_format=file_format, compress=compress)
+    query = select_users_export(columns=columns, filters=filters or UserExportFilters())
+
+    start = time.perf_counter()
+    output.write(encoder.header())
+    with engine.connect() as connection:
+        # A named cursor with psycopg2: rows are fetched batch_size at a time
+        result = connection.execution_options(stream_results=True).execute(query)
+        for rows in result.partitions(batch_size):
+            output.write(encoder.encode(rows))
+    output.write(encoder.finish())
+
+    seconds = time.perf_counter() - start
+    return {
+        "rows": encoder.rows,
+        "seconds": seconds,
+        "rows_per_second": encoder.rows / seconds,
+    }
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() not in ("true", "false", "1", "0"):
+        raise argparse.ArgumentTypeError(f"'{value}' isn't a boolean")
+    return value.lower() in ("true", "1")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export users to a CSV/NDJSON file")
+    parser.add_argument("output", help="Output file, '-' for the standard output")
+    parser.add_argument(
+        "--format", choices=EXPORT_FORMATS, dest="file_format", default=None
+    )
+    parser.add_argument(
+        "--columns",
+        default=",".join(EXPORT_COLUMNS),
+        help=f"Comma separated columns among: {', '.join(EXPORT_COLUMNS)}",
+    )
+    parser.add_argument("--gzip", action="store_true", help="Default for .gz files")
+    parser.add_argument("--is-active", type=parse_bool)
+    parser.add_argument("--is-verified", type=parse_bool)
+    parser.add_argument(
+        "--validated-after", type=datetime.fromisoformat, help="ISO date or datetime"
+    )
+    parser.add_argument(
+        "--validated-before", type=datetime.fromisoformat, help="ISO date or datetime"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.USERS_EXPORT_BATCH_SIZE
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    name = args.output[:-3] if args.output.endswith(".gz") else args.output
+    file_format = args.file_format or (
+        "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+    )
+    filters = UserExportFilters(
+        is_active=args.is_active,
+        is_verified=args.is_verified,
+        validated_after=args.validated_after,
+        validated_before=args.validated_before,
+    )
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        report = export_users(
+            output,
+            columns=args.columns.split(","),
+            file_format=file_format,
+            compress=args.gzip or args.output.endswith(".gz"),
+            filters=filters,
+            batch_size=args.batch_size,
+        )
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+    logger.info(
+        f"{report['rows']} users exported in {report['seconds']:.1f}s "
+        f"({report['rows_per_second']:.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
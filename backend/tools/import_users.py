@@ -0,0 +1,290 @@
+"""
+Users import: load users of a legacy system from a CSV or a JSONL file.
+
+    python -m backend.tools.import_users users.csv [--format csv|jsonl]
+        [--chunk-size 10000] [--workers 4] [--checkpoint users.csv.checkpoint]
+
+Each row has an 'email' and either a plain 'password' (hashed by the import) or a
+'hashed_password' (bcrypt), plus optional 'is_active' and 'is_verified' flags.
+
+The file is read as a stream, by chunks: each chunk is validated, hashed, loaded
+into a staging table (COPY on PostgreSQL) and merged into the users table in its
+own transaction. Emails which already exist are skipped, so a chunk can be
+imported twice. After each chunk, the number of rows read is saved to the
+checkpoint file: an interrupted import resumes after the last merged chunk.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import Boolean, Column, MetaData, String, Table, func, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+from backend.core.configs import settings
+from backend.core.hashing import hash_passwords
+from backend.db.models.users import Users
+from backend.db.session import engine as default_engine
+from backend.schemas.users import UserImport
+
+logger = logging.getLogger(__name__)
+
+STAGING_COLUMNS = ("email", "hashed_password", "is_active", "is_verified")
+
+# Session scoped table, one per import process
+staging_table = Table(
+    "users_import",
+    MetaData(),
+    Column("email", String, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("is_active", Boolean, nullable=False),
+    Column("is_verified", Boolean, nullable=False),
+    prefixes=["TEMPORARY"],
+)
+
+
+def guess_format(path: str) -> str:
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_rows(path: str, file_format: str, skip: int = 0) -> Iterator[Dict[str, Any]]:
+    """Read the rows of a CSV (with a header) or JSONL file one at a time
+
+    Args:
+        path (str): file to import
+        file_format (str): 'csv' or 'jsonl'
+        skip (int): number of rows to skip, already imported
+
+    Yields:
+        Dict[str, Any]: row data
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        yield from islice(rows, skip, None)
+
+
+def read_checkpoint(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as file:
+        return json.load(file)["rows"]
+
+
+def write_checkpoint(path: str, rows: int) -> None:
+    # Write then rename, so a crash never leaves a truncated checkpoint
+    with open(f"{path}.tmp", "w") as file:
+        json.dump({"rows": rows}, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def validate_rows(rows: List[Dict[str, Any]], first_row: int) -> List[UserImport]:
+    users = []
+    for number, row in enumerate(rows, start=first_row):
+        # Empty CSV cells mean "not given"
+        row = {key: value for key, value in row.items() if value not in ("", None)}
+        try:
+            users.append(UserImport.parse_obj(row))
+        except ValidationError as exc:
+            logger.warning(f"Row {number} skipped: {exc.errors()}")
+    return users
+
+
+def hash_users(
+    users: List[UserImport], executor: Optional[Executor], workers: int
+) -> List[Dict[str, Any]]:
+    """Build the staging rows, hashing the plain passwords on all the workers"""
+    to_hash = [user for user in users if not user.hashed_password]
+    passwords = [user.password for user in to_hash]
+    if executor and passwords:
+        size = -(-len(passwords) // workers)
+        chunks = [
+            passwords[start : start + size] for start in range(0, len(passwords), size)
+        ]
+        hashed_passwords = [
+            hashed for chunk in executor.map(hash_passwords, chunks) for hashed in chunk
+        ]
+    else:
+        hashed_passwords = hash_passwords(passwords)
+    for user, hashed_password in zip(to_hash, hashed_passwords):
+        user.hashed_password = hashed_password
+
+    return [
+        {
+            "email": user.email,
+            "hashed_password": user.hashed_password,
+            "is_active": user.is_active,
+            "is_verified": user.is_verified,
+        }
+        for user in users
+    ]
+
+
+def copy_rows(connection: Connection, rows: List[Dict[str, Any]]) -> None:
+    """Load rows into the staging table, with COPY on PostgreSQL"""
+    if connection.dialect.name != "postgresql":
+        connection.execute(staging_table.insert(), rows)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in STAGING_COLUMNS])
+    buffer.seek(0)
+
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {staging_table.name} ({', '.join(STAGING_COLUMNS)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def merge_staging(connection: Connection) -> int:
+    """Insert the staged users whose email is new, return their number"""
+    insert = sqlite.insert if connection.dialect.name == "sqlite" else postgresql.insert
+    query = (
+        insert(Users)
+        .from_select(
+            list(STAGING_COLUMNS),
+            # SQLite can't tell ON CONFLICT from a join clause without a WHERE
+            select(*(staging_table.c[column] for column in STAGING_COLUMNS)).where(
+                true()
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=[func.lower(Users.email)])
+    )
+    return connection.execute(query).rowcount
+
+
+def import_chunk(connection: Connection, rows: List[Dict[str, Any]]) -> int:
+    with connection.begin():
+        connection.execute(staging_table.delete())
+        copy_rows(connection, rows)
+        return merge_staging(connection)
+
+
+def import_users(
+    path: str,
+    file_format: Optional[str] = None,
+    chunk_size: int = settings.IMPORT_CHUNK_SIZE,
+    workers: int = settings.HASHING_POOL_SIZE,
+    checkpoint: Optional[str] = None,
+    engine: Engine = default_engine,
+) -> Dict[str, Any]:
+    """Import the users of a file, resuming from its checkpoint if any
+
+    Args:
+        path (str): CSV or JSONL file to import
+        file_format (str, optional): 'csv' or 'jsonl', guessed from the extension
+        chunk_size (int): rows loaded and merged per transaction
+        workers (int): processes hashing the plain passwords, 0 to hash inline
+        checkpoint (str, optional): checkpoint file, '<path>.checkpoint' by default
+        engine (Engine): database to import into
+
+    Returns:
+        Dict[str, Any]: rows read, imported users, skipped rows and throughput
+    """
+    file_format = file_format or guess_format(path)
+    checkpoint = checkpoint or f"{path}.checkpoint"
+    skipped_rows = read_checkpoint(checkpoint)
+    if skipped_rows:
+        logger.info(f"Resuming after row {skipped_rows}")
+
+    report = {"rows": 0, "imported": 0, "invalid": 0, "duplicates": 0}
+    rows = read_rows(path, file_format, skip=skipped_rows)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    start = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            with connection.begin():
+                staging_table.create(connection, checkfirst=True)
+
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                first_row = skipped_rows + report["rows"] + 1
+                users = validate_rows(chunk, first_row=first_row)
+
+                # Keep the first occurrence of an email, COPY has no ON CONFLICT
+                unique_users: Dict[str, UserImport] = {}
+                for user in users:
+                    unique_users.setdefault(user.email, user)
+                imported = 0
+                if unique_users:
+                    staged_rows = hash_users(
+                        list(unique_users.values()), executor, workers
+                    )
+                    imported = import_chunk(connection, staged_rows)
+
+                report["rows"] += len(chunk)
+                report["imported"] += imported
+                report["invalid"] += len(chunk) - len(users)
+                report["duplicates"] += len(users) - imported
+                write_checkpoint(checkpoint, skipped_rows + report["rows"])
+
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"{skipped_rows + report['rows']} rows read, "
+                    f"{report['imported']} users imported "
+                    f"({report['rows'] / elapsed:.0f} rows/s)"
+                )
+
+            # The connection goes back to the pool
+            with connection.begin():
+                staging_table.drop(connection)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    # Done: a new import of the same file starts from the beginning
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    report["seconds"] = time.perf_counter() - start
+    report["rows_per_second"] = report["rows"] / report["seconds"]
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import users from a CSV/JSONL file")
+    parser.add_argument("path", help="CSV (with a header) or JSONL file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], dest="file_format")
+    parser.add_argument("--chunk-size", type=int, default=settings.IMPORT_CHUNK_SIZE)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.HASHING_POOL_SIZE,
+        help="Processes hashing the plain passwords, 0 to hash inline",
+    )
+    parser.add_argument("--checkpoint", help="Default: <path>.checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = import_users(
+        args.path,
+        file_format=args.file_format,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        checkpoint=args.checkpoint,
+    )
+    logger.info(
+        f"{report['rows']} rows read in {report['seconds']:.1f}s "
+        f"({report['rows_per_second']:.0f} rows/s): {report['imported']} imported, "
+        f"{report['duplicates']} duplicates, {report['invalid']} invalid"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+JWT keys rotation: add a signing key to a keyring file and retire the previous ones.
+
+    python -m backend.tools.jwt_keys keys.json [--algorithm ES256]
+        [--activate-in-minutes 5] [--kid 2022-05]
+
+The new key signs once its 'not_before' (now + --activate-in-minutes) is past:
+the workers reload the file every JWT_KEYS_RELOAD_SECONDS, so they all accept
+its tokens before any of them signs with it. The previous keys expire when the
+last tokens they signed expire, JWT_REFRESH_TOKEN_EXPIRE_MINUTES after that,
+and expired keys are removed from the file. A new keyring file gets a key
+active right away.
+
+With an asymmetric algorithm (ES256, RS256...), other services verify the tokens
+with the public keys of GET /api/v1/auth/jwks.json, without any secret.
+"""
+import argparse
+import json
+import logging
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose.constants import ALGORITHMS
+
+from backend.core.configs import settings
+from backend.core.keyring import (
+    SIGNING_ALGORITHMS,
+    KeyringError,
+    parse_keyring,
+    parse_time,
+)
+
+logger = logging.getLogger(__name__)
+
+EC_CURVES = {
+    ALGORITHMS.ES256: ec.SECP256R1,
+    ALGORITHMS.ES384: ec.SECP384R1,
+    ALGORITHMS.ES512: ec.SECP521R1,
+}
+RSA_KEY_SIZE = 2048
+
+
+def generate_key_data(algorithm: str) -> str:
+    """New secret (HMAC) or PEM private key (EC, RSA) for the algorithm"""
+    if algorithm in ALGORITHMS.HMAC:
+        return secrets.token_urlsafe(64)
+    if algorithm in EC_CURVES:
+        private_key = ec.generate_private_key(EC_CURVES[algorithm]())
+    elif algorithm in ALGORITHMS.RSA_DS:
+        private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=RSA_KEY_SIZE
+        )
+    else:
+        raise KeyringError(f"Unsupported algorithm '{algorithm}'")
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+def rotate_keyring(
+    config: Dict[str, Any],
+    algorithm: str = ALGORITHMS.ES256,
+    activate_in: timedelta = timedelta(minutes=5),
+    kid: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Keyring configuration with a new signing key, and the previous ones retired
+
+    Args:
+        config (Dict[str, Any]): keyring file content, {"keys": [...]}
+        algorithm (str): algorithm of the new key
+        activate_in (timedelta): delay before the new key signs, ignored for the
+            first key
+        kid (str, optional): id of the new key, its activation time by default
+        now (datetime, optional): current time, timezone aware
+
+    Returns:
+        Dict[str, Any]: new keyring file content
+    """
+    now = now or datetime.now(timezone.utc)
+    keys = [
+        entry
+        for entry in config.get("keys", [])
+        if entry.get("expires") is None
+        or parse_time(entry["expires"]) > now.timestamp()
+    ]
+    not_before = now + activate_in if keys else now
+    kid = kid or not_before.strftime("%Y%m%d%H%M%S")
+    if any(entry["kid"] == kid for entry in keys):
+        raise KeyringError(f"Key '{kid}' is already in the keyring")
+
+    # Tokens signed just before the rotation stay valid until they expire
+    expires = not_before + timedelta(minutes=settings.JWT_REFRESH_TOKEN_EXPIRE_MINUTES)
+    for entry in keys:
+        if entry.get("expires") is None:
+            entry["expires"] = expires.isoformat()
+
+    keys.append(
+        {
+            "kid": kid,
+            "alg": algorithm,
+            "key": generate_key_data(algorithm),
+            "not_before": not_before.isoformat(),
+        }
+    )
+    return {**config, "keys": keys}
+
+
+def write_keyring(path: str, config: Dict[str, Any]) -> None:
+    """Replace the keyring file at once: workers never read a partial file"""
+    # Checked before writing: the workers would keep their keys otherwise
+    parse_keyring(config, directory=os.path.dirname(os.path.abspath(path)))
+    tmp_path = f"{path}.tmp"
+    descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as file:
+        json.dump(config, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rotate the JWT signing keys")
+    parser.add_argument("path", help="Keyring file, created if missing")
+    parser.add_argument(
+        "--algorithm",
+        default=ALGORITHMS.ES256,
+        choices=sorted(SIGNING_ALGORITHMS),
+    )
+    parser.add_argument("--activate-in-minutes", type=float, default=5)
+    parser.add_argument(
+        "--kid", help="Id of the new key, its activation time by default"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = {"keys": []}
+    if os.path.exists(args.path):
+        with open(args.path) as file:
+            config = json.load(file)
+
+    config = rotate_keyring(
+        config,
+        algorithm=args.algorithm,
+        activate_in=timedelta(minutes=args.activate_in_minutes),
+        kid=args.kid,
+    )
+    write_keyring(args.path, config)
+    new_key = config["keys"][-1]
+    logger.info(
+        f"Key '{new_key['kid']}' ({new_key['alg']}) signs from "
+        f"{new_key['not_before']}, {len(config['keys'])} keys in {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
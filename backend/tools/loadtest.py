@@ -0,0 +1,283 @@
+"""
+Load test: replay user sessions against the API and measure each endpoint.
+
+    python -m backend.tools.loadtest [--url http://localhost:8000] [--users 200]
+        [--concurrency 20] [--gets-per-user 5] [--output results.json]
+        [--baseline previous.json]
+
+Each virtual user registers, logs in, verifies its email, refreshes its tokens,
+reads its profile a few times and deletes its account. Without --url, the
+application runs in this process (through ASGI, against DATABASE_URL, SQLite or
+PostgreSQL) with rate limiting off.
+Against a running server, rate limiting should be disabled and the server must
+share this process's verification store (same REDIS_URL): the virtual users save
+their own verification code there, instead of reading their email.
+
+Throughput and p50/p95/p99 latencies are reported per endpoint. --output saves
+them as JSON, and --baseline compares them with a previous run.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from backend.api.utils import generate_random_code
+from backend.core.configs import settings
+from backend.core.verification import new_verification_id, verification_store
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("register", "login", "verify", "refresh", "get", "delete")
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class LoadTestStats:
+    """Latency and status codes of the requests, by endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.status_codes: Dict[str, Dict[int, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def request(
+        self, endpoint: str, client: httpx.AsyncClient, method: str, url: str, **kwargs
+    ) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            logger.debug(f"{endpoint}: {exc}")
+            self.errors[endpoint] += 1
+            return None
+        finally:
+            self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+
+        self.status_codes[endpoint][response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+    def report(self, seconds: float) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for endpoint in ENDPOINTS:
+            latencies = sorted(self.latencies.get(endpoint, []))
+            if not latencies:
+                continue
+            report[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "throughput_rps": len(latencies) / seconds,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "max_ms": latencies[-1],
+                "status_codes": {
+                    str(code): count
+                    for code, count in sorted(self.status_codes[endpoint].items())
+                },
+            }
+        return report
+
+
+async def user_session(
+    client: httpx.AsyncClient, stats: LoadTestStats, gets_per_user: int
+) -> None:
+    """One virtual user: register, login, verify, read its profile and leave"""
+    api = settings.API_V1_STR
+    email = f"loadtest-{uuid.uuid4().hex}@example.com"
+    password = uuid.uuid4().hex
+
+    response = await stats.request(
+        "register",
+        client,
+        "POST",
+        f"{api}/users/register",
+        json={"email": email, "password": password},
+    )
+    if response is None or response.status_code != 200:
+        return
+    user_id = response.json()["id"]
+
+    response = await stats.request(
+        "login",
+        client,
+        "POST",
+        f"{api}/auth/access-token",
+        data={"username": email, "password": password},
+    )
+    if response is None or response.status_code != 200:
+        return
+    # Each user has its own session: the cookie is sent explicitly, the client
+    # (and its connections) being shared by all the users
+    cookies = {"access_token": response.cookies.get("access_token")}
+    refresh_token = response.json()["refresh_token"]
+
+    verification_id, code = new_verification_id(), generate_random_code(size=4)
+    await verification_store.save(verification_id, user_id, code)
+    await stats.request(
+        "verify",
+        client,
+        "POST",
+        f"{api}/users/verify/{verification_id}",
+        data={"code": code},
+    )
+
+    # The access token claims are updated (verified) with the refresh
+    response = await stats.request(
+        "refresh",
+        client,
+        "POST",
+        f"{api}/auth/refresh",
+        data={"refresh_token": refresh_token},
+    )
+    if response is None or response.status_code != 200:
+        return
+    cookies = {"access_token": response.cookies.get("access_token")}
+
+    for _ in range(gets_per_user):
+        await stats.request(
+            "get", client, "GET", f"{api}/users/get/{user_id}", cookies=cookies
+        )
+
+    await stats.request(
+        "delete", client, "DELETE", f"{api}/users/delete/{user_id}", cookies=cookies
+    )
+
+
+async def run_load_test(
+    url: Optional[str] = None,
+    users: int = 100,
+    concurrency: int = 10,
+    gets_per_user: int = 5,
+) -> Dict[str, Any]:
+    """Run the sessions of 'users' virtual users, 'concurrency' at a time
+
+    Args:
+        url (str, optional): base URL of a running server, in process by default
+        users (int): number of user sessions
+        concurrency (int): number of sessions running at the same time
+        gets_per_user (int): profile reads per session
+
+    Returns:
+        Dict[str, Any]: run configuration, duration and statistics by endpoint
+    """
+    app = None
+    if url is None:
+        # Imported here: a run against --url doesn't need the application
+        from backend.main import app
+
+        settings.RATE_LIMIT_ENABLED = False
+        await app.router.startup()
+
+    stats = LoadTestStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async def session(client: httpx.AsyncClient) -> None:
+        async with semaphore:
+            await user_session(client, stats, gets_per_user)
+
+    start = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(
+            app=app, base_url=url or "http://loadtest", limits=limits, timeout=60
+        ) as client:
+            await asyncio.gather(*(session(client) for _ in range(users)))
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+    seconds = time.perf_counter() - start
+
+    return {
+        "config": {
+            "target": url or "in-process",
+            "database": settings.DATABASE_URL.split(":", 1)[0],
+            "users": users,
+            "concurrency": concurrency,
+            "gets_per_user": gets_per_user,
+        },
+        "seconds": seconds,
+        "endpoints": stats.report(seconds),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Describe the changes of throughput and p95 latency since a baseline run"""
+    lines = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        throughput = relative_change(
+            previous["throughput_rps"], current["throughput_rps"]
+        )
+        p95 = relative_change(previous["p95_ms"], current["p95_ms"])
+        lines.append(f"{endpoint:<10} throughput {throughput}, p95 {p95}")
+    return lines
+
+
+def relative_change(previous: float, current: float) -> str:
+    if not previous:
+        return "n/a"
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the users API")
+    parser.add_argument("--url", help="Running server, in process by default")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--gets-per-user", type=int, default=5)
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    results = asyncio.run(
+        run_load_test(
+            url=args.url,
+            users=args.users,
+            concurrency=args.concurrency,
+            gets_per_user=args.gets_per_user,
+        )
+    )
+
+    print(f"{args.users} sessions in {results['seconds']:.1f}s")
+    print(
+        f"{'endpoint':<10} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for endpoint, stats in results["endpoints"].items():
+        print(
+            f"{endpoint:<10} {stats['requests']:>8} {stats['errors']:>6} "
+            f"{stats['throughput_rps']:>8.1f} {stats['p50_ms']:>8.1f} "
+            f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+        )
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            for line in compare(results, json.load(file)):
+                print(line)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Emails outbox worker: deliver the emails queued by the API.
+
+    python -m backend.workers.outbox [--batch-size 50] [--poll-interval 2] [--once]
+
+Several workers can run side by side, each one claims its own batch of rows.
+"""
+import argparse
+import logging
+import signal
+import time
+
+from sqlalchemy.orm import Session
+
+from backend.api.utils import send_outbox_email
+from backend.core.configs import settings
+from backend.core.email_templates import email_templates
+from backend.db.models.outbox import EmailOutbox
+from backend.db.repository.outbox import (
+    claim_pending_emails,
+    mark_email_failed,
+    mark_email_sent,
+)
+from backend.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class EmailDeliveryError(Exception):
+    """Raised when the SMTP server doesn't accept an email"""
+
+
+def deliver_email(email: EmailOutbox) -> None:
+    response = send_outbox_email(email)
+    # 'emails' reports SMTP errors in the response instead of raising them
+    if response is None or response.status_code != 250:
+        error = getattr(response, "error", None) or getattr(
+            response, "status_text", None
+        )
+        raise EmailDeliveryError(f"SMTP server refused the email: {error}")
+
+
+def process_batch(db: Session, batch_size: int = settings.OUTBOX_BATCH_SIZE) -> int:
+    """Deliver a batch of due emails and record their delivery status
+
+    Args:
+        db (Session): database session, the batch is committed at the end
+        batch_size (int): maximum number of emails to claim
+
+    Returns:
+        int: number of processed emails
+    """
+    emails = claim_pending_emails(db=db, batch_size=batch_size)
+    for email in emails:
+        try:
+            deliver_email(email)
+        except Exception as exc:
+            logger.warning(f"Failed to send email {email.id}: {exc}")
+            mark_email_failed(
+                email,
+                error=str(exc),
+                max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+                retry_delay=settings.OUTBOX_RETRY_DELAY_SECONDS,
+            )
+        else:
+            mark_email_sent(email)
+    db.commit()
+    return len(emails)
+
+
+def run(
+    batch_size: int = settings.OUTBOX_BATCH_SIZE,
+    poll_interval: float = settings.OUTBOX_POLL_INTERVAL_SECONDS,
+    once: bool = False,
+) -> None:
+    """Deliver emails until stopped (SIGINT/SIGTERM), or the outbox is empty"""
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        logger.info("Stopping after the current batch")
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    email_templates.load()
+
+    while running:
+        with SessionLocal() as db:
+            processed = process_batch(db=db, batch_size=batch_size)
+        if processed:
+            logger.info(f"{processed} email(s) processed")
+            continue
+        if once:
+            break
+        time.sleep(poll_interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Deliver the queued emails")
+    parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+    parser.add_argument(
+        "--poll-interval", type=float, default=settings.OUTBOX_POLL_INTERVAL_SECONDS
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="Stop when no email is left to send"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(batch_size=args.batch_size, poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()